@@ -0,0 +1,4 @@
+# Benchmarks of the psp_cz project. They are not part of the crawler and are
+# run directly, for example:
+#
+#     python -m benchmarks.bench_vote_ingest
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+Measures the vote matrix analyses of psp_cz.analytics on a synthetic matrix
+of parliament members x votings (200 x 50000 by default - several terms of
+votings).
+
+Usage:
+    python -m benchmarks.bench_analytics [--members N] [--votings N] [--groups N]
+
+The matrix is written to a temporary .npy file by VoteMatrix.append() in
+chunks of votings - the same way incremental updates extend it - and the
+analyses run on the memory mapped file.
+
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import numpy
+
+CHUNK_SIZE = 5000
+
+
+def synthetic_votes(members, votings, groups, seed=1):
+    """Returns members x votings matrix of vote codes and groups of members"""
+    from psp_cz.analytics import YES, NO, ABSTAIN, NOT_VOTED
+    from psp_cz.votes import VOTE_CODES
+
+    rnd = numpy.random.RandomState(seed)
+    member_groups = numpy.arange(members) % groups
+    # every group votes mostly along its line, members deviate occasionally
+    group_line = rnd.choice([YES, NO, ABSTAIN], size=(groups, votings))
+    matrix = group_line[member_groups].astype(numpy.int8)
+    deviate = rnd.random_sample((members, votings)) < 0.1
+    matrix[deviate] = rnd.choice([YES, NO, ABSTAIN, NOT_VOTED, VOTE_CODES[u'0'], VOTE_CODES[u'M']],
+                                 size=deviate.sum())
+    return matrix, member_groups
+
+
+def measure(name, func, *args):
+    start = time.time()
+    result = func(*args)
+    print '%-30s %8.3f s' % (name, time.time() - start)
+    return result
+
+
+def write_matrix(vote_matrix, matrix):
+    from psp_cz.votes import VOTES
+
+    parl_memb_ids = range(1, matrix.shape[0] + 1)
+    for start in xrange(0, matrix.shape[1], CHUNK_SIZE):
+        chunk = matrix[:, start:start + CHUNK_SIZE]
+        votings_votes = [dict((parl_memb_id, VOTES[code])
+                              for parl_memb_id, code in zip(parl_memb_ids, column) if code)
+                         for column in chunk.T]
+        vote_matrix.append(range(start + 1, start + chunk.shape[1] + 1), votings_votes)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--members', type='int', default=200)
+    parser.add_option('--votings', type='int', default=50000)
+    parser.add_option('--groups', type='int', default=6)
+    options, args = parser.parse_args()
+
+    from psp_cz import analytics
+
+    matrix, groups = synthetic_votes(options.members, options.votings, options.groups)
+    directory = tempfile.mkdtemp()
+    try:
+        vote_matrix = analytics.VoteMatrix(os.path.join(directory, 'votes.npy'))
+        measure('append (%d chunks)' % (-(-options.votings // CHUNK_SIZE)), write_matrix,
+                vote_matrix, matrix)
+        mapped = vote_matrix.load()
+        assert (mapped == matrix).all()
+        print 'Matrix %d x %d, %d bytes' % (mapped.shape + (os.path.getsize(vote_matrix.path),))
+
+        measure('agreement', analytics.agreement, mapped)
+        measure('rice_cohesion', analytics.rice_cohesion, mapped, groups)
+        measure('attendance', analytics.attendance, mapped)
+        measure('against_own_group', analytics.against_own_group, mapped, groups)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+Measures how parsing of voting list and voting result pages scales with the
+number of worker processes of ParsePool (see psp_cz.parse_pool).
+
+Usage:
+    python -m benchmarks.bench_parse_pool [--workers 0,1,2,4] [--repeat N]
+        [--sittings N] [--votings N] [ARCHIVE ...]
+
+Pages are taken from response archives of the psp.cz spider (archive files
+or directories, see psp_cz.archive) when they are given, from the synthetic
+site otherwise. 0 workers parses the pages in the benchmark process like the
+spider does without the pool.
+
+"""
+import sys
+import time
+from optparse import OptionParser
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
+
+from psp_cz.archive import ResponseArchive, find_archives
+from psp_cz.parsers import parse_parl_memb_votes, parse_votings_page
+from psp_cz.parse_pool import ParsePool
+from benchmarks.fixtures import SyntheticSite, ENCODING
+
+BASE_URL = 'http://www.psp.cz/sqw/'
+# page parsers by the name of the page
+PARSERS = {
+    'phlasa.sqw': parse_votings_page,
+    'hlasy.sqw': parse_parl_memb_votes,
+}
+
+
+def get_parser(url):
+    return PARSERS.get(url.split('?', 1)[0].rsplit('/', 1)[-1])
+
+
+def archive_pages(paths):
+    """Returns (parser, body, encoding, url) of parsed pages of the archives"""
+    archive = ResponseArchive(find_archives(paths, 'psp.cz'))
+    pages = []
+    for url in sorted(archive.index):
+        parser = get_parser(url)
+        if parser is not None:
+            response = archive.get(url)
+            pages.append((parser, response.body, response.encoding, response.url))
+    archive.close()
+    return pages
+
+
+def synthetic_pages(sittings, votings):
+    site = SyntheticSite(sittings, votings)
+    pages = []
+    for sitting_no in xrange(1, sittings + 1):
+        for pg in xrange(1, site.pages_count() + 1):
+            url = BASE_URL + 'phlasa.sqw?o=%d&s=%d&pg=%d' % (site.TERM, sitting_no, pg)
+            pages.append((parse_votings_page, site.page(url)[2], ENCODING, url))
+        for voting_nr in xrange(1, votings + 1):
+            url = BASE_URL + 'hlasy.sqw?g=%d' % site.voting_id(sitting_no, voting_nr)
+            pages.append((parse_parl_memb_votes, site.page(url)[2], ENCODING, url))
+    return pages
+
+
+@inlineCallbacks
+def measure(pages, workers, repeat, max_pending):
+    pool = ParsePool(workers, max_pending) if workers else None
+    records = 0
+    start = time.time()
+    for i in xrange(repeat):
+        if pool is None:
+            for parser, body, encoding, url in pages:
+                records += len(parser(body, encoding, url))
+        else:
+            results = yield DeferredList([pool.parse(*page) for page in pages], fireOnOneErrback=True)
+            records += sum(len(result) for ok, result in results)
+    elapsed = time.time() - start
+    if pool is not None:
+        pool.close()
+    count = len(pages) * repeat
+    print '%2d workers %8d pages %8.2f s %8.0f pages/s %10.0f records/s' % (
+        workers, count, elapsed, count / elapsed, records / elapsed)
+    returnValue(elapsed)
+
+
+@inlineCallbacks
+def run(pages, options):
+    try:
+        baseline = None
+        for workers in options.workers:
+            elapsed = yield measure(pages, workers, options.repeat, options.max_pending)
+            if baseline is None:
+                baseline = elapsed
+            else:
+                print '           speedup %.2fx' % (baseline / elapsed)
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [ARCHIVE ...]')
+    parser.add_option('--workers', default='0,1,2,4',
+                      help='comma separated numbers of worker processes (default: 0,1,2,4)')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='number of times every page is parsed')
+    parser.add_option('--max-pending', type='int', default=64,
+                      help='pages sent to the workers at once')
+    parser.add_option('--sittings', type='int', default=4,
+                      help='sittings of the synthetic site')
+    parser.add_option('--votings', type='int', default=100,
+                      help='votings per sitting of the synthetic site')
+    options, args = parser.parse_args()
+    options.workers = [int(n) for n in options.workers.split(',')]
+
+    if args:
+        pages = archive_pages(args)
+    else:
+        pages = synthetic_pages(options.sittings, options.votings)
+    print 'Pages: %d' % len(pages)
+
+    reactor.callWhenRunning(run, pages, options)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
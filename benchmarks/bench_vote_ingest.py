@@ -0,0 +1,131 @@
+# coding=utf-8
+"""
+Compares rows per second of storing ParlMembVoting rows by the original
+"SELECT, then INSERT if missing" approach and by the bulk vote writers.
+
+Usage:
+    python -m benchmarks.bench_vote_ingest [--votings N] [--url DATABASE_URL]
+
+Without --url a temporary SQLite database is used. The database must be empty
+as the schema is created by the benchmark.
+
+"""
+import os
+import sys
+import time
+import tempfile
+import datetime
+from optparse import OptionParser
+
+PARL_MEMBS = 200
+TERM = 6
+
+
+def setup(votings):
+    """Creates sitting, votings and parliament members the votes refer to"""
+    from psp_cz.database import db_session, init_db
+    from psp_cz.psp_cz_models import Sitting, Voting, ParlMemb
+
+    init_db()
+    sitting = Sitting(url='http://bench/sitting', name='1. schuze', term=TERM, sitting_no=1)
+    db_session.add(sitting)
+    for nr in xrange(votings):
+        db_session.add(Voting(url='http://bench/voting/%d' % nr,
+                              voting_nr=nr,
+                              name='Voting %d' % nr,
+                              voting_date=datetime.date(2012, 1, 1),
+                              result='Prijato',
+                              term=TERM,
+                              sitting=sitting))
+    for psp_cz_id in xrange(PARL_MEMBS):
+        db_session.add(ParlMemb(url='http://bench/parl_memb/%d' % psp_cz_id,
+                                name='Member %d' % psp_cz_id,
+                                psp_cz_id=psp_cz_id))
+    db_session.commit()
+    return [id for id, in db_session.query(Voting.id).order_by(Voting.id)]
+
+
+def clear():
+    from psp_cz.database import db_session
+    from psp_cz.psp_cz_models import ParlMembVoting
+    db_session.query(ParlMembVoting).delete()
+    db_session.commit()
+
+
+def row_by_row(voting_ids):
+    """The original path - lookups, existence check and commit for every vote"""
+    from psp_cz.database import db_session
+    from psp_cz.psp_cz_models import Voting, ParlMemb, ParlMembVoting
+
+    for voting_id in voting_ids:
+        for psp_cz_id in xrange(PARL_MEMBS):
+            parl_memb = db_session.query(ParlMemb).filter_by(psp_cz_id=psp_cz_id).first()
+            voting = db_session.query(Voting).filter_by(id=voting_id).first()
+            if db_session.query(ParlMembVoting).filter_by(parlMemb=parl_memb,
+                                                         voting=voting).first() is None:
+                db_session.add(ParlMembVoting(vote='A', parlMemb=parl_memb, voting=voting, term=voting.term))
+                db_session.commit()
+
+
+def bulk(voting_ids, conflict='ignore'):
+    """One bulk write and commit per voting"""
+    from psp_cz.database import db_session, get_engine
+    from psp_cz.psp_cz_models import ParlMemb
+    from psp_cz.bulk import get_vote_writer
+
+    writer = get_vote_writer(get_engine(), conflict)
+    parl_memb_ids = dict(db_session.query(ParlMemb.psp_cz_id, ParlMemb.id))
+    for voting_id in voting_ids:
+        rows = [{'vote': 'A', 'voting_id': voting_id, 'parl_memb_id': parl_memb_ids[psp_cz_id], 'term': TERM}
+                for psp_cz_id in xrange(PARL_MEMBS)]
+        stored_votes = None if writer.resolves_conflicts else {voting_id: {}}
+        writer.write(db_session, rows, stored_votes)
+        db_session.commit()
+    return writer.__class__.__name__
+
+
+def measure(name, func, voting_ids):
+    start = time.time()
+    result = func(voting_ids)
+    elapsed = time.time() - start
+    rows = len(voting_ids) * PARL_MEMBS
+    if result:
+        name = '%s - %s' % (name, result)
+    print '%-40s %8d rows %8.2f s %10.0f rows/s' % (name, rows, elapsed, rows / elapsed)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--votings', type='int', default=20,
+                      help='number of votings to store (200 votes each)')
+    parser.add_option('--url', help='database url, temporary SQLite database by default')
+    options, args = parser.parse_args()
+
+    path = None
+    if options.url:
+        os.environ['DATABASE_URL'] = options.url
+    else:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+
+    try:
+        voting_ids = setup(options.votings)
+        from psp_cz.database import get_engine
+        print 'Database: %s' % get_engine().dialect.name
+
+        measure('row by row', row_by_row, voting_ids)
+        clear()
+        measure('bulk', bulk, voting_ids)
+        # re-crawl of already stored votings
+        measure('bulk (re-crawl)', bulk, voting_ids)
+        clear()
+    finally:
+        if path:
+            from psp_cz.database import db_session
+            db_session.remove()
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Runs a single profiled crawl and writes its report as JSON. It is started by
+benchmarks/run_crawl.py in a separate process with the environment prepared.
+
+Usage:
+    python -m benchmarks.crawl SPIDER REPORT_FILE [scrapy crawl options]
+
+"""
+import sys
+import json
+import resource
+import threading
+import cProfile
+import pstats
+
+from .extensions import collected_stats
+
+# spider callbacks and pipeline stages reported separately
+PROFILED_FUNCTIONS = (
+    ('spider', 'parse_sittings'),
+    ('spider', 'proceed_to_votings'),
+    ('spider', 'parse_votings'),
+    ('spider', 'parse_parl_memb_votes'),
+    ('spider', 'parse_parl_polit_groups'),
+    ('spider', 'parse_parl_memb'),
+    ('pipeline', 'process_item'),
+    ('pipeline', 'flush'),
+    ('pipeline', 'store_sittings'),
+    ('pipeline', 'store_votings'),
+    ('pipeline', 'store_parl_membs'),
+    ('pipeline', 'store_parl_memb_votes'),
+)
+
+def profile_threads(profiles):
+    """
+    Profiles threads started from now on, e.g. the database writer thread of
+    the pipeline - cProfile sees only the thread it was enabled in. Profiles
+    of the threads are appended to profiles.
+
+    """
+    def start_profile(frame, event, arg):
+        profile = cProfile.Profile()
+        profiles.append(profile)
+        # the profile replaces this function in the thread
+        profile.enable()
+    threading.setprofile(start_profile)
+
+
+def get_function_times(profiles):
+    """Returns cumulative time of profiled functions in seconds"""
+    times = {}
+    for (filename, lineno, name), stat in pstats.Stats(*profiles).stats.items():
+        if 'psp_cz' not in filename:
+            continue
+        for kind, function_name in PROFILED_FUNCTIONS:
+            if name == function_name and (kind == 'spider') == ('spiders' in filename):
+                key = '%s/%s' % (kind, name)
+                # (primitive calls, calls, total time, cumulative time, callers)
+                times[key] = times.get(key, 0.0) + stat[3]
+    return times
+
+
+def main():
+    spider, report_file = sys.argv[1:3]
+
+    from scrapy.cmdline import execute
+    profile = cProfile.Profile()
+    profiles = [profile]
+    profile_threads(profiles)
+    try:
+        profile.runcall(execute, ['scrapy', 'crawl', spider] + sys.argv[3:])
+    except SystemExit:
+        pass
+    threading.setprofile(None)
+
+    elapsed = (collected_stats['finish_time'] - collected_stats['start_time']).total_seconds()
+    report = {
+        'spider': spider,
+        'elapsed': elapsed,
+        'pages': collected_stats.get('response_received_count', 0),
+        'items': collected_stats.get('item_scraped_count', 0),
+        'pages_per_second': collected_stats.get('response_received_count', 0) / elapsed,
+        'items_per_second': collected_stats.get('item_scraped_count', 0) / elapsed,
+        # kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'function_times': get_function_times(profiles),
+        'stats': dict((k, v) for k, v in collected_stats.items() if isinstance(v, (int, long, float))),
+    }
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
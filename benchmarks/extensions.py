@@ -0,0 +1,20 @@
+# coding=utf-8
+from scrapy import signals
+
+# stats of the last finished crawl in this process
+collected_stats = {}
+
+
+class StatsDump(object):
+    """Extension which keeps the stats of the finished crawl for the report"""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        crawler.signals.connect(self.engine_stopped, signal=signals.engine_stopped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def engine_stopped(self):
+        collected_stats.update(self.crawler.stats.get_stats())
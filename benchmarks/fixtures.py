@@ -0,0 +1,237 @@
+# coding=utf-8
+"""
+Synthetic psp.cz site used by the offline benchmarks.
+
+Pages are generated from templates which follow the markup of the psp.cz pages
+the spiders parse (the same element paths, url formats, windows-1250 encoding,
+non-breaking spaces in dates). The site is scaled by the number of sittings,
+votings per sitting and parliament members.
+
+"""
+import random
+import urlparse
+from datetime import date, timedelta
+
+ENCODING = 'windows-1250'
+CONTENT_TYPE = 'text/html; charset=%s' % ENCODING
+
+# 1x1 pixel GIF served as every parliament member photo
+PHOTO = ('GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04\x01\x00'
+         '\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+PAGE_TEMPLATE = u"""<!DOCTYPE html>
+<html lang="cs">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=windows-1250">
+<title>%(title)s</title>
+</head>
+<body>
+<div id="header"><a href="hp.sqw?k=27">Poslanecká sněmovna</a></div>
+%(content)s
+<div id="footer">Poslanecká sněmovna Parlamentu České republiky</div>
+</body>
+</html>
+"""
+
+VOTES = u'AAAANNZ0MX'
+GROUPS = [(u'ODS', u'Poslanecký klub Občanské demokratické strany'),
+          (u'ČSSD', u'Poslanecký klub České strany sociálně demokratické'),
+          (u'TOP09', u'Poslanecký klub TOP 09 a Starostové'),
+          (u'KSČM', u'Poslanecký klub Komunistické strany Čech a Moravy'),
+          (u'VV', u'Poslanecký klub Věci veřejné')]
+REGIONS = [u'Praha', u'Středočeský', u'Jihočeský', u'Plzeňský', u'Karlovarský',
+           u'Ústecký', u'Liberecký', u'Královéhradecký', u'Pardubický', u'Vysočina',
+           u'Jihomoravský', u'Olomoucký', u'Zlínský', u'Moravskoslezský']
+
+
+class SyntheticSite(object):
+    """
+    Generates psp.cz pages for sittings x votings x members. Page urls are
+    relative to http://www.psp.cz/sqw/.
+
+    """
+    TERM = 6
+    VOTINGS_PER_PAGE = 50
+
+    def __init__(self, sittings=2, votings=20, members=200, seed=1):
+        self.sittings = sittings
+        self.votings = votings
+        self.members = members
+        self.seed = seed
+
+    def voting_id(self, sitting_no, voting_nr):
+        return 50000 + sitting_no * 1000 + voting_nr
+
+    def member_id(self, member):
+        return 5000 + member
+
+    def member_group(self, member):
+        return member % len(GROUPS)
+
+    def member_name(self, member):
+        return u'Poslanec%d Příjmení%d' % (member, member)
+
+    def render(self, title, content):
+        return (PAGE_TEMPLATE % {'title': title, 'content': content}).encode(ENCODING)
+
+    def page(self, url):
+        """Returns (status, content type, body) of the page at url"""
+        parsed = urlparse.urlparse(url)
+        page = parsed.path.rsplit('/', 1)[-1]
+        params = dict((k, v[0]) for k, v in urlparse.parse_qs(parsed.query).items())
+        try:
+            if page == 'hp.sqw':
+                return 200, CONTENT_TYPE, self.homepage()
+            elif page == 'hlasovani.sqw' and 's' in params:
+                return 200, CONTENT_TYPE, self.sitting(int(params['s']))
+            elif page == 'hlasovani.sqw':
+                return 200, CONTENT_TYPE, self.sittings_page()
+            elif page == 'phlasa.sqw':
+                return 200, CONTENT_TYPE, self.votings_page(int(params['s']), int(params.get('pg', 1)))
+            elif page == 'hlasy.sqw':
+                return 200, CONTENT_TYPE, self.voting(int(params['g']))
+            elif page == 'organy2.sqw':
+                return 200, CONTENT_TYPE, self.groups_page()
+            elif page == 'snem.sqw':
+                return 200, CONTENT_TYPE, self.group(int(params['id']))
+            elif page == 'detail.sqw':
+                return 200, CONTENT_TYPE, self.member(int(params['id']) - 5000)
+            elif parsed.path.endswith('.jpg'):
+                return 200, 'image/gif', PHOTO
+        except (KeyError, ValueError, IndexError):
+            pass
+        return 404, CONTENT_TYPE, self.render(u'Stránka nenalezena', u'<h1>Stránka nenalezena</h1>')
+
+    def homepage(self):
+        return self.render(u'Poslanecká sněmovna', u"""
+<div id="main-content">
+<ul class="menu">
+<li><a href="hlasovani.sqw">Hlasování</a></li>
+<li><a href="organy2.sqw?k=1">Poslanecké kluby</a></li>
+</ul>
+</div>""")
+
+    def sittings_page(self):
+        rows = []
+        for sitting_no in xrange(self.sittings, 0, -1):
+            rows.append(u'<tr><td><b><a href="hlasovani.sqw?o=%d&amp;s=%d">%d. schůze</a></b></td>'
+                        u'<td>%d.&nbsp;1.&nbsp;2012</td></tr>'
+                        % (self.TERM, sitting_no, sitting_no, sitting_no))
+        return self.render(u'Hlasování', u"""
+<div id="main-content">
+<div><table class="document-table"><thead><tr><th>Schůze</th><th>Datum</th></tr></thead>
+<tbody>
+%s
+</tbody></table></div>
+</div>""" % u'\n'.join(rows))
+
+    def pages_count(self):
+        return (self.votings - 1) // self.VOTINGS_PER_PAGE + 1
+
+    def sitting(self, sitting_no):
+        if not 1 <= sitting_no <= self.sittings:
+            raise KeyError(sitting_no)
+        links = [u'<li><a href="phlasa.sqw?o=%d&amp;s=%d">Hlasování %d. schůze</a></li>'
+                 % (self.TERM, sitting_no, sitting_no)]
+        for pg in xrange(1, self.pages_count() + 1):
+            links.append(u'<li><a href="phlasa.sqw?o=%d&amp;s=%d&amp;pg=%d">%d</a></li>'
+                         % (self.TERM, sitting_no, pg, pg))
+        return self.render(u'%d. schůze' % sitting_no, u"""
+<div id="main-content">
+<h1>%d. schůze</h1>
+<ul>%s</ul>
+</div>""" % (sitting_no, u''.join(links)))
+
+    def voting_date(self, sitting_no):
+        return date(2012, 1, 1) + timedelta(days=sitting_no)
+
+    def votings_page(self, sitting_no, pg):
+        if not 1 <= sitting_no <= self.sittings or not 1 <= pg <= self.pages_count():
+            raise KeyError(pg)
+        first = (pg - 1) * self.VOTINGS_PER_PAGE + 1
+        last = min(self.votings, pg * self.VOTINGS_PER_PAGE)
+        day = self.voting_date(sitting_no)
+        date_text = u'%d.&nbsp;%d.&nbsp;%d' % (day.day, day.month, day.year)
+        rows = []
+        for voting_nr in xrange(first, last + 1):
+            if voting_nr % 10:
+                date_cell = u'<a href="eknih/2010ps/stenprot/%03dschuz/s%03d001.htm">%s</a>' \
+                            % (sitting_no, sitting_no, date_text)
+            else:
+                date_cell = date_text
+            rows.append(u'<tr><td>%d</td><td><a href="hlasy.sqw?g=%d">%d</a></td><td>%d</td>'
+                        u'<td>Návrh zákona o státním rozpočtu, hlasování č. %d</td><td>%s</td><td>%s</td></tr>'
+                        % (sitting_no, self.voting_id(sitting_no, voting_nr), voting_nr, voting_nr,
+                           voting_nr, date_cell, u'Přijato' if voting_nr % 3 else u'Zamítnuto'))
+        pages = u' '.join(u'<a href="phlasa.sqw?o=%d&amp;s=%d&amp;pg=%d">%d</a>' % (self.TERM, sitting_no, p, p)
+                          for p in xrange(1, self.pages_count() + 1))
+        return self.render(u'Hlasování %d. schůze' % sitting_no, u"""
+<div id="main-content">
+<div>
+<center><table>
+<tr><th>Schůze</th><th>Číslo</th><th>Bod</th><th>Název</th><th>Datum</th><th>Výsledek</th></tr>
+%s
+</table></center>
+<p class="pages">%s</p>
+</div>
+</div>""" % (u'\n'.join(rows), pages))
+
+    def voting(self, voting_id):
+        sitting_no, voting_nr = divmod(voting_id - 50000, 1000)
+        if not 1 <= sitting_no <= self.sittings or not 1 <= voting_nr <= self.votings:
+            raise KeyError(voting_id)
+        rnd = random.Random(self.seed * voting_id)
+        items = []
+        for member in xrange(self.members):
+            items.append(u'<li><span class="flag">%s</span><a href="detail.sqw?id=%d&amp;o=%d">%s</a></li>'
+                         % (rnd.choice(VOTES), self.member_id(member), self.TERM, self.member_name(member)))
+        return self.render(u'Hlasování %d' % voting_id, u"""
+<div id="main-content">
+<h1>%d. schůze, hlasování č. %d</h1>
+<ul class="results">
+%s
+</ul>
+</div>""" % (sitting_no, voting_nr, u'\n'.join(items)))
+
+    def groups_page(self):
+        links = [u'<li><a href="snem.sqw?l=cz&amp;id=%d">%s</a></li>' % (100 + i, name)
+                 for i, (name, name_long) in enumerate(GROUPS)]
+        return self.render(u'Poslanecké kluby', u"""
+<div id="main-content">
+<ul>%s</ul>
+</div>""" % u''.join(links))
+
+    def group(self, group_id):
+        group = group_id - 100
+        name, name_long = GROUPS[group]
+        rows = []
+        for member in xrange(self.members):
+            if self.member_group(member) != group:
+                continue
+            region = member % len(REGIONS)
+            rows.append(u'<tr><th><a href="detail.sqw?id=%d&amp;o=%d">%s</a></th>'
+                        u'<td><a href="organy.sqw?id=%d">%s</a></td>'
+                        u'<td><a href="snem.sqw?l=cz&amp;id=%d" title="%s">%s</a></td></tr>'
+                        % (self.member_id(member), self.TERM, self.member_name(member),
+                           200 + region, REGIONS[region], group_id, name_long, name))
+        return self.render(name_long, u"""
+<div id="content"><div><div><table>
+<thead><tr><th>Jméno</th><th>Kraj</th><th>Klub</th></tr></thead>
+<tbody>
+%s
+</tbody>
+</table></div></div></div>""" % u'\n'.join(rows))
+
+    def member(self, member):
+        if not 0 <= member < self.members:
+            raise KeyError(member)
+        born = date(1950, 1, 1) + timedelta(days=member * 37)
+        gender = u'Narozen' if member % 4 else u'Narozena'
+        return self.render(self.member_name(member), u"""
+<div id="main-content">
+<h1>%s</h1>
+<div><div><div>
+<a href="/img/%d.jpg"><img src="/img/%d.jpg" alt=""></a>
+<div><p><strong>%s: %02d.%02d.%d</strong></p></div>
+</div></div></div>
+</div>""" % (self.member_name(member), member, member, gender, born.day, born.month, born.year))
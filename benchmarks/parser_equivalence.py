@@ -0,0 +1,164 @@
+# coding=utf-8
+"""
+Checks that psp_cz.parsers return the same data as the original
+HtmlXPathSelector based parsing and compares their speed.
+
+Usage:
+    python -m benchmarks.parser_equivalence [--repeat N] [--pages N] [PAGE_URL=FILE ...]
+
+Each argument is a saved voting results page (hlasy.sqw) or a page of the list
+of votings (phlasa.sqw) together with the url it was downloaded from, for
+example http://www.psp.cz/sqw/hlasy.sqw?g=57300=hlasy_57300.html
+Without arguments pages of benchmarks.fixtures.SyntheticSite are checked.
+
+"""
+import re
+import sys
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+from scrapy.http import HtmlResponse
+from scrapy.selector import HtmlXPathSelector
+from scrapy.utils.response import get_base_url
+from scrapy.utils.url import urljoin_rfc
+
+from psp_cz.parsers import get_parl_memb_id, parse_parl_memb_votes, parse_votings_page
+
+from .fixtures import SyntheticSite
+
+SITE_URL = 'http://www.psp.cz/sqw/'
+
+
+def selector_parl_memb_votes(response):
+    """The original selector based parsing of PspCzSpider.parse_parl_memb_votes"""
+    hxs = HtmlXPathSelector(response)
+    base_url = get_base_url(response)
+
+    records = []
+    for v in hxs.select('//ul[@class="results"]//li'):
+        vote = v.select('span/text()').extract()[0]
+        parl_memb_name = v.select('a/text()').extract()[0]
+        relative_url = v.select('a/@href').extract()[0]
+        relative_url = re.sub(r'\&o=[:0-9:]+', '', relative_url)
+        parl_memb_url = urljoin_rfc(base_url, relative_url)
+        records.append((vote, parl_memb_name, parl_memb_url, get_parl_memb_id(parl_memb_url)))
+    return records
+
+
+def fast_parl_memb_votes(response):
+    return [tuple(r) for r in parse_parl_memb_votes(response.body, response.encoding, response.url)]
+
+
+def selector_votings(response):
+    """The original selector based parsing of PspCzSpider.parse_votings"""
+    hxs = HtmlXPathSelector(response)
+    base_url = get_base_url(response)
+
+    records = []
+    for voting_link in hxs.select('//*[@id="main-content"]/div[1]/center/table/tr[position()>1]'):
+        url = urljoin_rfc(base_url, voting_link.select('td[2]/a/@href').extract()[0])
+        voting_nr = int(voting_link.select('td[2]/a/text()').extract()[0])
+        name = voting_link.select('td[4]/node()').extract()[0]
+        if voting_link.select('td[5]/a/text()'):
+            date_text = voting_link.select('td[5]/a/text()').extract()[0].replace(u'\xa0', '')
+            voting_date = datetime.strptime(date_text, '%d.%m.%Y')
+            minutes_url = voting_link.select('td[5]/a/@href').extract()[0]
+        else:
+            date_text = voting_link.select('td[5]/text()').extract()[0].replace(u'\xa0', '')
+            voting_date = datetime.strptime(date_text, '%d.%m.%Y')
+            minutes_url = None
+        result = voting_link.select('td[6]/text()').extract()[0]
+        records.append((url, voting_nr, name, voting_date, minutes_url, result))
+    return records
+
+
+def fast_votings(response):
+    return [tuple(r) for r in parse_votings_page(response.body, response.encoding, response.url)]
+
+# page name -> (original parsing, parser)
+PARSERS = {
+    'hlasy.sqw': (selector_parl_memb_votes, fast_parl_memb_votes),
+    'phlasa.sqw': (selector_votings, fast_votings),
+}
+
+
+def get_page_name(url):
+    return url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+
+def synthetic_responses(pages):
+    """
+    Returns responses with voting results pages and pages of the list of
+    votings of the synthetic site.
+
+    """
+    site = SyntheticSite(sittings=1, votings=pages)
+    urls = [SITE_URL + 'hlasy.sqw?g=%d' % site.voting_id(1, voting_nr)
+            for voting_nr in xrange(1, pages + 1)]
+    urls.extend(SITE_URL + 'phlasa.sqw?o=%d&s=1&pg=%d' % (site.TERM, pg)
+                for pg in xrange(1, site.pages_count() + 1))
+    responses = []
+    for url in urls:
+        status, content_type, body = site.page(url)
+        responses.append(HtmlResponse(url, headers={'Content-Type': content_type}, body=body))
+    return responses
+
+
+def measure(func, responses, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        for response in responses:
+            func(response)
+    return time.time() - start
+
+
+def main():
+    parser = OptionParser(usage='%prog [--repeat N] [--pages N] [PAGE_URL=FILE ...]')
+    parser.add_option('--repeat', type='int', default=10,
+                      help='number of times every page is parsed when measuring speed')
+    parser.add_option('--pages', type='int', default=120,
+                      help='number of synthetic voting results pages checked when no pages are '
+                           'given, votings of the synthetic list of votings')
+    options, args = parser.parse_args()
+
+    if args:
+        responses = []
+        for arg in args:
+            url, path = arg.rsplit('=', 1)
+            with open(path, 'rb') as f:
+                responses.append(HtmlResponse(url, body=f.read()))
+    else:
+        responses = synthetic_responses(options.pages)
+
+    failures = 0
+    for response in responses:
+        selector_parser, fast_parser = PARSERS[get_page_name(response.url)]
+        expected = selector_parser(response)
+        actual = fast_parser(response)
+        if expected != actual:
+            failures += 1
+            print 'DIFFERENT %s' % response.url
+            for e, a in zip(expected, actual):
+                if e != a:
+                    print '    selector: %r\n    parser:   %r' % (e, a)
+            if len(expected) != len(actual):
+                print '    %d records by selector, %d by parser' % (len(expected), len(actual))
+        else:
+            print 'OK %s (%d records)' % (response.url, len(actual))
+
+    for page_name, (selector_parser, fast_parser) in sorted(PARSERS.items()):
+        page_responses = [r for r in responses if get_page_name(r.url) == page_name]
+        if not page_responses:
+            continue
+        selector_time = measure(selector_parser, page_responses, options.repeat)
+        fast_time = measure(fast_parser, page_responses, options.repeat)
+        pages = len(page_responses) * options.repeat
+        print '%s selector: %8.1f pages/s' % (page_name, pages / selector_time)
+        print '%s parser:   %8.1f pages/s' % (page_name, pages / fast_time)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
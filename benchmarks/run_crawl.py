@@ -0,0 +1,87 @@
+# coding=utf-8
+"""
+End to end benchmark of the spiders against the local psp.cz stand-in.
+
+Starts benchmarks.server with a synthetic site and crawls it by psp.cz and
+poslanci.psp.cz spiders into a fresh SQLite database. For every crawl it
+reports pages/s, items/s, peak RSS and time spent in the spider callbacks and
+pipeline stages (profiled, so the absolute numbers are inflated).
+
+Usage:
+    python -m benchmarks.run_crawl [--sittings N] [--votings N] [--members N]
+                                   [--spider NAME] [--report FILE]
+
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+from .fixtures import SyntheticSite
+from .server import SiteServer
+
+SPIDERS = ['psp.cz', 'poslanci.psp.cz']
+
+
+def run_crawl(spider, server, workdir):
+    """Runs the spider in a child process and returns its report"""
+    report_file = os.path.join(workdir, '%s.json' % spider)
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'benchmark.db'),
+        'IMAGES_STORE': os.path.join(workdir, 'images'),
+        'SCRAPY_SETTINGS_MODULE': 'benchmarks.settings',
+        'http_proxy': server.proxy_url,
+    })
+    env.pop('no_proxy', None)
+    env.pop('NO_PROXY', None)
+    subprocess.check_call([sys.executable, '-m', 'benchmarks.crawl', spider, report_file,
+                           '-s', 'LOG_FILE=%s' % os.path.join(workdir, '%s.log' % spider)],
+                          env=env)
+    with open(report_file) as f:
+        return json.load(f)
+
+
+def print_report(report):
+    print '%s: %d pages, %d items in %.2f s' % (report['spider'], report['pages'],
+                                                report['items'], report['elapsed'])
+    print '    %10.1f pages/s' % report['pages_per_second']
+    print '    %10.1f items/s' % report['items_per_second']
+    print '    %10.1f MB peak RSS' % (report['peak_rss_kb'] / 1024.0)
+    for name, seconds in sorted(report['function_times'].items(), key=lambda x: -x[1]):
+        print '    %10.2f s %s' % (seconds, name)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sittings', type='int', default=2)
+    parser.add_option('--votings', type='int', default=20,
+                      help='votings per sitting')
+    parser.add_option('--members', type='int', default=200)
+    parser.add_option('--spider', action='append', choices=SPIDERS,
+                      help='spider to run, all spiders by default')
+    parser.add_option('--report', help='write reports of all crawls to this JSON file')
+    options, args = parser.parse_args()
+
+    server = SiteServer(SyntheticSite(options.sittings, options.votings, options.members))
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='psp_cz_benchmark')
+    try:
+        reports = []
+        for spider in options.spider or SPIDERS:
+            report = run_crawl(spider, server, workdir)
+            print_report(report)
+            reports.append(report)
+        if options.report:
+            with open(options.report, 'w') as f:
+                json.dump(reports, f, indent=2, sort_keys=True)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Local stand-in of psp.cz serving pages of a SyntheticSite.
+
+The server works as an HTTP proxy - requests for absolute www.psp.cz urls are
+answered with the synthetic pages, so the spiders run unmodified when the
+http_proxy environment variable points to the server.
+
+Usage:
+    python -m benchmarks.server [--port PORT] [--sittings N] [--votings N] [--members N]
+
+"""
+import sys
+import hashlib
+import threading
+from optparse import OptionParser
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from .fixtures import SyntheticSite
+
+
+class SiteRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        status, content_type, body = self.server.site.page(self.path)
+        etag = None
+        if status == 200:
+            # pages and images support conditional requests
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, ''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SiteServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, site, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), SiteRequestHandler)
+        self.site = site
+
+    @property
+    def proxy_url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        """Serves requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--sittings', type='int', default=2)
+    parser.add_option('--votings', type='int', default=20)
+    parser.add_option('--members', type='int', default=200)
+    options, args = parser.parse_args()
+
+    server = SiteServer(SyntheticSite(options.sittings, options.votings, options.members),
+                        options.port)
+    print 'Serving synthetic psp.cz at %s (use it as http_proxy)' % server.proxy_url
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# Scrapy settings of benchmark crawls against the local psp.cz stand-in - see
+# benchmarks/run_crawl.py
+from psp_cz.settings import *
+
+EXTENSIONS = dict(EXTENSIONS, **{
+    'benchmarks.extensions.StatsDump': 500,
+})
+DOWNLOAD_DELAY = 0
+CONCURRENT_REQUESTS = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 16
+LOG_LEVEL = 'INFO'
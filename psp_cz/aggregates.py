@@ -0,0 +1,347 @@
+# coding=utf-8
+"""
+Summary tables of votes maintained together with the votes.
+
+VotingTally counts votes of each kind (see votes.VOTES) in every voting,
+ParlMembTermTally counts votes of each kind of every parliament member in a
+term and PolitGroupVotingTally counts votes of each kind of members of every
+political group in a voting. Reports read the counts instead of grouping the
+whole parl_memb_voting table.
+
+DBStorePipeline computes changes of stored votes of every batch
+(get_vote_changes) and update_aggregates() applies them to the counts in the
+same transaction. Votes are counted for the political group the member
+belonged to on the day of the voting (see PolitGroupMemb). When the
+poslanci.psp.cz spider changes the group of a member, the membership in the
+old group ends and the one in the new group starts that day
+(change_polit_group) and move_parl_memb_votes() moves counts of the member's
+votes in votings since then - counts of past votings are kept. Only a member
+without any membership gets the group since the beginning, all of the votes
+are counted for it then. rebuild_aggregates() regenerates the tables from the
+stored votes and memberships (scrapy rebuild_aggregates command) and
+check_aggregates() compares them (scrapy check_aggregates command).
+
+"""
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import and_, or_, bindparam, func
+
+from .bulk import UNKNOWN_TERM
+from .votes import iter_parl_memb_votes, iter_votes_of_parl_membs
+from .psp_cz_models import Voting as TVoting
+from .psp_cz_models import PolitGroupMemb as TPolitGroupMemb
+from .psp_cz_models import ParlMembVoting as TParlMembVoting
+from .psp_cz_models import VotingTally as TVotingTally
+from .psp_cz_models import ParlMembTermTally as TParlMembTermTally
+from .psp_cz_models import PolitGroupVotingTally as TPolitGroupVotingTally
+
+# summary tables and their key columns, count of votes is the value
+AGGREGATES = (
+    (TVotingTally, ('voting_id', 'vote')),
+    (TParlMembTermTally, ('parl_memb_id', 'term', 'vote')),
+    (TPolitGroupVotingTally, ('voting_id', 'polit_group_id', 'vote')),
+)
+
+# number of rows inserted at once by rebuild_aggregates()
+INSERT_CHUNK_SIZE = 10000
+# number of votings whose counts are moved at once by move_parl_memb_votes()
+MOVE_CHUNK_SIZE = 500
+
+
+def _delta_update(model, key_names):
+    table = model.__table__
+    return table.update() \
+                .where(and_(*[table.c[name] == bindparam('b_' + name) for name in key_names])) \
+                .values(count=table.c.count + bindparam('b_delta'), last_modified=func.now())
+
+# statements are built once so that the engine reuses their compiled form
+INSERTS = dict((model, model.__table__.insert()) for model, key_names in AGGREGATES)
+DELTA_UPDATES = dict((model, _delta_update(model, key_names)) for model, key_names in AGGREGATES)
+
+
+def get_vote_changes(rows, stored_votes, conflict='ignore'):
+    """
+    Returns changes of stored votes made by writing rows (see bulk) as list
+    of (voting id, parliament member id, stored vote or None, new vote)
+    tuples. stored_votes maps voting id to dictionary of parliament member
+    id -> stored vote, it is not modified.
+
+    """
+    changes = []
+    written = {}
+    for row in rows:
+        key = (row['voting_id'], row['parl_memb_id'])
+        if key in written:
+            stored = written[key]
+        else:
+            stored = stored_votes[row['voting_id']].get(row['parl_memb_id'])
+        if stored == row['vote'] or (stored is not None and conflict == 'ignore'):
+            continue
+        changes.append((row['voting_id'], row['parl_memb_id'], stored, row['vote']))
+        written[key] = row['vote']
+    return changes
+
+
+def get_votings(session, voting_ids):
+    """Returns dictionary of voting id -> (term, date) of the voting"""
+    votings = dict((voting_id, (UNKNOWN_TERM, None)) for voting_id in voting_ids)
+    if votings:
+        votings.update((voting_id, (term, voting_date)) for voting_id, term, voting_date in
+                       session.query(TVoting.id, TVoting.term, TVoting.voting_date)
+                              .filter(TVoting.id.in_(votings.keys())))
+    return votings
+
+
+def get_memberships(session, parl_memb_ids=None):
+    """
+    Returns dictionary of parliament member id -> list of (since, until,
+    political group id) of memberships of the members, of all members when
+    parl_memb_ids is None.
+
+    """
+    query = session.query(TPolitGroupMemb.parl_memb_id, TPolitGroupMemb.since, TPolitGroupMemb.until,
+                          TPolitGroupMemb.polit_group_id)
+    if parl_memb_ids is not None:
+        if not parl_memb_ids:
+            return {}
+        query = query.filter(TPolitGroupMemb.parl_memb_id.in_(parl_memb_ids))
+    memberships = defaultdict(list)
+    for parl_memb_id, since, until, group_id in query:
+        memberships[parl_memb_id].append((since, until, group_id))
+    return memberships
+
+
+def get_group(memberships, day):
+    """Returns political group id of the membership (see get_memberships) on the day or None"""
+    if day is None:
+        return None
+    for since, until, group_id in memberships:
+        if (since is None or since <= day) and (until is None or day < until):
+            return group_id
+    return None
+
+
+def change_polit_group(session, parl_memb_id, polit_group_id, day):
+    """
+    Records that parliament member is in political group (None in no group)
+    since the day - ends the current membership and starts a new one. Returns
+    the day, or None when the member had no membership - the member is in the
+    group since the beginning then.
+
+    """
+    table = TPolitGroupMemb.__table__
+    member = table.c.parl_memb_id == parl_memb_id
+    if session.query(TPolitGroupMemb.id).filter(member).first() is None:
+        since = None
+    else:
+        since = day
+        # membership which started the same day is replaced
+        session.execute(table.delete().where(and_(member, table.c.since >= day)))
+        session.execute(table.update().where(and_(member, table.c.until == None))
+                             .values(until=day, last_modified=func.now()))
+    if polit_group_id is not None:
+        session.execute(table.insert(), {'parl_memb_id': parl_memb_id, 'polit_group_id': polit_group_id,
+                                         'since': since, 'until': None})
+    return since
+
+
+def count_changes(session, changes):
+    """Returns dictionary of model -> {key: change of the count} of changes"""
+    votings = get_votings(session, set(change[0] for change in changes))
+    memberships = get_memberships(session, set(change[1] for change in changes))
+
+    deltas = dict((model, defaultdict(int)) for model, keys in AGGREGATES)
+    for voting_id, parl_memb_id, old, new in changes:
+        term, voting_date = votings[voting_id]
+        group_id = get_group(memberships.get(parl_memb_id, ()), voting_date)
+        for vote, delta in ((old, -1), (new, 1)):
+            if vote is None:
+                continue
+            deltas[TVotingTally][(voting_id, vote)] += delta
+            deltas[TParlMembTermTally][(parl_memb_id, term, vote)] += delta
+            if group_id is not None:
+                deltas[TPolitGroupVotingTally][(voting_id, group_id, vote)] += delta
+    return deltas
+
+
+def update_aggregates(session, changes):
+    """Applies changes of stored votes (see get_vote_changes) to the summary tables"""
+    if not changes:
+        return
+    for model, deltas in count_changes(session, changes).iteritems():
+        apply_deltas(session, model, deltas)
+
+
+def move_parl_memb_votes(session, moves, storage='rows'):
+    """
+    Moves counts of votes of parliament members who changed political group
+    (see change_polit_group) from the old group to the new one. moves is list
+    of (parliament member id, old group id, new group id, since) tuples, the
+    groups may be None. Only votes in votings since the day are moved, all
+    votes when since is None. Packed votes are read when storage is 'packed',
+    rows otherwise.
+
+    """
+    if not moves:
+        return
+    parl_memb_moves = defaultdict(list)
+    for parl_memb_id, old_group_id, new_group_id, since in moves:
+        parl_memb_moves[parl_memb_id].append((old_group_id, new_group_id, since))
+    if storage == 'packed':
+        votes = iter_votes_of_parl_membs(session, parl_memb_moves.keys())
+    else:
+        votes = session.query(TParlMembVoting.voting_id, TParlMembVoting.parl_memb_id, TParlMembVoting.vote) \
+                       .filter(TParlMembVoting.parl_memb_id.in_(parl_memb_moves.keys()))
+    # the changes are recent, so dates of few votings are needed
+    days = [since for parl_memb_id, old_group_id, new_group_id, since in moves if since is not None]
+    if days:
+        voting_dates = dict(session.query(TVoting.id, TVoting.voting_date)
+                                   .filter(TVoting.voting_date >= min(days)))
+
+    # voting id -> {key: change of the count}
+    deltas = defaultdict(lambda: defaultdict(int))
+    for voting_id, parl_memb_id, vote in votes:
+        for old_group_id, new_group_id, since in parl_memb_moves[parl_memb_id]:
+            # votings missing in voting_dates took place before all of the days
+            if since is not None and voting_dates.get(voting_id, date.min) < since:
+                continue
+            if old_group_id is not None:
+                deltas[voting_id][(voting_id, old_group_id, vote)] -= 1
+            if new_group_id is not None:
+                deltas[voting_id][(voting_id, new_group_id, vote)] += 1
+
+    # apply_deltas() looks up existing counts by voting ids
+    voting_ids = sorted(deltas)
+    for i in xrange(0, len(voting_ids), MOVE_CHUNK_SIZE):
+        chunk = {}
+        for voting_id in voting_ids[i:i + MOVE_CHUNK_SIZE]:
+            chunk.update(deltas[voting_id])
+        apply_deltas(session, TPolitGroupVotingTally, chunk)
+
+
+def apply_deltas(session, model, deltas):
+    """Adds deltas (dictionary of key -> change of the count) to the counts of model"""
+    deltas = dict((key, delta) for key, delta in deltas.iteritems() if delta)
+    if not deltas:
+        return
+
+    key_names = dict(AGGREGATES)[model]
+    table = model.__table__
+    key_columns = [table.c[name] for name in key_names]
+    existing = set(tuple(row) for row in
+                   session.query(*key_columns)
+                          .filter(key_columns[0].in_(set(key[0] for key in deltas))))
+
+    inserts = []
+    updates = []
+    for key, delta in deltas.iteritems():
+        if key in existing:
+            update = dict(('b_' + name, value) for name, value in zip(key_names, key))
+            update['b_delta'] = delta
+            updates.append(update)
+        else:
+            insert = dict(zip(key_names, key))
+            insert['count'] = delta
+            inserts.append(insert)
+
+    if inserts:
+        session.execute(INSERTS[model], inserts)
+    if updates:
+        session.execute(DELTA_UPDATES[model], updates)
+
+
+def compute_aggregates(session, storage='rows'):
+    """
+    Counts stored votes - returns dictionary of model -> {key: count}.
+    Packed votes are counted when storage is 'packed', rows otherwise.
+
+    """
+    if storage == 'packed':
+        return compute_packed_aggregates(session)
+
+    count = func.count(TParlMembVoting.id)
+    result = {}
+    result[TVotingTally] = dict(((voting_id, vote), n) for voting_id, vote, n in
+                                session.query(TParlMembVoting.voting_id, TParlMembVoting.vote, count)
+                                       .group_by(TParlMembVoting.voting_id, TParlMembVoting.vote))
+    result[TParlMembTermTally] = dict(((parl_memb_id, t, vote), n) for parl_memb_id, t, vote, n in
+                                      session.query(TParlMembVoting.parl_memb_id, TParlMembVoting.term,
+                                                    TParlMembVoting.vote, count)
+                                             .group_by(TParlMembVoting.parl_memb_id, TParlMembVoting.term,
+                                                       TParlMembVoting.vote))
+    # memberships of a member do not overlap, so every vote is counted once
+    membership = and_(TPolitGroupMemb.parl_memb_id == TParlMembVoting.parl_memb_id,
+                      or_(TPolitGroupMemb.since == None, TPolitGroupMemb.since <= TVoting.voting_date),
+                      or_(TPolitGroupMemb.until == None, TVoting.voting_date < TPolitGroupMemb.until))
+    result[TPolitGroupVotingTally] = dict(((voting_id, group_id, vote), n) for voting_id, group_id, vote, n in
+                                          session.query(TParlMembVoting.voting_id, TPolitGroupMemb.polit_group_id,
+                                                        TParlMembVoting.vote, count)
+                                                 .join(TVoting, TVoting.id == TParlMembVoting.voting_id)
+                                                 .join(TPolitGroupMemb, membership)
+                                                 .group_by(TParlMembVoting.voting_id,
+                                                           TPolitGroupMemb.polit_group_id,
+                                                           TParlMembVoting.vote))
+    return result
+
+
+def compute_packed_aggregates(session):
+    votings = dict((voting_id, (term, voting_date)) for voting_id, term, voting_date in
+                   session.query(TVoting.id, TVoting.term, TVoting.voting_date))
+    memberships = get_memberships(session)
+
+    result = dict((model, defaultdict(int)) for model, keys in AGGREGATES)
+    for voting_id, parl_memb_id, vote in iter_parl_memb_votes(session):
+        term, voting_date = votings[voting_id]
+        result[TVotingTally][(voting_id, vote)] += 1
+        result[TParlMembTermTally][(parl_memb_id, term, vote)] += 1
+        group_id = get_group(memberships.get(parl_memb_id, ()), voting_date)
+        if group_id is not None:
+            result[TPolitGroupVotingTally][(voting_id, group_id, vote)] += 1
+    return dict((model, dict(counts)) for model, counts in result.iteritems())
+
+
+def get_aggregates(session):
+    """Returns stored counts as dictionary of model -> {key: count}"""
+    result = {}
+    for model, key_names in AGGREGATES:
+        table = model.__table__
+        columns = [table.c[name] for name in key_names]
+        result[model] = dict((tuple(row[:-1]), row[-1])
+                             for row in session.query(*(columns + [table.c.count])))
+    return result
+
+
+def rebuild_aggregates(session, storage='rows'):
+    """Replaces the summary tables by counts of stored votes"""
+    for model, counts in compute_aggregates(session, storage).iteritems():
+        key_names = dict(AGGREGATES)[model]
+        session.execute(model.__table__.delete())
+        rows = []
+        for key, count in counts.iteritems():
+            row = dict(zip(key_names, key))
+            row['count'] = count
+            rows.append(row)
+            if len(rows) >= INSERT_CHUNK_SIZE:
+                session.execute(INSERTS[model], rows)
+                rows = []
+        if rows:
+            session.execute(INSERTS[model], rows)
+
+
+def check_aggregates(session, storage='rows'):
+    """
+    Compares the summary tables with counts of stored votes. Returns list of
+    (table name, key, stored count, expected count) of differences, zero
+    counts are equal to missing rows.
+
+    """
+    differences = []
+    expected = compute_aggregates(session, storage)
+    for model, stored in get_aggregates(session).iteritems():
+        for key in sorted(set(stored) | set(expected[model])):
+            stored_count = stored.get(key, 0)
+            expected_count = expected[model].get(key, 0)
+            if stored_count != expected_count:
+                differences.append((model.__tablename__, key, stored_count, expected_count))
+    return differences
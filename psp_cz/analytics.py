@@ -0,0 +1,247 @@
+# coding=utf-8
+"""
+Vote matrix of parliament members x votings and analyses computed on it.
+
+VoteMatrix keeps votes in a .npy file which can be memory mapped - int8 codes
+of votes (see votes.VOTE_CODES, 0 means no vote) with a row per parliament
+member and a column per voting. The array is stored in Fortran (column major)
+order so new votings are appended to the end of the file without rewriting
+it. Ids of parliament members and votings of the rows and columns are kept in
+a JSON file next to it.
+
+The analysis functions take the matrix (and political groups of its rows)
+and are vectorized with numpy, they work on the memory mapped matrix as well
+as on any int8 array.
+
+"""
+import os
+import json
+import struct
+
+import numpy
+
+from .votes import VOTE_CODES, get_parl_memb_votes
+from .psp_cz_models import Voting as TVoting
+from .psp_cz_models import ParlMemb as TParlMemb
+from .psp_cz_models import ParlMembVoting as TParlMembVoting
+
+YES = VOTE_CODES[u'A']
+NO = VOTE_CODES[u'N']
+ABSTAIN = VOTE_CODES[u'Z']
+NOT_VOTED = VOTE_CODES[u'X']
+
+# .npy header of fixed size leaves room for the growing number of columns
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+NPY_HEADER_SIZE = 128
+# votings are read from the database in chunks of this size
+VOTINGS_CHUNK_SIZE = 500
+
+
+class VoteMatrix(object):
+    """
+    Vote matrix stored in path (and path + '.json'), optionally limited to
+    votings of a single term.
+
+    """
+    def __init__(self, path, term=None):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.term = term
+        self.parl_memb_ids = []
+        self.voting_ids = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta['term'] != term:
+                raise ValueError('%s holds votings of term %s' % (path, meta['term']))
+            self.parl_memb_ids = meta['parl_memb_ids']
+            self.voting_ids = meta['voting_ids']
+
+    @property
+    def shape(self):
+        return len(self.parl_memb_ids), len(self.voting_ids)
+
+    def load(self, mmap_mode='r'):
+        """Returns the matrix - memory mapped read only by default"""
+        if not self.voting_ids:
+            return numpy.zeros(self.shape, dtype=numpy.int8)
+        return numpy.load(self.path, mmap_mode=mmap_mode)
+
+    def update(self, session):
+        """
+        Appends votings stored since the last update; returns the number of
+        appended votings. Votings are appended in the order of their ids up to
+        the first voting whose votes are not complete (see psp_cz.progress) -
+        later updates continue with it, columns are never changed.
+
+        """
+        query = session.query(TVoting.id, TVoting.votes_expected, TVoting.votes_stored) \
+                       .filter(TVoting.id > max(self.voting_ids or [0]))
+        if self.term is not None:
+            query = query.filter(TVoting.term == self.term)
+        new_voting_ids = []
+        for id, votes_expected, votes_stored in query.order_by(TVoting.id):
+            if votes_expected is None or votes_stored is None or votes_stored < votes_expected:
+                break
+            new_voting_ids.append(id)
+
+        appended = 0
+        for start in xrange(0, len(new_voting_ids), VOTINGS_CHUNK_SIZE):
+            chunk = new_voting_ids[start:start + VOTINGS_CHUNK_SIZE]
+            votes = self.get_votes(session, chunk)
+            voting_ids = []
+            for voting_id in chunk:
+                if not votes[voting_id]:
+                    break
+                voting_ids.append(voting_id)
+            self.append(voting_ids, [votes[voting_id] for voting_id in voting_ids])
+            appended += len(voting_ids)
+            if len(voting_ids) < len(chunk):
+                break
+        return appended
+
+    def get_votes(self, session, voting_ids):
+        """Returns dictionary of voting id -> {parliament member id: vote}"""
+        # votes may be stored as rows, packed or both (VOTE_STORAGE setting)
+        votes = get_parl_memb_votes(session, voting_ids)
+        query = session.query(TParlMembVoting.voting_id, TParlMembVoting.parl_memb_id, TParlMembVoting.vote) \
+                       .filter(TParlMembVoting.voting_id.in_(voting_ids))
+        if self.term is not None:
+            # reads only the partition of the term (see psp_cz.partitions)
+            query = query.filter(TParlMembVoting.term == self.term)
+        for voting_id, parl_memb_id, vote in query:
+            votes[voting_id][parl_memb_id] = vote
+        return votes
+
+    def append(self, voting_ids, votings_votes):
+        """Appends columns of votings; votings_votes are {parliament member id: vote}"""
+        if not voting_ids:
+            return
+        rows = dict((parl_memb_id, row) for row, parl_memb_id in enumerate(self.parl_memb_ids))
+        new_parl_memb_ids = sorted(set(parl_memb_id for votes in votings_votes for parl_memb_id in votes)
+                                   .difference(rows))
+        if new_parl_memb_ids:
+            self.add_rows(new_parl_memb_ids)
+            rows.update((parl_memb_id, row) for row, parl_memb_id in enumerate(self.parl_memb_ids))
+
+        columns = numpy.zeros((len(voting_ids), len(self.parl_memb_ids)), dtype=numpy.int8)
+        for column, votes in enumerate(votings_votes):
+            for parl_memb_id, vote in votes.iteritems():
+                columns[column, rows[parl_memb_id]] = VOTE_CODES[vote]
+
+        mode = 'r+b' if self.voting_ids else 'w+b'
+        with open(self.path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            f.write(max(NPY_HEADER_SIZE - f.tell(), 0) * ' ')
+            # rows of C ordered columns array are the columns of the matrix
+            f.write(columns.tostring())
+            self.voting_ids.extend(voting_ids)
+            self.write_header(f)
+        self.write_meta()
+
+    def add_rows(self, parl_memb_ids):
+        """Adds rows of parliament members - the whole file is rewritten"""
+        stored = self.load(mmap_mode='r')
+        self.parl_memb_ids.extend(parl_memb_ids)
+        matrix = numpy.zeros(self.shape, dtype=numpy.int8, order='F')
+        matrix[:stored.shape[0]] = stored
+        with open(self.path, 'w+b') as f:
+            f.write(NPY_HEADER_SIZE * ' ')
+            f.write(matrix.tostring(order='F'))
+            self.write_header(f)
+        self.write_meta()
+
+    def write_header(self, f):
+        header = "{'descr': '|i1', 'fortran_order': True, 'shape': (%d, %d), }" % self.shape
+        header_len = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+        f.seek(0)
+        f.write(NPY_MAGIC + struct.pack('<H', header_len) + header.ljust(header_len - 1) + '\n')
+
+    def write_meta(self):
+        with open(self.meta_path, 'w') as f:
+            json.dump({'term': self.term,
+                       'parl_memb_ids': self.parl_memb_ids,
+                       'voting_ids': self.voting_ids}, f)
+
+    def get_groups(self, session):
+        """Returns array of political group ids of the rows (-1 if unknown)"""
+        group_ids = dict(session.query(TParlMemb.id, TParlMemb.polit_group_id)
+                                .filter(TParlMemb.id.in_(self.parl_memb_ids)))
+        return numpy.array([group_ids.get(parl_memb_id) or -1 for parl_memb_id in self.parl_memb_ids])
+
+
+def _indicator(matrix, *codes):
+    """float32 matrix with ones where matrix holds one of codes"""
+    result = numpy.zeros(matrix.shape, dtype=numpy.float32)
+    for code in codes:
+        result += (matrix == code)
+    return result
+
+
+def _group_indicator(groups):
+    """Returns unique groups and groups x members indicator matrix"""
+    groups = numpy.asarray(groups)
+    unique_groups = numpy.unique(groups[groups >= 0])
+    return unique_groups, (groups[numpy.newaxis, :] == unique_groups[:, numpy.newaxis]).astype(numpy.float32)
+
+
+def agreement(matrix):
+    """
+    Returns members x members matrix of agreement - ratio of votings where
+    both members voted the same (yes, no or abstain) to the votings where both
+    of them voted. NaN if there is no such voting.
+
+    """
+    same = numpy.zeros((matrix.shape[0], matrix.shape[0]), dtype=numpy.float64)
+    for code in (YES, NO, ABSTAIN):
+        votes = _indicator(matrix, code)
+        same += numpy.dot(votes, votes.T)
+    voted = _indicator(matrix, YES, NO, ABSTAIN)
+    both = numpy.dot(voted, voted.T)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return same / both
+
+
+def rice_cohesion(matrix, groups):
+    """
+    Returns unique groups and groups x votings matrix of Rice index
+    |yes - no| / (yes + no) of the groups. NaN where nobody of the group voted
+    yes or no.
+
+    """
+    unique_groups, members = _group_indicator(groups)
+    yes = numpy.dot(members, _indicator(matrix, YES))
+    no = numpy.dot(members, _indicator(matrix, NO))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return unique_groups, numpy.abs(yes - no) / (yes + no)
+
+
+def attendance(matrix):
+    """
+    Returns ratio of votings each member was present at (voted or did not
+    vote while logged in) to the votings with a vote of the member.
+
+    """
+    present = _indicator(matrix, YES, NO, ABSTAIN, NOT_VOTED).sum(axis=1)
+    recorded = (numpy.asarray(matrix) != 0).sum(axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return present / recorded
+
+
+def against_own_group(matrix, groups):
+    """
+    Returns number of votings where the member voted yes while majority of
+    the member's group voted no or vice versa. Members without a group get zero.
+
+    """
+    groups = numpy.asarray(groups)
+    unique_groups, members = _group_indicator(groups)
+    yes = _indicator(matrix, YES)
+    no = _indicator(matrix, NO)
+    # +1 where group majority voted yes, -1 where no, 0 for a tie
+    majority = numpy.sign(numpy.dot(members, yes) - numpy.dot(members, no))
+    member_majority = numpy.zeros(matrix.shape, dtype=numpy.float32)
+    group_rows = numpy.searchsorted(unique_groups, groups)
+    has_group = groups >= 0
+    member_majority[has_group] = majority[group_rows[has_group]]
+    return ((yes * (member_majority < 0)) + (no * (member_majority > 0))).sum(axis=1).astype(numpy.int64)
@@ -0,0 +1,212 @@
+# coding=utf-8
+"""
+Archive of downloaded responses for parsing them again without network access.
+
+An archive is a pair of files. <spider>-<timestamp>.records.gz holds
+records, every record is a separate gzip member with JSON header (url,
+status, headers) on the first line followed by the response body.
+<spider>-<timestamp>.records.gz.idx holds a line per record with the offset
+and the compressed size of the record and the url of the request, so a
+record is read without decompressing the preceding ones.
+
+ResponseArchiveMiddleware records responses of a crawl into ARCHIVE_DIR, or
+replays responses of archives in ARCHIVE_REPLAY instead of downloading them.
+The replay command (psp_cz.commands.replay) runs replaying crawls in several
+processes.
+
+"""
+import os
+import glob
+import json
+import time
+import zlib
+from cStringIO import StringIO
+from gzip import GzipFile
+
+from scrapy import signals, log
+from scrapy.http import Headers
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.responsetypes import responsetypes
+
+RECORDS_EXTENSION = '.records.gz'
+INDEX_EXTENSION = '.idx'
+
+
+def find_archives(paths, name):
+    """
+    Returns archive files of the spider name in paths - archive files or
+    directories with archives. Archives of a directory are ordered by time.
+
+    """
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(glob.glob(os.path.join(path, '%s-*%s' % (name, RECORDS_EXTENSION)))))
+        else:
+            result.append(path)
+    return result
+
+
+class ArchiveWriter(object):
+    """Appends responses to a new archive file"""
+
+    def __init__(self, path, compress_level=6):
+        self.path = path
+        self.compress_level = compress_level
+        self.file = open(path, 'wb')
+        self.index = open(path + INDEX_EXTENSION, 'w')
+        self.size = 0
+        self.records = 0
+
+    def write(self, url, response):
+        """Stores response under url of its request"""
+        header = {'url': response.url,
+                  'status': response.status,
+                  # header values are bytes, latin-1 maps them to unicode and back
+                  'headers': dict((name, [value.decode('latin-1') for value in values])
+                                  for name, values in response.headers.iteritems())}
+        buf = StringIO()
+        member = GzipFile(fileobj=buf, mode='wb', compresslevel=self.compress_level)
+        member.write(json.dumps(header))
+        member.write('\n')
+        member.write(response.body)
+        member.close()
+        record = buf.getvalue()
+
+        self.file.write(record)
+        # the record is written before its index line, an interrupted crawl
+        # leaves a readable archive
+        self.file.flush()
+        self.index.write('%d\t%d\t%s\n' % (self.size, len(record), url))
+        self.index.flush()
+        self.size += len(record)
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class ResponseArchive(object):
+    """
+    Reads responses of archive files. A url recorded in several archives
+    is read from the last of them.
+
+    """
+    def __init__(self, paths):
+        self.paths = list(paths)
+        # url -> (path, offset, size)
+        self.index = {}
+        self.files = {}
+        for path in self.paths:
+            with open(path + INDEX_EXTENSION) as f:
+                for line in f:
+                    offset, size, url = line.rstrip('\n').split('\t', 2)
+                    self.index[url] = (path, int(offset), int(size))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def get(self, url):
+        """Returns the response recorded for url or None"""
+        if url not in self.index:
+            return None
+        path, offset, size = self.index[url]
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = open(path, 'rb')
+        f.seek(offset)
+        data = zlib.decompress(f.read(size), 16 + zlib.MAX_WBITS)
+        header, body = data.split('\n', 1)
+        header = json.loads(header)
+        headers = Headers(dict((name, [value.encode('latin-1') for value in values])
+                               for name, values in header['headers'].iteritems()))
+        url = header['url'].encode('utf-8')
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, status=header['status'], headers=headers, body=body)
+
+    def close(self):
+        for f in self.files.itervalues():
+            f.close()
+        self.files = {}
+
+
+class ResponseArchiveMiddleware(object):
+    """
+    Downloader middleware which records responses into an archive in
+    ARCHIVE_DIR, or which replays responses of archives in ARCHIVE_REPLAY
+    (archive files or directories with archives of the spider) instead of
+    downloading them. Requests not found in the replayed archives are
+    ignored, nothing is downloaded.
+
+    The middleware sits next to the downloader so raw responses are recorded
+    and replayed responses pass redirects, decompression etc. like downloaded
+    ones. 304 Not Modified responses to conditional requests of the page cache
+    (psp_cz.pagecache) have no body and are not recorded - replay of a
+    directory reads the page from an older archive.
+
+    """
+    def __init__(self, stats, directory=None, replay=None, compress_level=6):
+        self.stats = stats
+        self.directory = directory
+        self.replay = replay or []
+        self.compress_level = compress_level
+        self.writer = None
+        self.archive = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = settings.get('ARCHIVE_DIR')
+        replay = settings.getlist('ARCHIVE_REPLAY')
+        if not directory and not replay:
+            raise NotConfigured
+        o = cls(crawler.stats, directory, replay, settings.getint('ARCHIVE_COMPRESS_LEVEL', 6))
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        if self.replay:
+            self.archive = ResponseArchive(find_archives(self.replay, spider.name))
+            log.msg('Replaying %d responses from %s' % (len(self.archive), ', '.join(self.archive.paths)),
+                    spider=spider)
+        elif self.directory:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, '%s-%s%s' % (spider.name, time.strftime('%Y%m%d%H%M%S'),
+                                                             RECORDS_EXTENSION))
+            self.writer = ArchiveWriter(path, self.compress_level)
+            log.msg('Recording responses into %s' % path, spider=spider)
+
+    def spider_closed(self, spider):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self.writer is not None:
+            self.writer.close()
+            log.msg('Recorded %d responses into %s' % (self.writer.records, self.writer.path),
+                    spider=spider)
+            self.writer = None
+
+    def process_request(self, request, spider):
+        if self.archive is None:
+            return
+        response = self.archive.get(request.url)
+        if response is None:
+            self.stats.inc_value('archive/missing', spider=spider)
+            raise IgnoreRequest('Request not in the archive: %s' % request)
+        response.flags.append('archived')
+        self.stats.inc_value('archive/replayed', spider=spider)
+        return response
+
+    def process_response(self, request, response, spider):
+        if response.status == 304:
+            return response
+        if self.writer is not None and 'archived' not in response.flags:
+            self.writer.write(request.url, response)
+            self.stats.inc_value('archive/recorded', spider=spider)
+        return response
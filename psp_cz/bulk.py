@@ -0,0 +1,309 @@
+# coding=utf-8
+import sqlite3
+from collections import defaultdict
+from cStringIO import StringIO
+
+from sqlalchemy import and_, bindparam, func
+
+from .votes import get_vote_code, get_parl_memb_votes, filter_known_votes
+from .partitions import is_partitioned
+from .psp_cz_models import ParlMembVoting as TParlMembVoting
+from .psp_cz_models import VotingVotes as TVotingVotes
+from .psp_cz_models import TermMembSlot as TTermMembSlot
+
+# Bulk writers of ParlMembVoting rows. The rows are dictionaries with keys
+# vote, parl_memb_id, voting_id and term (term of the voting). Conflicts with already stored votes (see
+# the unique constraint on parl_memb_id and voting_id) are resolved according
+# to the conflict parameter:
+#     ignore - stored vote is kept
+#     update - stored vote is replaced by the new one
+#
+# Votes are stored as ParlMembVoting rows, packed into VotingVotes rows or
+# both according to the storage parameter of get_vote_writer().
+
+CONFLICT_MODES = ('ignore', 'update')
+STORAGE_MODES = ('rows', 'packed', 'both')
+
+# term of votings whose sitting has no term
+UNKNOWN_TERM = 0
+
+# statements are built once so that the engine reuses their compiled form
+# (see DB_STATEMENT_CACHE_SIZE setting)
+VOTE_INSERT = TParlMembVoting.__table__.insert()
+VOTE_INSERT_IGNORE = TParlMembVoting.__table__.insert().prefix_with('OR IGNORE')
+VOTE_UPDATE = TParlMembVoting.__table__.update() \
+                  .where(and_(TParlMembVoting.__table__.c.parl_memb_id == bindparam('b_parl_memb_id'),
+                              TParlMembVoting.__table__.c.voting_id == bindparam('b_voting_id'))) \
+                  .values(vote=bindparam('b_vote'))
+VOTING_VOTES_INSERT = TVotingVotes.__table__.insert()
+VOTING_VOTES_UPDATE = TVotingVotes.__table__.update() \
+                          .where(TVotingVotes.__table__.c.voting_id == bindparam('b_voting_id')) \
+                          .values(votes=bindparam('b_votes'), last_modified=func.now())
+SLOT_INSERT = TTermMembSlot.__table__.insert()
+
+
+def unique_votes(rows, conflict='ignore'):
+    """
+    Returns rows with one vote of a parliament member in a voting - the first
+    one when conflicts are ignored, the last one when they are updated, the
+    same vote the other writers keep.
+
+    """
+    unique = {}
+    for row in rows:
+        key = (row['parl_memb_id'], row['voting_id'])
+        if conflict == 'update' or key not in unique:
+            unique[key] = row
+    if len(unique) == len(rows):
+        return rows
+    return unique.values()
+
+
+class VoteWriter(object):
+    """
+    Portable writer - inserts new rows by executemany and updates changed ones.
+    It does not resolve conflicts by itself so the caller has to pass stored
+    votes of the affected votings.
+
+    """
+    resolves_conflicts = False
+
+    def __init__(self, conflict='ignore'):
+        if conflict not in CONFLICT_MODES:
+            raise ValueError('Unknown conflict mode %s' % conflict)
+        self.conflict = conflict
+
+    def clear(self):
+        """Forgets cached data - called when a write fails"""
+        pass
+
+    def write(self, session, rows, stored_votes=None):
+        """
+        Writes rows using session. stored_votes maps voting id to dictionary
+        of parliament member id -> stored vote.
+
+        """
+        inserts = []
+        updates = []
+        for row in rows:
+            stored = stored_votes[row['voting_id']]
+            if row['parl_memb_id'] not in stored:
+                inserts.append(row)
+            elif self.conflict == 'update' and stored[row['parl_memb_id']] != row['vote']:
+                updates.append({'b_vote': row['vote'],
+                                'b_parl_memb_id': row['parl_memb_id'],
+                                'b_voting_id': row['voting_id']})
+            stored[row['parl_memb_id']] = row['vote']
+
+        if inserts:
+            session.execute(VOTE_INSERT, inserts)
+        if updates:
+            session.execute(VOTE_UPDATE, updates)
+
+
+class SQLiteVoteWriter(VoteWriter):
+    """Writer using INSERT OR IGNORE (or upsert if SQLite supports it)"""
+    resolves_conflicts = True
+
+    # ON CONFLICT clause is available since SQLite 3.24
+    UPSERT = """INSERT INTO parl_memb_voting (vote, parl_memb_id, voting_id, term, created, last_modified)
+                VALUES (:vote, :parl_memb_id, :voting_id, :term, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (parl_memb_id, voting_id) DO UPDATE
+                SET vote = excluded.vote, last_modified = excluded.last_modified
+                WHERE vote <> excluded.vote"""
+
+    def write(self, session, rows, stored_votes=None):
+        if not rows:
+            return
+        if self.conflict == 'update' and sqlite3.sqlite_version_info >= (3, 24):
+            session.execute(self.UPSERT, rows)
+        else:
+            session.execute(VOTE_INSERT_IGNORE, rows)
+
+
+class PostgresVoteWriter(VoteWriter):
+    """
+    Writer which COPYs the rows into a temporary staging table and merges them
+    into parl_memb_voting by a single INSERT ... ON CONFLICT statement. The
+    unique constraint of partitioned votes contains term (see
+    psp_cz.partitions) and so does the conflict target then. Duplicate votes
+    are removed before COPY (see unique_votes).
+
+    """
+    resolves_conflicts = True
+
+    CREATE_STAGE = """CREATE TEMPORARY TABLE IF NOT EXISTS parl_memb_voting_stage (
+                          vote VARCHAR(1) NOT NULL,
+                          parl_memb_id INTEGER NOT NULL,
+                          voting_id INTEGER NOT NULL,
+                          term INTEGER NOT NULL
+                      ) ON COMMIT DELETE ROWS"""
+    COPY = "COPY parl_memb_voting_stage (vote, parl_memb_id, voting_id, term) FROM STDIN"
+    MERGE = """INSERT INTO parl_memb_voting (vote, parl_memb_id, voting_id, term, last_modified)
+               SELECT vote, parl_memb_id, voting_id, term, now()
+               FROM parl_memb_voting_stage
+               ON CONFLICT (%s) %s"""
+    ON_CONFLICT = {
+        'ignore': "DO NOTHING",
+        'update': """DO UPDATE SET vote = EXCLUDED.vote, last_modified = EXCLUDED.last_modified
+                     WHERE parl_memb_voting.vote <> EXCLUDED.vote""",
+    }
+
+    def __init__(self, conflict='ignore', partitioned=False):
+        super(PostgresVoteWriter, self).__init__(conflict)
+        if partitioned:
+            self.conflict_target = 'parl_memb_id, voting_id, term'
+        else:
+            self.conflict_target = 'parl_memb_id, voting_id'
+
+    def write(self, session, rows, stored_votes=None):
+        if not rows:
+            return
+        connection = session.connection()
+        connection.execute(self.CREATE_STAGE)
+
+        data = StringIO()
+        for row in unique_votes(rows, self.conflict):
+            data.write('%s\t%d\t%d\t%d\n' % (row['vote'], row['parl_memb_id'], row['voting_id'], row['term']))
+        data.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(self.COPY, data)
+        finally:
+            cursor.close()
+
+        connection.execute(self.MERGE % (self.conflict_target, self.ON_CONFLICT[self.conflict]))
+        connection.execute("TRUNCATE parl_memb_voting_stage")
+
+
+class PackedVoteWriter(VoteWriter):
+    """
+    Writer of packed votes (see votes module) - merges the rows into
+    VotingVotes rows of their votings.
+
+    """
+    resolves_conflicts = True
+
+    def __init__(self, conflict='ignore'):
+        super(PackedVoteWriter, self).__init__(conflict)
+        # term -> {parliament member id: slot}
+        self.slots = {}
+
+    def clear(self):
+        self.slots.clear()
+
+    def write(self, session, rows, stored_votes=None):
+        rows = filter_known_votes(rows)
+        if not rows:
+            return
+        voting_rows = defaultdict(list)
+        for row in rows:
+            voting_rows[row['voting_id']].append(row)
+
+        stored = dict((voting_id, bytearray(votes)) for voting_id, votes in
+                      session.query(TVotingVotes.voting_id, TVotingVotes.votes)
+                             .filter(TVotingVotes.voting_id.in_(voting_rows.keys())))
+
+        inserts = []
+        updates = []
+        for voting_id, voting_votes in voting_rows.iteritems():
+            term = voting_votes[0]['term']
+            slots = self.get_slots(session, term, set(row['parl_memb_id'] for row in voting_votes))
+            votes = stored.get(voting_id, bytearray())
+            changed = False
+            for row in voting_votes:
+                slot = slots[row['parl_memb_id']]
+                if slot >= len(votes):
+                    votes.extend(bytearray(slot + 1 - len(votes)))
+                code = get_vote_code(row['vote'])
+                if votes[slot] == code or (votes[slot] and self.conflict == 'ignore'):
+                    continue
+                votes[slot] = code
+                changed = True
+
+            if voting_id not in stored:
+                inserts.append({'voting_id': voting_id, 'term': term, 'votes': str(votes)})
+            elif changed:
+                updates.append({'b_voting_id': voting_id, 'b_votes': str(votes)})
+
+        if inserts:
+            session.execute(VOTING_VOTES_INSERT, inserts)
+        if updates:
+            session.execute(VOTING_VOTES_UPDATE, updates)
+
+    def get_slots(self, session, term, parl_memb_ids):
+        """Returns slots of parliament members in term, missing slots are allocated"""
+        if term not in self.slots:
+            self.slots[term] = dict(session.query(TTermMembSlot.parl_memb_id, TTermMembSlot.slot)
+                                           .filter(TTermMembSlot.term == term))
+        slots = self.slots[term]
+        new_slots = []
+        for parl_memb_id in sorted(parl_memb_ids):
+            if parl_memb_id not in slots:
+                slots[parl_memb_id] = len(slots)
+                new_slots.append({'term': term, 'slot': slots[parl_memb_id],
+                                  'parl_memb_id': parl_memb_id})
+        if new_slots:
+            session.execute(SLOT_INSERT, new_slots)
+        return slots
+
+
+class MultiVoteWriter(object):
+    """Writes the rows by all writers"""
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.resolves_conflicts = all(writer.resolves_conflicts for writer in writers)
+
+    def clear(self):
+        for writer in self.writers:
+            writer.clear()
+
+    def write(self, session, rows, stored_votes=None):
+        for writer in self.writers:
+            if stored_votes is not None and not writer.resolves_conflicts:
+                # writer updates stored votes, every writer needs its own copy
+                writer_stored_votes = dict((voting_id, dict(votes))
+                                           for voting_id, votes in stored_votes.iteritems())
+            else:
+                writer_stored_votes = stored_votes
+            writer.write(session, rows, writer_stored_votes)
+
+
+def get_stored_votes(session, voting_ids, storage='rows'):
+    """
+    Returns stored votes of votings as dictionary of voting id ->
+    {parliament member id: vote}. Packed votes are read when storage is
+    'packed', rows otherwise.
+
+    """
+    if storage == 'packed':
+        return get_parl_memb_votes(session, voting_ids)
+    result = dict((voting_id, {}) for voting_id in voting_ids)
+    if result:
+        for voting_id, parl_memb_id, vote in session.query(TParlMembVoting.voting_id,
+                                                           TParlMembVoting.parl_memb_id,
+                                                           TParlMembVoting.vote) \
+                                                    .filter(TParlMembVoting.voting_id.in_(result.keys())):
+            result[voting_id][parl_memb_id] = vote
+    return result
+
+
+def get_row_vote_writer(engine, conflict='ignore'):
+    """Returns writer of ParlMembVoting rows suitable for the database dialect of engine"""
+    if engine.dialect.name == 'postgresql':
+        return PostgresVoteWriter(conflict, is_partitioned(engine))
+    elif engine.dialect.name == 'sqlite':
+        return SQLiteVoteWriter(conflict)
+    return VoteWriter(conflict)
+
+
+def get_vote_writer(engine, conflict='ignore', storage='rows'):
+    """Returns vote writer for the database of engine and vote storage"""
+    if storage not in STORAGE_MODES:
+        raise ValueError('Unknown vote storage %s' % storage)
+    if storage == 'rows':
+        return get_row_vote_writer(engine, conflict)
+    elif storage == 'packed':
+        return PackedVoteWriter(conflict)
+    return MultiVoteWriter([get_row_vote_writer(engine, conflict), PackedVoteWriter(conflict)])
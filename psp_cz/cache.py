@@ -0,0 +1,49 @@
+# coding=utf-8
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded mapping which evicts the least recently used entries when it
+    grows over max_size.
+
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # re-insert the key to mark it as the most recently used one
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def update(self, mapping):
+        for key, value in mapping.iteritems():
+            self.put(key, value)
+
+    def invalidate(self, keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
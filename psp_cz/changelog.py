@@ -0,0 +1,115 @@
+# coding=utf-8
+"""
+Log of rows inserted and changed by crawls.
+
+DBStorePipeline compares crawled values with the stored ones and updates
+only rows which differ, last_modified of an updated row is set to the time
+of the update. Every inserted or updated row of sitting, voting, parl_memb,
+region and polit_group tables is recorded in change_log table in the same
+transaction - id of the spider run, the table, id of the row, the operation
+and new values of the changed columns (all values of an inserted row) as
+JSON object. Votes are not logged, there are too many of them - a consumer
+reads votes of the logged votings.
+
+Consumers keep id of the last record they processed and read only newer
+records (read_changes) instead of comparing whole tables. Records of
+concurrent transactions (parallel replay workers) may be committed out of
+the order of their ids.
+
+"""
+import os
+import json
+import time
+import datetime
+
+from sqlalchemy import Date
+
+from .psp_cz_models import ChangeLog as TChangeLog
+
+INSERT = 'I'
+UPDATE = 'U'
+
+CHANGE_LOG_INSERT = TChangeLog.__table__.insert()
+
+
+def new_run_id(name):
+    """Returns id of a new run of the spider name"""
+    return '%s-%s-%d' % (name, time.strftime('%Y%m%d%H%M%S'), os.getpid())
+
+
+def get_changed(row, values):
+    """
+    Returns dict of values which differ from the attributes of the stored
+    row (mapped object or result row).
+
+    """
+    changed = {}
+    for key, value in values.iteritems():
+        stored = getattr(row, key)
+        # parsers return datetime for date columns
+        if isinstance(value, datetime.datetime) and isinstance(stored, datetime.date) and \
+                not isinstance(stored, datetime.datetime):
+            value = value.date()
+        if value != stored:
+            changed[key] = value
+    return changed
+
+
+def to_json(table, values):
+    result = {}
+    for key, value in values.iteritems():
+        if isinstance(value, datetime.datetime) and isinstance(table.c[key].type, Date):
+            value = value.date()
+        if isinstance(value, datetime.date):
+            value = value.isoformat()
+        result[key] = value
+    return json.dumps(result, sort_keys=True, separators=(',', ':'))
+
+
+class ChangeLog(object):
+    """Change records of a transaction, written by write() before its commit"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.records = []
+
+    def inserted(self, table, row_id, values):
+        """Records row of the table inserted with values"""
+        self.records.append({'run_id': self.run_id,
+                             'table_name': table.name,
+                             'row_id': row_id,
+                             'operation': INSERT,
+                             'changed': to_json(table, values)})
+
+    def updated(self, table, row_id, changed):
+        """Records row of the table updated with changed values"""
+        self.records.append({'run_id': self.run_id,
+                             'table_name': table.name,
+                             'row_id': row_id,
+                             'operation': UPDATE,
+                             'changed': to_json(table, changed)})
+
+    def write(self, session):
+        if self.records:
+            session.execute(CHANGE_LOG_INSERT, self.records)
+        self.clear()
+
+    def clear(self):
+        self.records = []
+
+
+def read_changes(session, cursor=0, limit=1000, tables=None):
+    """
+    Returns at most limit change records with id greater than cursor - list
+    of (id, run_id, table_name, row_id, operation, changed values) ordered
+    by id. Id of the last record is the cursor of the next call.
+
+    """
+    query = session.query(TChangeLog.id, TChangeLog.run_id, TChangeLog.table_name,
+                          TChangeLog.row_id, TChangeLog.operation, TChangeLog.changed) \
+                   .filter(TChangeLog.id > cursor)
+    if tables:
+        query = query.filter(TChangeLog.table_name.in_(tables))
+    return [(id, run_id, table_name, row_id, operation, json.loads(changed))
+            for id, run_id, table_name, row_id, operation, changed
+            in query.order_by(TChangeLog.id).limit(limit)]
@@ -0,0 +1,4 @@
+# Scrapy commands of the psp_cz project - see COMMANDS_MODULE setting
+#
+# For more info see:
+# http://doc.scrapy.org/topics/commands.html
@@ -0,0 +1,37 @@
+from scrapy.command import ScrapyCommand
+
+from psp_cz.database import db_session, init_db
+from psp_cz.database import configure as configure_db
+from psp_cz.aggregates import check_aggregates
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Compare summary tables of votes with the stored votes"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--show", type="int", default=20,
+                          help="number of differences to print (default: 20)")
+
+    def run(self, args, opts):
+        configure_db(self.settings)
+        init_db()
+        try:
+            differences = check_aggregates(db_session, self.settings.get('VOTE_STORAGE', 'rows'))
+        finally:
+            db_session.remove()
+
+        for table, key, stored, expected in differences[:opts.show]:
+            print '%s %s: stored %d, expected %d' % (table, key, stored, expected)
+        if differences:
+            print '%d differences found - run scrapy rebuild_aggregates' % len(differences)
+            self.exitcode = 1
+        else:
+            print 'Summary tables of votes are consistent'
@@ -0,0 +1,40 @@
+from scrapy import log
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from psp_cz.database import db_session, init_db
+from psp_cz.database import configure as configure_db
+from psp_cz.partitions import delete_term
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <term>"
+
+    def short_desc(self):
+        return "Delete sittings, votings and votes of a term"
+
+    def long_desc(self):
+        return "Delete sittings, votings, votes and summary counts of votes of the term. " \
+               "The partition of the term is dropped when votes are partitioned (see " \
+               "partition_votes command)."
+
+    def run(self, args, opts):
+        if len(args) != 1 or not args[0].isdigit():
+            raise UsageError()
+        term = int(args[0])
+
+        configure_db(self.settings)
+        init_db()
+        try:
+            delete_term(db_session.connection(), term)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.remove()
+        log.msg('Term %d deleted' % term)
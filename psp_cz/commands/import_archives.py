@@ -0,0 +1,32 @@
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from psp_cz.database import configure as configure_db
+from psp_cz.importer import ArchiveImporter
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <archive.zip> ..."
+
+    def short_desc(self):
+        return "Import psp.cz open data archives (poslanci.zip, hl-<year>ps.zip)"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--term", type="int",
+                          help="term of the votings when poslanci.zip is not imported")
+
+    def run(self, args, opts):
+        if not args:
+            raise UsageError()
+
+        configure_db(self.settings)
+        importer = ArchiveImporter(term=opts.term,
+                                   vote_conflict=self.settings.get('DB_VOTE_CONFLICT', 'ignore'),
+                                   vote_storage=self.settings.get('VOTE_STORAGE', 'rows'),
+                                   aggregates=self.settings.getbool('DB_AGGREGATES', True))
+        importer.import_archives(args)
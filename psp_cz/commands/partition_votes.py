@@ -0,0 +1,42 @@
+from scrapy import log
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from psp_cz.database import db_session, init_db, get_engine
+from psp_cz.database import configure as configure_db
+from psp_cz.partitions import partition_votes, create_term_partitions
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Partition votes by term (PostgreSQL only)"
+
+    def long_desc(self):
+        return "Convert parl_memb_voting table into a table partitioned by term (see " \
+               "psp_cz.partitions) and create partitions of all stored terms. Votes of " \
+               "terms crawled later are stored in the default partition until the command " \
+               "is run again."
+
+    def run(self, args, opts):
+        configure_db(self.settings)
+        init_db()
+        if get_engine().dialect.name != 'postgresql':
+            raise UsageError("Votes can be partitioned on PostgreSQL only", print_help=False)
+        try:
+            connection = db_session.connection()
+            if partition_votes(connection):
+                log.msg('Votes partitioned by term')
+            for term in create_term_partitions(connection):
+                log.msg('Created partition of votes of term %d' % term)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.remove()
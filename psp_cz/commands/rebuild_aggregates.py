@@ -0,0 +1,30 @@
+from scrapy import log
+from scrapy.command import ScrapyCommand
+
+from psp_cz.database import db_session, init_db
+from psp_cz.database import configure as configure_db
+from psp_cz.aggregates import rebuild_aggregates
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Regenerate summary tables of votes from the stored votes"
+
+    def run(self, args, opts):
+        configure_db(self.settings)
+        init_db()
+        try:
+            rebuild_aggregates(db_session, self.settings.get('VOTE_STORAGE', 'rows'))
+            db_session.commit()
+        except:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.remove()
+        log.msg('Summary tables of votes rebuilt')
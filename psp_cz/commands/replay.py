@@ -0,0 +1,82 @@
+import sys
+import subprocess
+
+from scrapy.command import ScrapyCommand
+from scrapy.utils.conf import arglist_to_dict
+from scrapy.exceptions import UsageError
+
+from psp_cz.database import init_db
+from psp_cz.database import configure as configure_db
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider> [archive ...]"
+
+    def short_desc(self):
+        return "Parse recorded responses again without network access"
+
+    def long_desc(self):
+        return "Run the spider on responses recorded in archives (see psp_cz.archive) " \
+               "in parallel worker processes. Archives are files or directories, " \
+               "ARCHIVE_DIR setting is used when none is given. Workers run the spider " \
+               "in reparse mode, each one parses its share of sittings, and overwrite " \
+               "stored votings and votes (DB_VOTE_CONFLICT=update)."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-w", "--workers", type="int", default=1,
+                          help="number of worker processes (default: 1)")
+        parser.add_option("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                          help="set spider argument (may be repeated)")
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+
+    def run(self, args, opts):
+        if not args:
+            raise UsageError()
+        spider = args[0]
+        archives = args[1:] or [self.settings.get('ARCHIVE_DIR')]
+        if not all(archives):
+            raise UsageError("No archive given and ARCHIVE_DIR setting is not set")
+        if opts.workers < 1:
+            raise UsageError("Number of workers must be positive")
+
+        # the schema is created before the workers start using it
+        configure_db(self.settings)
+        init_db()
+
+        workers = []
+        for k in range(opts.workers):
+            command = [sys.executable, '-m', 'scrapy.cmdline', 'crawl', spider,
+                       '-s', 'ARCHIVE_REPLAY=' + ','.join(archives),
+                       '-s', 'DB_VOTE_CONFLICT=update',
+                       '-s', 'PAGE_CACHE_FILE=',
+                       '-a', 'mode=reparse']
+            if opts.workers > 1:
+                command += ['-a', 'shard=%d/%d' % (k, opts.workers)]
+            # options of the command override the defaults above
+            for setting in opts.set:
+                command += ['-s', setting]
+            for argument in opts.spargs:
+                command += ['-a', argument]
+            if opts.logfile:
+                command += ['--logfile', '%s.%d' % (opts.logfile, k)]
+            if opts.loglevel:
+                command += ['--loglevel', opts.loglevel]
+            if opts.nolog:
+                command += ['--nolog']
+            workers.append(subprocess.Popen(command))
+
+        failed = [k for k, worker in enumerate(workers) if worker.wait() != 0]
+        if failed:
+            print 'Workers %s failed' % ', '.join(str(k) for k in failed)
+            self.exitcode = 1
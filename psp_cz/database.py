@@ -1,13 +1,78 @@
 import os
+import threading
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.util import LRUCache
 
-engine = create_engine(os.environ['DATABASE_URL'], convert_unicode=True)
-db_session = scoped_session(sessionmaker(autocommit=False,
-                                         autoflush=False,
-                                         bind=engine))
+# The engine is created on the first use, not at import, so that commands
+# which do not work with the database do not need it configured. Its options
+# come from the Scrapy settings passed to configure() (see DATABASE_URL and
+# DB_* settings), the DATABASE_URL environment variable is used otherwise.
+_engine = None
+_options = {}
+_initialized = False
+_lock = threading.RLock()
+
+Session = sessionmaker(autocommit=False, autoflush=False)
+
+def configure(settings):
+    """Sets options of the engine from Scrapy settings unless it is created already"""
+    with _lock:
+        if _engine is not None:
+            return
+        _options.update(url=settings.get('DATABASE_URL'),
+                        pool_size=settings.getint('DB_POOL_SIZE', 5),
+                        max_overflow=settings.getint('DB_POOL_MAX_OVERFLOW', 10),
+                        pool_recycle=settings.getint('DB_POOL_RECYCLE', 3600),
+                        pre_ping=settings.getbool('DB_POOL_PRE_PING', True),
+                        statement_cache_size=settings.getint('DB_STATEMENT_CACHE_SIZE', 500))
+
+def get_engine():
+    """Returns the engine, creates it on the first call"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = _create_engine(**_options)
+        return _engine
+
+def _create_engine(url=None, pool_size=5, max_overflow=10, pool_recycle=3600, pre_ping=True,
+                   statement_cache_size=500):
+    url = url or os.environ.get('DATABASE_URL')
+    if not url:
+        raise ValueError('Database is not configured - set DATABASE_URL')
+
+    kwargs = {'convert_unicode': True, 'pool_recycle': pool_recycle}
+    if statement_cache_size:
+        # compiled forms of statements executed repeatedly (e.g. by the bulk
+        # vote writers) are reused
+        kwargs['execution_options'] = {'compiled_cache': LRUCache(statement_cache_size)}
+    if not make_url(url).drivername.startswith('sqlite'):
+        # SQLite uses pools without size limits
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+    engine = create_engine(url, **kwargs)
+    if pre_ping:
+        event.listen(engine.pool, 'checkout', _ping_connection)
+    return engine
+
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Replaces connections closed by the server before they are used"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        # the pool retries the checkout with a new connection
+        raise exc.DisconnectionError()
+    cursor.close()
+
+def create_session():
+    """Returns a new session bound to the engine - the caller closes it"""
+    return Session(bind=get_engine())
+
+# thread local session of commands and scripts
+db_session = scoped_session(create_session)
 Base = declarative_base()
 Base.query = db_session.query_property()
 
@@ -16,4 +81,14 @@ def init_db():
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
     import psp_cz_models
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    import migrations
+    global _initialized
+    # the spider and the pipelines call it when they are opened - the schema
+    # is created and upgraded once
+    with _lock:
+        if _initialized:
+            return
+        engine = get_engine()
+        Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+        _initialized = True
@@ -0,0 +1,215 @@
+# coding=utf-8
+"""
+Compact store of item fingerprints used by DuplicatesPipeline.
+
+Item ids are reduced to 64-bit keys kept in an open addressing hash table.
+Votes of parliament members are keyed by the (voting number, psp.cz member
+id) pair, other items by a hash of their id.
+The table lives in a memory-mapped file, so it survives between runs, or in
+anonymous memory when no file is given. An optional Bloom filter in front of
+the table answers most lookups of new items without probing the table.
+
+"""
+import os
+import re
+import mmap
+import struct
+import hashlib
+
+MAGIC = 'PSPDEDUP'
+# magic, capacity, number of stored fingerprints
+HEADER = struct.Struct('<8sQQ')
+SLOT = struct.Struct('<Q')
+INITIAL_CAPACITY = 1 << 16
+MAX_LOAD = 0.5
+
+# the highest bit separates (voting, member) pair keys from hashed ids
+PAIR_FLAG = 1 << 63
+VOTING_NO_REGEXP = re.compile(r'[?&]g=([0-9]+)')
+# Fibonacci hashing spreads pair keys, which differ mostly in a few bits, over
+# the whole table
+GOLDEN_RATIO = 0x9e3779b97f4a7c15
+MASK64 = (1 << 64) - 1
+
+
+def mix(value):
+    return (value * GOLDEN_RATIO) & MASK64
+
+
+def item_fingerprint(item):
+    """
+    Returns 64-bit key of item. Zero is never returned as it marks empty
+    slots of the table.
+
+    """
+    item_id = item['id']
+    parl_memb_id = item.get('parl_memb_id')
+    if parl_memb_id is not None and '|' in item_id:
+        # vote id is "<voting url>|<parliament member url>"
+        match = VOTING_NO_REGEXP.search(item_id.split('|', 1)[0])
+        if match:
+            return PAIR_FLAG | int(match.group(1)) << 32 | parl_memb_id
+    if isinstance(item_id, unicode):
+        item_id = item_id.encode('utf-8')
+    return (SLOT.unpack(hashlib.sha1(item_id).digest()[:8])[0] & ~PAIR_FLAG) or 1
+
+
+class FingerprintTable(object):
+    """Open addressing hash set of 64-bit integers in a (file backed) mmap"""
+
+    def __init__(self, path=None, capacity=INITIAL_CAPACITY):
+        self.path = path
+        self.file = None
+        if path and os.path.exists(path) and os.path.getsize(path) > HEADER.size:
+            self._open(path)
+        else:
+            self._create(path, capacity)
+
+    def _map(self, path, capacity):
+        size = HEADER.size + capacity * SLOT.size
+        if path:
+            f = open(path, 'w+b')
+            f.truncate(size)
+            return f, mmap.mmap(f.fileno(), size)
+        return None, mmap.mmap(-1, size)
+
+    def _create(self, path, capacity):
+        self.file, self.map = self._map(path, capacity)
+        self.capacity = capacity
+        self.shift = 64 - capacity.bit_length() + 1
+        self.count = 0
+        self._write_header()
+
+    def _open(self, path):
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.capacity, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a fingerprint table' % path)
+        self.shift = 64 - self.capacity.bit_length() + 1
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for slot in xrange(self.capacity):
+            value = SLOT.unpack_from(self.map, HEADER.size + slot * SLOT.size)[0]
+            if value:
+                yield value
+
+    def _find(self, value):
+        """Returns offset of the slot holding value or of the empty slot for it"""
+        mask = self.capacity - 1
+        slot = mix(value) >> self.shift
+        while True:
+            offset = HEADER.size + slot * SLOT.size
+            stored = SLOT.unpack_from(self.map, offset)[0]
+            if stored == value or stored == 0:
+                return offset, stored
+            slot = (slot + 1) & mask
+
+    def __contains__(self, value):
+        return self._find(value)[1] != 0
+
+    def add(self, value):
+        """Adds value; returns False if it was already stored"""
+        offset, stored = self._find(value)
+        if stored:
+            return False
+        SLOT.pack_into(self.map, offset, value)
+        self.count += 1
+        if self.count > self.capacity * MAX_LOAD:
+            self._grow()
+        return True
+
+    def _grow(self):
+        values = list(self)
+        self.map.close()
+        if self.file:
+            self.file.close()
+        self._create(self.path, self.capacity * 2)
+        for value in values:
+            SLOT.pack_into(self.map, self._find(value)[0], value)
+        self.count = len(values)
+
+    def memory_usage(self):
+        return HEADER.size + self.capacity * SLOT.size
+
+    def close(self):
+        self._write_header()
+        self.map.flush()
+        self.map.close()
+        if self.file:
+            self.file.close()
+
+
+class BloomFilter(object):
+    """Bloom filter over 64-bit fingerprints using double hashing"""
+
+    def __init__(self, bits, hashes=4):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value):
+        value = mix(value)
+        h1 = value & 0xffffffff
+        h2 = (value >> 32) | 1
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def __contains__(self, value):
+        array = self.array
+        for position in self._positions(value):
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, value):
+        array = self.array
+        for position in self._positions(value):
+            array[position >> 3] |= 1 << (position & 7)
+
+    def memory_usage(self):
+        return len(self.array)
+
+
+class FingerprintStore(object):
+    """Fingerprint table with an optional Bloom filter in front of it"""
+
+    def __init__(self, path=None, bloom_bits=0):
+        self.table = FingerprintTable(path)
+        self.bloom = None
+        if bloom_bits:
+            self.bloom = BloomFilter(bloom_bits)
+            for value in self.table:
+                self.bloom.add(value)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, value):
+        if self.bloom is not None and value not in self.bloom:
+            return False
+        return value in self.table
+
+    def add(self, value):
+        """Adds fingerprint; returns False if it was already stored"""
+        if self.bloom is not None:
+            if value not in self.bloom:
+                # certainly new - only the empty slot needs to be found
+                self.bloom.add(value)
+                return self.table.add(value)
+        return self.table.add(value)
+
+    def memory_usage(self):
+        usage = self.table.memory_usage()
+        if self.bloom is not None:
+            usage += self.bloom.memory_usage()
+        return usage
+
+    def close(self):
+        self.table.close()
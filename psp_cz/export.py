@@ -0,0 +1,209 @@
+# coding=utf-8
+"""
+Export of scraped items into compressed files (see ExportPipeline).
+
+Every item type is written into its own series of gzip compressed files in
+JSON Lines or CSV format. A new file of the series is started after
+max_records records. A voting refers to its sitting by sitting_url, a vote
+to its voting by voting_url, so the files can be joined like the database
+tables.
+
+"""
+import os
+import csv
+import gzip
+import json
+import time
+import hashlib
+from cStringIO import StringIO
+from datetime import date, datetime
+
+from .items import ParlMembVote
+from .items import Voting
+from .items import Sitting
+from .items import ParlMemb
+
+FORMATS = ('jsonl', 'csv')
+
+# exported fields of item types
+FIELDS = {
+    'sitting': ['url', 'name', 'term', 'sitting_no'],
+    'voting': ['url', 'voting_nr', 'name', 'voting_date', 'minutes_url', 'result', 'sitting_url', 'term'],
+    'parl_memb_vote': ['voting_url', 'parl_memb_id', 'parl_memb_url', 'parl_memb_name', 'vote'],
+    'parl_memb': ['url', 'parl_memb_id', 'name', 'born', 'gender', 'picture_hash',
+                  'region', 'region_url', 'group', 'group_long', 'group_url'],
+}
+
+
+def get_picture_hash(item):
+    """
+    Picture identifier of ParlMemb item - the hash filled by
+    CachedImagesPipeline or SHA1 hash of the picture url
+    (see ImagesPipeline.image_key())
+
+    """
+    if item.get('picture_hash'):
+        return item['picture_hash']
+    if item.get('image_urls'):
+        return hashlib.sha1(item['image_urls'][0]).hexdigest()
+
+
+def flatten_item(item):
+    """Returns item type and dictionary of exported fields of the item"""
+    record = item
+    if isinstance(item, ParlMembVote):
+        item_type = 'parl_memb_vote'
+    elif isinstance(item, Voting):
+        item_type = 'voting'
+    elif isinstance(item, Sitting):
+        item_type = 'sitting'
+    elif isinstance(item, ParlMemb):
+        item_type = 'parl_memb'
+        record = dict(item, picture_hash=get_picture_hash(item))
+    else:
+        raise ValueError('Unknown item %s' % item.__class__.__name__)
+
+    result = {}
+    for field in FIELDS[item_type]:
+        value = record.get(field)
+        if isinstance(value, datetime):
+            value = value.date()
+        if isinstance(value, date):
+            value = value.isoformat()
+        result[field] = value
+    return item_type, result
+
+
+class ExportFile(object):
+    """
+    Series of gzip compressed files with records of one item type. Records
+    are serialized into a buffer which is compressed and written when it
+    reaches buffer_size bytes.
+
+    """
+    extension = None
+
+    def __init__(self, path_prefix, fields, max_records=1000000, buffer_size=1 << 20,
+                 compress_level=6):
+        self.path_prefix = path_prefix
+        self.fields = fields
+        self.max_records = max_records
+        self.buffer_size = buffer_size
+        self.compress_level = compress_level
+        self.part = 0
+        self.file = None
+        self.records = 0
+        self.total_records = 0
+        self.buffer = StringIO()
+        self.paths = []
+
+    def write(self, record):
+        if self.file is None:
+            self.open_file()
+        self.serialize(record)
+        self.records += 1
+        self.total_records += 1
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+        if self.records >= self.max_records:
+            self.close()
+
+    def open_file(self):
+        self.part += 1
+        path = '%s-%04d.%s.gz' % (self.path_prefix, self.part, self.extension)
+        self.file = gzip.GzipFile(path, 'wb', self.compress_level)
+        self.paths.append(path)
+        self.records = 0
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def serialize(self, record):
+        raise NotImplementedError
+
+    def flush(self):
+        if self.file is not None and self.buffer.tell():
+            self.file.write(self.buffer.getvalue())
+            self.buffer = StringIO()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+class JsonLinesFile(ExportFile):
+    extension = 'jsonl'
+
+    def serialize(self, record):
+        self.buffer.write(json.dumps(record))
+        self.buffer.write('\n')
+
+
+class CsvFile(ExportFile):
+    extension = 'csv'
+
+    def __init__(self, *args, **kwargs):
+        super(CsvFile, self).__init__(*args, **kwargs)
+        self.writer = csv.writer(self.buffer)
+
+    def write_header(self):
+        self.writer.writerow(self.fields)
+
+    def serialize(self, record):
+        row = []
+        for field in self.fields:
+            value = record[field]
+            if value is None:
+                value = ''
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            row.append(value)
+        self.writer.writerow(row)
+
+    def flush(self):
+        super(CsvFile, self).flush()
+        self.writer = csv.writer(self.buffer)
+
+
+FILE_CLASSES = {
+    'jsonl': JsonLinesFile,
+    'csv': CsvFile,
+}
+
+
+class Exporter(object):
+    """
+    Writes items of a crawl into directory. File names are
+    <name>-<item type>-<timestamp>-<part>.<format>.gz
+
+    """
+    def __init__(self, directory, name, format='jsonl', max_records=1000000, buffer_size=1 << 20):
+        if format not in FORMATS:
+            raise ValueError('Unknown export format %s' % format)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.name = name
+        self.format = format
+        self.max_records = max_records
+        self.buffer_size = buffer_size
+        self.timestamp = time.strftime('%Y%m%d%H%M%S')
+        self.files = {}
+
+    def export(self, item):
+        item_type, record = flatten_item(item)
+        export_file = self.files.get(item_type)
+        if export_file is None:
+            path_prefix = os.path.join(self.directory, '%s-%s-%s' % (self.name, item_type, self.timestamp))
+            export_file = self.files[item_type] = FILE_CLASSES[self.format](path_prefix,
+                                                                            FIELDS[item_type],
+                                                                            self.max_records,
+                                                                            self.buffer_size)
+        export_file.write(record)
+
+    def close(self):
+        for export_file in self.files.itervalues():
+            export_file.close()
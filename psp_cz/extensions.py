@@ -0,0 +1,70 @@
+# coding=utf-8
+import json
+import time
+
+from scrapy import signals, log
+from scrapy.exceptions import NotConfigured
+
+from .metrics import metrics
+
+
+class MetricsExtension(object):
+    """
+    Collects crawl metrics (see metrics module) together with download
+    latency and scraped items per item type. When the spider closes they are
+    stored into the stats under metrics/ keys and written into METRICS_REPORT
+    JSON file if the setting is set - %(name)s in the path is replaced by the
+    spider name.
+
+    """
+    def __init__(self, crawler, report=None):
+        self.crawler = crawler
+        self.report = report
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            metrics.enabled = False
+            raise NotConfigured
+        metrics.enabled = True
+        return cls(crawler, crawler.settings.get('METRICS_REPORT'))
+
+    def spider_opened(self, spider):
+        metrics.reset()
+
+    def response_received(self, response, request, spider):
+        latency = response.meta.get('download_latency')
+        if latency is not None:
+            metrics.observe('download/latency', latency)
+
+    def item_scraped(self, item, response, spider):
+        metrics.inc('items/%s' % item.__class__.__name__)
+
+    def spider_closed(self, spider, reason):
+        snapshot = metrics.snapshot()
+        elapsed = snapshot['elapsed']
+        snapshot['items_per_second'] = dict((name.split('/', 1)[1], count / elapsed if elapsed else None)
+                                            for name, count in snapshot['counters'].iteritems()
+                                            if name.startswith('items/'))
+
+        stats = self.crawler.stats
+        for name, histogram in snapshot['histograms'].iteritems():
+            for key in ('count', 'total', 'p50', 'p95', 'max'):
+                stats.set_value('metrics/%s/%s' % (name, key), histogram[key], spider=spider)
+        for name, count in snapshot['counters'].iteritems():
+            stats.set_value('metrics/%s' % name, count, spider=spider)
+        for name, rate in snapshot['items_per_second'].iteritems():
+            stats.set_value('metrics/items_per_second/%s' % name, rate, spider=spider)
+
+        if self.report:
+            path = self.report % {'name': spider.name}
+            snapshot.update({'spider': spider.name,
+                             'reason': reason,
+                             'finished': time.strftime('%Y-%m-%dT%H:%M:%S')})
+            with open(path, 'w') as f:
+                json.dump(snapshot, f, indent=2, sort_keys=True)
+            log.msg('Metrics report written into %s' % path, spider=spider)
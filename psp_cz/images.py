@@ -0,0 +1,125 @@
+# coding=utf-8
+"""
+Images pipeline which does not process unchanged images again.
+
+The pipeline remembers validators (ETag, Last-Modified) and SHA1 hash of the
+content of every downloaded image in a JSON file. Known images are requested
+conditionally - 304 Not Modified response, or a response with the same
+content hash when the server does not support validators, reuses the stored
+image and its thumbnails without decoding the image again.
+
+"""
+import os
+import json
+import hashlib
+
+from scrapy import log
+from scrapy.http import Request
+from scrapy.exceptions import NotConfigured
+from scrapy.contrib.pipeline.images import ImagesPipeline, FSImagesStore
+
+CACHE_FILE_NAME = 'image_cache.json'
+
+
+class CachedImagesPipeline(ImagesPipeline):
+    """
+    ImagesPipeline with conditional requests. The cache is stored in
+    IMAGES_CACHE_FILE (image_cache.json in IMAGES_STORE by default).
+
+    Besides images field the pipeline fills picture_hash of the item - name
+    of the stored image file without extension.
+
+    """
+    def __init__(self, store_uri, download_func=None):
+        super(CachedImagesPipeline, self).__init__(store_uri, download_func=download_func)
+        self.cache_file = None
+        if isinstance(self.store, FSImagesStore):
+            self.cache_file = os.path.join(self.store.basedir, CACHE_FILE_NAME)
+        self.load_cache()
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.get('IMAGES_STORE'):
+            raise NotConfigured('IMAGES_STORE setting is not set')
+        o = super(CachedImagesPipeline, cls).from_settings(settings)
+        if settings.get('IMAGES_CACHE_FILE'):
+            o.cache_file = settings.get('IMAGES_CACHE_FILE')
+            o.load_cache()
+        return o
+
+    def load_cache(self):
+        # url -> {'etag', 'last_modified', 'content_hash', 'checksum', 'path'}
+        self.cache = {}
+        if self.cache_file and os.path.exists(self.cache_file):
+            with open(self.cache_file) as f:
+                self.cache = json.load(f)
+
+    def close_spider(self, spider):
+        super(CachedImagesPipeline, self).close_spider(spider)
+        if self.cache_file:
+            with open(self.cache_file, 'w') as f:
+                json.dump(self.cache, f, indent=1, sort_keys=True)
+
+    def get_cached(self, url):
+        """Returns cache entry of the url if the stored image still exists"""
+        entry = self.cache.get(url)
+        if entry and isinstance(self.store, FSImagesStore) and \
+                not os.path.exists(self.store._get_filesystem_path(entry['path'])):
+            return None
+        return entry
+
+    def get_media_requests(self, item, info):
+        requests = []
+        for url in item.get('image_urls', []):
+            headers = {}
+            entry = self.get_cached(url)
+            if entry:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            requests.append(Request(url, headers=headers))
+        return requests
+
+    def media_to_download(self, request, info):
+        # every image is requested - conditionally if it is known
+        return None
+
+    def media_downloaded(self, response, request, info):
+        entry = self.get_cached(request.url)
+        if entry and response.status == 304:
+            return self.unchanged(entry, request, info, 'notmodified')
+
+        content_hash = None
+        if response.status == 200 and response.body:
+            content_hash = hashlib.sha1(response.body).hexdigest()
+            if entry and entry.get('content_hash') == content_hash:
+                self.update_validators(entry, response)
+                return self.unchanged(entry, request, info, 'unchanged')
+
+        result = super(CachedImagesPipeline, self).media_downloaded(response, request, info)
+        entry = {'content_hash': content_hash,
+                 'checksum': result['checksum'],
+                 'path': result['path']}
+        self.update_validators(entry, response)
+        self.cache[request.url] = entry
+        return result
+
+    def update_validators(self, entry, response):
+        entry['etag'] = response.headers.get('ETag')
+        entry['last_modified'] = response.headers.get('Last-Modified')
+
+    def unchanged(self, entry, request, info, status):
+        log.msg(format='Image (%(status)s): %(request)s', level=log.DEBUG, spider=info.spider,
+                status=status, request=request)
+        self.inc_stats(info.spider, status)
+        return {'url': request.url, 'path': entry['path'], 'checksum': entry['checksum']}
+
+    def item_completed(self, results, item, info):
+        item = super(CachedImagesPipeline, self).item_completed(results, item, info)
+        if 'picture_hash' in item.fields:
+            for ok, result in results:
+                if ok:
+                    item['picture_hash'] = os.path.splitext(os.path.basename(result['path']))[0]
+                    break
+        return item
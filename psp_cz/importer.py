@@ -0,0 +1,350 @@
+# coding=utf-8
+"""
+Importer of psp.cz open data archives.
+
+psp.cz publishes the votings of whole terms (hl-<year>ps.zip) and tables of
+parliament members and organs (poslanci.zip) as zipped pipe delimited UNL
+files in windows-1250 encoding. The importer reads them directly from the zip
+archives and bulk inserts them into the same tables the spiders use. Natural
+keys (urls, psp.cz ids) are built the same way the spiders get them from the
+web pages, so the crawler can continue incrementally after the import.
+
+"""
+import re
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from scrapy import log
+
+from .database import db_session, get_engine, init_db
+from .bulk import get_vote_writer, get_stored_votes
+from .partitions import create_term_partition
+from .progress import update_progress
+from .aggregates import rebuild_aggregates
+from .urls import sitting_url, voting_url, parl_memb_url, organ_url
+from .psp_cz_models import Sitting as TSitting
+from .psp_cz_models import Voting as TVoting
+from .psp_cz_models import ParlMemb as TParlMemb
+from .psp_cz_models import Region as TRegion
+from .psp_cz_models import PolitGroup as TPolitGroup
+from .psp_cz_models import PolitGroupMemb as TPolitGroupMemb
+
+ENCODING = 'windows-1250'
+
+# votings archive contains hl<year>s.unl with votings and hl<year>h<n>.unl
+# with votes of parliament members
+VOTINGS_FILE_REGEXP = re.compile(r'hl[0-9]{4}s\.unl$')
+VOTES_FILE_REGEXP = re.compile(r'hl[0-9]{4}h[0-9]+\.unl$')
+
+# vote codes of the archives mapped to the flags shown on the voting pages
+VOTES = {
+    'A': u'A',  # ano
+    'B': u'N',  # ne
+    'N': u'N',  # ne
+    'C': u'Z',  # zdržel se
+    'K': u'Z',  # zdržel se
+    'F': u'X',  # nehlasoval
+    '@': u'0',  # nepřihlášen
+    'W': u'0',  # hlasoval před složením slibu
+    'M': u'M',  # omluven
+}
+
+VOTING_RESULTS = {
+    'A': u'Přijato',
+    'R': u'Zamítnuto',
+}
+
+GENDERS = {
+    u'M': 'M',
+    u'Ž': 'F',
+}
+
+# organ types (typ_organu.unl) of political groups and regions
+POLIT_GROUP_ORGAN_TYPE = u'Klub'
+REGION_ORGAN_TYPE = u'Kraj'
+
+# term number from organ abbreviation of the chamber, e.g. PSP6
+TERM_REGEXP = re.compile(r'^PSP([0-9]+)$')
+
+# number of votes written at once
+VOTES_CHUNK_SIZE = 10000
+
+
+def read_unl(archive, name):
+    """Iterates over rows of UNL file in zip archive without extracting it"""
+    f = archive.open(name)
+    try:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                # every field is terminated by |
+                yield line.decode(ENCODING).split(u'|')[:-1]
+    finally:
+        f.close()
+
+
+def parse_date(value):
+    if value:
+        return datetime.strptime(value.strip(), '%d.%m.%Y').date()
+
+
+def date_key(value):
+    """Sortable key of dates which are either in d.m.yyyy or yyyy-mm-dd format"""
+    numbers = map(int, re.findall(r'[0-9]+', value))
+    if len(numbers) < 3:
+        return ()
+    if numbers[0] < 1000:
+        numbers[0], numbers[2] = numbers[2], numbers[0]
+    return tuple(numbers)
+
+
+def get_membership_periods(memberships):
+    """
+    Returns list of (since, until, value) of memberships given as (since key,
+    until key, value) with date keys (see date_key). Until is the last day of
+    the membership in the archives while it is excluded in PolitGroupMemb.
+    A membership ends when the next one starts at the latest, so that they do
+    not overlap.
+
+    """
+    memberships = sorted(memberships)
+    periods = []
+    for i, (since_key, until_key, value) in enumerate(memberships):
+        since = date(*since_key[:3]) if since_key else None
+        until = date(*until_key[:3]) + timedelta(days=1) if until_key else None
+        if i + 1 < len(memberships) and memberships[i + 1][0]:
+            next_since = date(*memberships[i + 1][0][:3])
+            until = min(until or next_since, next_since)
+        if since is None or until is None or since < until:
+            periods.append((since, until, value))
+    return periods
+
+
+class ArchiveImporter(object):
+    """Imports votings and parliament members archives into the database"""
+
+    def __init__(self, term=None, vote_conflict='ignore', vote_storage='rows', aggregates=True):
+        self.term = term
+        self.vote_conflict = vote_conflict
+        self.vote_storage = vote_storage
+        self.aggregates = aggregates
+        # id_organ -> term number of chamber organs
+        self.terms = {}
+        # id_poslanec -> id_osoba
+        self.persons = {}
+
+    def import_archives(self, paths):
+        """Imports archives - parliament members first, then votings"""
+        init_db()
+        archives = [zipfile.ZipFile(path) for path in paths]
+        try:
+            members = [a for a in archives if 'osoby.unl' in a.namelist()]
+            votings = [a for a in archives if a not in members]
+            for archive in members:
+                self.import_parl_membs(archive)
+            for archive in votings:
+                self.import_votings(archive)
+            # votes are imported in bulk, summary tables are regenerated at once
+            if self.aggregates:
+                rebuild_aggregates(db_session, self.vote_storage)
+                db_session.commit()
+        finally:
+            for archive in archives:
+                archive.close()
+
+    def import_parl_membs(self, archive):
+        """Imports political groups, regions and parliament members"""
+        names = archive.namelist()
+        organ_types = {}
+        if 'typ_organu.unl' in names:
+            organ_types = dict((int(row[0]), row[2]) for row in read_unl(archive, 'typ_organu.unl'))
+
+        polit_groups = {}
+        regions = {}
+        for row in read_unl(archive, 'organy.unl'):
+            id_organ, organ_type, abbreviation, name = int(row[0]), int(row[2]), row[3], row[4]
+            match = TERM_REGEXP.match(abbreviation)
+            if match:
+                self.terms[id_organ] = int(match.group(1))
+            elif organ_types.get(organ_type) == POLIT_GROUP_ORGAN_TYPE:
+                polit_groups[id_organ] = {'name': abbreviation,
+                                          'name_full': name,
+                                          'url': organ_url(id_organ)}
+            elif organ_types.get(organ_type) == REGION_ORGAN_TYPE:
+                regions[id_organ] = {'name': name,
+                                     'url': organ_url(id_organ)}
+        self.insert_missing(TPolitGroup, 'url', polit_groups.values())
+        self.insert_missing(TRegion, 'url', regions.values())
+        polit_group_ids = dict(db_session.query(TPolitGroup.url, TPolitGroup.id))
+        region_ids = dict(db_session.query(TRegion.url, TRegion.id))
+
+        # the latest term of every person decides the region
+        person_regions = {}
+        for row in read_unl(archive, 'poslanec.unl'):
+            id_poslanec, id_osoba, id_kraj, id_obdobi = int(row[0]), int(row[1]), int(row[2]), int(row[4])
+            self.persons[id_poslanec] = id_osoba
+            if id_kraj in regions and self.terms.get(id_obdobi, 0) >= person_regions.get(id_osoba, (0, None))[0]:
+                person_regions[id_osoba] = (self.terms.get(id_obdobi, 0), id_kraj)
+
+        # the latest membership in a political group
+        person_groups = {}
+        # id_osoba -> [(since key, until key, id_organ)] of all memberships
+        person_memberships = defaultdict(list)
+        if 'zarazeni.unl' in names:
+            for row in read_unl(archive, 'zarazeni.unl'):
+                id_osoba, id_of, function = int(row[0]), int(row[1]), int(row[2])
+                if function == 0 and id_of in polit_groups:
+                    since = date_key(row[3])
+                    if since >= person_groups.get(id_osoba, ((), None))[0]:
+                        person_groups[id_osoba] = (since, id_of)
+                    person_memberships[id_osoba].append((since, date_key(row[4]), id_of))
+
+        parl_memb_persons = set(self.persons.itervalues())
+        rows = []
+        for row in read_unl(archive, 'osoby.unl'):
+            id_osoba = int(row[0])
+            if id_osoba not in parl_memb_persons:
+                continue
+            region = person_regions.get(id_osoba, (None, None))[1]
+            polit_group = person_groups.get(id_osoba, (None, None))[1]
+            rows.append({'url': parl_memb_url(id_osoba),
+                         'name': u'%s %s' % (row[2], row[3]),
+                         'name_full': u' '.join(x for x in (row[1], row[3], row[2], row[4]) if x),
+                         'born': parse_date(row[5]),
+                         'gender': GENDERS.get(row[6]),
+                         'psp_cz_id': id_osoba,
+                         'region_id': region_ids.get(organ_url(region)) if region else None,
+                         'polit_group_id': polit_group_ids.get(organ_url(polit_group)) if polit_group else None})
+        self.insert_missing(TParlMemb, 'psp_cz_id', rows)
+        self.import_memberships(person_memberships, polit_group_ids)
+        db_session.commit()
+        log.msg('Imported %d parliament members' % len(rows))
+
+    def import_memberships(self, person_memberships, polit_group_ids):
+        """Imports memberships in political groups of members who have none stored"""
+        parl_memb_ids = dict(db_session.query(TParlMemb.psp_cz_id, TParlMemb.id))
+        stored = set(parl_memb_id for parl_memb_id, in db_session.query(TPolitGroupMemb.parl_memb_id))
+        rows = []
+        for id_osoba, memberships in person_memberships.iteritems():
+            parl_memb_id = parl_memb_ids.get(id_osoba)
+            if parl_memb_id is None or parl_memb_id in stored:
+                continue
+            for since, until, polit_group in get_membership_periods(memberships):
+                rows.append({'parl_memb_id': parl_memb_id,
+                             'polit_group_id': polit_group_ids[organ_url(polit_group)],
+                             'since': since,
+                             'until': until})
+        if rows:
+            db_session.execute(TPolitGroupMemb.__table__.insert(), rows)
+
+    def get_term(self, id_organ):
+        if id_organ in self.terms:
+            return self.terms[id_organ]
+        if self.term:
+            return self.term
+        raise ValueError('Unknown term of organ %d - import poslanci.zip archive too '
+                         'or specify the term' % id_organ)
+
+    def import_votings(self, archive):
+        """Imports sittings, votings and votes of parliament members"""
+        names = archive.namelist()
+        sittings = {}
+        votings = []
+        # sitting url -> number of votings, voting url -> number of votes
+        votings_count = defaultdict(int)
+        votes_count = defaultdict(int)
+        for name in filter(VOTINGS_FILE_REGEXP.search, names):
+            for row in read_unl(archive, name):
+                term, sitting_no = self.get_term(int(row[1])), int(row[2])
+                sittings[(term, sitting_no)] = {'url': sitting_url(term, sitting_no),
+                                                'name': u'%d. schůze' % sitting_no,
+                                                'term': term,
+                                                'sitting_no': sitting_no}
+                votings.append({'url': voting_url(int(row[0])),
+                                'voting_nr': int(row[3]),
+                                'name': row[15] or row[16],
+                                'voting_date': parse_date(row[5]),
+                                'minutes_url': None,
+                                'result': VOTING_RESULTS.get(row[14], row[14]),
+                                'sitting_url': sitting_url(term, sitting_no),
+                                'term': term})
+                votings_count[sitting_url(term, sitting_no)] += 1
+        self.insert_missing(TSitting, 'url', sittings.values())
+        sitting_ids = dict(db_session.query(TSitting.url, TSitting.id))
+        for voting in votings:
+            voting['sitting_id'] = sitting_ids[voting.pop('sitting_url')]
+        self.insert_missing(TVoting, 'url', votings)
+        db_session.commit()
+        log.msg('Imported %d sittings and %d votings' % (len(sittings), len(votings)))
+
+        # votes of a term are loaded into its own partition (see psp_cz.partitions)
+        for term in set(voting['term'] for voting in votings):
+            if create_term_partition(db_session.connection(), term):
+                log.msg('Created partition of votes of term %d' % term)
+        db_session.commit()
+
+        voting_ids = dict(db_session.query(TVoting.url, TVoting.id))
+        voting_terms = dict((voting['url'], voting['term']) for voting in votings)
+        parl_memb_ids = dict(db_session.query(TParlMemb.psp_cz_id, TParlMemb.id))
+        writer = get_vote_writer(get_engine(), self.vote_conflict, self.vote_storage)
+        count = 0
+        rows = []
+        missing_votings = set()
+        for name in filter(VOTES_FILE_REGEXP.search, names):
+            for row in read_unl(archive, name):
+                url = voting_url(int(row[1]))
+                if url not in voting_terms:
+                    if url not in missing_votings:
+                        log.msg('Votes of voting %s not in the votings file skipped' % row[1],
+                                level=log.WARNING)
+                        missing_votings.add(url)
+                    continue
+                id_osoba = self.persons.get(int(row[0]))
+                if id_osoba not in parl_memb_ids:
+                    log.msg('Unknown parliament member %s - import poslanci.zip archive too' % row[0],
+                            level=log.WARNING)
+                    continue
+                # skipped votes are not expected, the voting is complete
+                # without them
+                votes_count[url] += 1
+                rows.append({'vote': VOTES.get(row[2], row[2]),
+                             'parl_memb_id': parl_memb_ids[id_osoba],
+                             'voting_id': voting_ids[url],
+                             'term': voting_terms[url]})
+                if len(rows) >= VOTES_CHUNK_SIZE:
+                    count += self.write_votes(writer, rows)
+                    rows = []
+        count += self.write_votes(writer, rows)
+        log.msg('Imported %d votes' % count)
+
+        # the archive contains whole sittings and votings - record them as
+        # crawled (see psp_cz.progress), sitting by sitting to keep the
+        # queries small
+        sitting_votings = defaultdict(dict)
+        for voting in votings:
+            sitting_votings[voting['sitting_id']][voting_ids[voting['url']]] = votes_count[voting['url']]
+        for url, votings_expected in votings_count.iteritems():
+            update_progress(db_session,
+                            votes_expected=sitting_votings[sitting_ids[url]],
+                            votings_expected={sitting_ids[url]: votings_expected},
+                            storage=self.vote_storage)
+        db_session.commit()
+
+    def write_votes(self, writer, rows):
+        if rows:
+            stored_votes = None
+            if not writer.resolves_conflicts:
+                stored_votes = get_stored_votes(db_session, set(row['voting_id'] for row in rows))
+            writer.write(db_session, rows, stored_votes)
+            db_session.commit()
+        return len(rows)
+
+    def insert_missing(self, model, key, rows):
+        """Bulk inserts rows whose natural key is not stored yet"""
+        column = getattr(model, key)
+        existing = set(value for value, in db_session.query(column))
+        rows = [row for row in rows if row[key] not in existing]
+        if rows:
+            db_session.execute(model.__table__.insert(), rows)
+        return len(rows)
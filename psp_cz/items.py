@@ -20,8 +20,8 @@ class ParlMembVote(Item):
     # short name of the parliament member
     parl_memb_name = Field()
 
-    # reference to the voting
-    voting = Field()
+    # URL of the voting
+    voting_url = Field()
 
     # parliament member id in psp.cz
     parl_memb_id = Field()
@@ -49,8 +49,11 @@ class Voting(Item):
     # voting result in textual form
     result = Field()
 
-    # reference to the sitting
-    sitting = Field()
+    # URL of the sitting
+    sitting_url = Field()
+
+    # term of parliament
+    term = Field()
 
 
 class Sitting(Item):
@@ -63,6 +66,12 @@ class Sitting(Item):
     # name of the sitting - sequential numbers along with text 'schuze' are being used
     name = Field()
 
+    # term of parliament
+    term = Field()
+
+    # sequential number of the sitting in the term
+    sitting_no = Field()
+
 
 class ParlMemb(Item):
     # unique identifier for duplicity check
@@ -105,3 +114,25 @@ class ParlMemb(Item):
     # see http://doc.scrapy.org/en/latest/topics/images.html
     image_urls = Field()
     images = Field()
+
+
+class SittingProgress(Item):
+    # unique identifier for duplicity check
+    id = Field()
+
+    # URL of the sitting
+    url = Field()
+
+    # number of votings listed on the pages of the sitting
+    votings_expected = Field()
+
+
+class VotingProgress(Item):
+    # unique identifier for duplicity check
+    id = Field()
+
+    # URL of the voting
+    url = Field()
+
+    # number of votes on the voting page
+    votes_expected = Field()
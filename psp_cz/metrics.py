@@ -0,0 +1,220 @@
+# coding=utf-8
+"""
+Lightweight instrumentation of crawls.
+
+The module level metrics object collects histograms of durations and counters
+from the spider callbacks (timed_callback decorator), the pipelines (timer
+context manager, timed decorator) and the SQL statements executed by the
+engine (instrument_engine). It is thread safe - the database writer thread of
+DBStorePipeline reports into it as well. MetricsExtension puts the collected
+values into the Scrapy stats and into a JSON report when the spider closes.
+
+SQL statements are attributed to the innermost timer running in the same
+thread, so e.g. queries executed by DBStorePipeline.get_db_voting_ids() are
+counted as sql/db/get_db_voting_ids.
+
+"""
+import sys
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from twisted.internet.defer import Deferred
+
+try:
+    RUSAGE_THREAD = resource.RUSAGE_THREAD
+except AttributeError:
+    # not exported by older Pythons, the value is the same on all Linuxes
+    RUSAGE_THREAD = 1 if sys.platform.startswith('linux') else None
+
+# upper bounds of histogram buckets in seconds - 10 us .. ~84 s
+BUCKETS = [0.00001 * 2 ** i for i in xrange(24)]
+
+
+def thread_cpu_time():
+    """CPU time of the current thread (of the process where not available)"""
+    if RUSAGE_THREAD is not None:
+        usage = resource.getrusage(RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    return time.clock()
+
+
+class Histogram(object):
+    """Histogram of durations with logarithmic buckets"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile"""
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[bucket], self.max) if bucket < len(BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'buckets': dict(('le_%g' % (BUCKETS[bucket] if bucket < len(BUCKETS) else float('inf')), count)
+                                for bucket, count in enumerate(self.buckets) if count)}
+
+
+class Metrics(object):
+    """Thread safe registry of histograms and counters"""
+
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def inc(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    @property
+    def scope(self):
+        """Name of the innermost timer running in the current thread"""
+        scopes = getattr(self.local, 'scopes', None)
+        return scopes[-1] if scopes else None
+
+    @contextmanager
+    def timer(self, name):
+        """Measures wall and CPU time of the with block as name/wall and name/cpu"""
+        if not self.enabled:
+            yield
+            return
+        scopes = getattr(self.local, 'scopes', None)
+        if scopes is None:
+            scopes = self.local.scopes = []
+        scopes.append(name)
+        start, start_cpu = time.time(), thread_cpu_time()
+        try:
+            yield
+        finally:
+            self.observe(name + '/wall', time.time() - start)
+            self.observe(name + '/cpu', thread_cpu_time() - start_cpu)
+            scopes.pop()
+
+    def timed(self, name):
+        """Decorator measuring calls of the function by timer(name)"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Returns collected values as dictionary serializable to JSON"""
+        with self.lock:
+            return {'elapsed': time.time() - self.started,
+                    'histograms': dict((name, histogram.as_dict())
+                                       for name, histogram in self.histograms.iteritems()),
+                    'counters': dict(self.counters)}
+
+
+metrics = Metrics()
+
+
+def timed_callback(func):
+    """
+    Decorator of spider callbacks. Callbacks are generators, so the time
+    spent in the callback is the time spent by producing its results - time
+    of the engine processing them is not included. A callback parsing the
+    page in a worker process (see psp_cz.parse_pool) returns Deferred, time
+    of producing its results is measured when it fires - the parsing itself
+    is not.
+
+    """
+    name = 'callback/%s' % func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return func(*args, **kwargs)
+        start, start_cpu = time.time(), thread_cpu_time()
+        results = func(*args, **kwargs)
+        wall, cpu = time.time() - start, thread_cpu_time() - start_cpu
+        if isinstance(results, Deferred):
+            return results.addCallback(lambda results: _timed_results(name, results, wall, cpu))
+        return _timed_results(name, results, wall, cpu)
+    return wrapper
+
+
+def _timed_results(name, results, wall=0.0, cpu=0.0):
+    start, start_cpu = time.time(), thread_cpu_time()
+    if results is not None:
+        results = iter(results)
+        while True:
+            try:
+                result = next(results)
+            except StopIteration:
+                break
+            wall += time.time() - start
+            cpu += thread_cpu_time() - start_cpu
+            yield result
+            start, start_cpu = time.time(), thread_cpu_time()
+    metrics.observe(name + '/wall', wall + time.time() - start)
+    metrics.observe(name + '/cpu', cpu + thread_cpu_time() - start_cpu)
+
+
+def instrument_engine(engine):
+    """Counts SQL statements of engine and measures their latency"""
+    if getattr(engine, '_psp_cz_instrumented', False):
+        return
+    engine._psp_cz_instrumented = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.time())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_start')
+        if starts:
+            start = starts.pop()
+            if metrics.enabled:
+                metrics.observe('sql/%s' % (metrics.scope or 'other'), time.time() - start)
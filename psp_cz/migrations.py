@@ -0,0 +1,156 @@
+# coding=utf-8
+"""
+Upgrades of databases created by older versions of psp_cz_models.
+
+Base.metadata.create_all() creates only missing tables, so columns added to
+existing tables are handled here. Every migration checks whether it is needed
+which makes upgrade() safe to run repeatedly - init_db() calls it on every
+start.
+
+"""
+from sqlalchemy import text
+from sqlalchemy.engine.reflection import Inspector
+
+from .urls import get_sitting_numbers
+from .votes import count_votes
+from .bulk import UNKNOWN_TERM
+
+# votings stored before crawl progress was tracked are complete when they
+# have votes of all parliament members
+PARL_MEMBS_COUNT = 200
+
+# executed with many parameter sets, text() renders the placeholders of the
+# DBAPI (psycopg2 does not understand :name)
+SITTING_NUMBERS_UPDATE = text('UPDATE sitting SET term = :term, sitting_no = :sitting_no WHERE id = :id')
+VOTES_STORED_UPDATE = text('UPDATE voting SET votes_stored = :stored WHERE id = :id AND votes_stored < :stored')
+
+
+def get_columns(connection, table):
+    return set(column['name'] for column in Inspector.from_engine(connection).get_columns(table))
+
+
+def drop_index(connection, table, name):
+    """Drops index of the table if it exists"""
+    if name not in set(index['name'] for index in Inspector.from_engine(connection).get_indexes(table)):
+        return
+    if connection.dialect.name == 'mysql':
+        connection.execute('DROP INDEX %s ON %s' % (name, table))
+    else:
+        connection.execute('DROP INDEX %s' % name)
+
+
+def add_sitting_term(connection):
+    """Adds term and sitting_no columns to sitting table and backfills them from urls"""
+    if 'term' not in get_columns(connection, 'sitting'):
+        connection.execute('ALTER TABLE sitting ADD COLUMN term INTEGER')
+        connection.execute('ALTER TABLE sitting ADD COLUMN sitting_no INTEGER')
+        connection.execute('CREATE INDEX ix_sit_term_sitting_no ON sitting (term, sitting_no)')
+
+    rows = []
+    for id, url in connection.execute('SELECT id, url FROM sitting WHERE term IS NULL'):
+        numbers = get_sitting_numbers(url)
+        if numbers:
+            rows.append({'id': id, 'term': numbers[0], 'sitting_no': numbers[1]})
+    if rows:
+        connection.execute(SITTING_NUMBERS_UPDATE, rows)
+
+
+def add_crawl_progress(connection):
+    """
+    Adds crawl progress columns to sitting and voting tables (see progress
+    module). Votes of already stored votings are counted, votings with votes
+    of all parliament members are marked complete.
+
+    """
+    if 'votes_expected' in get_columns(connection, 'voting'):
+        return
+
+    connection.execute('ALTER TABLE sitting ADD COLUMN votings_expected INTEGER')
+    connection.execute('ALTER TABLE sitting ADD COLUMN votings_stored INTEGER')
+    connection.execute('ALTER TABLE voting ADD COLUMN votes_expected INTEGER')
+    connection.execute('ALTER TABLE voting ADD COLUMN votes_stored INTEGER')
+
+    connection.execute('UPDATE voting SET votes_stored = '
+                       '(SELECT count(*) FROM parl_memb_voting WHERE voting_id = voting.id)')
+    # votes may be stored packed only
+    rows = []
+    for voting_id, votes in connection.execute('SELECT voting_id, votes FROM voting_votes'):
+        rows.append({'id': voting_id, 'stored': count_votes(votes)})
+    if rows:
+        connection.execute(VOTES_STORED_UPDATE, rows)
+    connection.execute('UPDATE voting SET votes_expected = votes_stored '
+                       'WHERE votes_stored >= %d' % PARL_MEMBS_COUNT)
+    connection.execute('UPDATE sitting SET votings_stored = '
+                       '(SELECT count(*) FROM voting WHERE sitting_id = sitting.id '
+                       'AND votes_stored >= votes_expected)')
+
+
+def add_vote_term(connection):
+    """
+    Adds term columns to voting and parl_memb_voting tables (see
+    psp_cz.partitions) and backfills them from sittings. Indexes duplicating
+    unique constraints are dropped - url of sittings, votings and parliament
+    members and parl_memb_id of votes (the first column of the unique
+    constraint on parl_memb_id and voting_id).
+
+    """
+    # parl_memb_voting may be partitioned already, which the inspector of
+    # PostgreSQL does not reflect - it is not touched then
+    if 'term' in get_columns(connection, 'voting'):
+        return
+
+    for table in ('voting', 'parl_memb_voting'):
+        connection.execute('ALTER TABLE %s ADD COLUMN term INTEGER NOT NULL DEFAULT %d'
+                           % (table, UNKNOWN_TERM))
+    connection.execute('UPDATE voting SET term = '
+                       '(SELECT coalesce(term, %d) FROM sitting WHERE sitting.id = voting.sitting_id)'
+                       % UNKNOWN_TERM)
+    connection.execute('UPDATE parl_memb_voting SET term = '
+                       '(SELECT term FROM voting WHERE voting.id = parl_memb_voting.voting_id)')
+    if connection.dialect.name != 'sqlite':
+        # the column has no default in the models, SQLite cannot drop it
+        for table in ('voting', 'parl_memb_voting'):
+            connection.execute('ALTER TABLE %s ALTER COLUMN term DROP DEFAULT' % table)
+    connection.execute('CREATE INDEX ix_vot_term ON voting (term)')
+
+    drop_index(connection, 'sitting', 'ix_sit_url')
+    drop_index(connection, 'voting', 'ix_vot_url')
+    drop_index(connection, 'parl_memb', 'ix_pm_url')
+    drop_index(connection, 'parl_memb_voting', 'ix_pmv_parl_memb_id')
+
+
+def add_polit_group_memberships(connection):
+    """
+    Adds memberships in political groups (polit_group_memb table created by
+    create_all()) of parliament members who have a group but no membership.
+    The group is the member's since the beginning, as votes were counted
+    before.
+
+    """
+    connection.execute('INSERT INTO polit_group_memb (parl_memb_id, polit_group_id, created, last_modified) '
+                       'SELECT id, polit_group_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM parl_memb '
+                       'WHERE polit_group_id IS NOT NULL '
+                       'AND id NOT IN (SELECT parl_memb_id FROM polit_group_memb)')
+
+
+MIGRATIONS = [
+    add_sitting_term,
+    add_crawl_progress,
+    add_vote_term,
+    add_polit_group_memberships,
+]
+
+
+def upgrade(engine):
+    """Runs all migrations in a single transaction"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        for migration in MIGRATIONS:
+            migration(connection)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
@@ -0,0 +1,242 @@
+# coding=utf-8
+"""
+Conditional cache of discovery pages - entry pages and lists of sittings,
+political groups etc. which lead to the pages with data.
+
+Spiders list their discovery pages in cached_pages attribute - pairs of url
+regular expression and flag whether the callback of the page is skipped when
+the page did not change. The cache file (PAGE_CACHE_FILE, gzip compressed
+JSON) holds for every page its validators (ETag, Last-Modified), digest of
+the normalized body, the response and the requests of discovery pages the
+callback yielded (child pages).
+
+PageCacheMiddleware requests known pages conditionally and compares the
+digest of downloaded pages with the stored one - 304 Not Modified response
+is replaced by the stored response. PageCacheSpiderMiddleware does not call
+the callback of an unchanged page, it only requests the child pages again
+(conditionally too), so a crawl without changes downloads just the discovery
+pages. Requests of other pages yielded by the skipped callback (detail
+pages, votings) are not repeated.
+
+An entry is complete only when the callback of the page finished, a page
+whose callback failed is parsed again in the next crawl.
+
+"""
+import os
+import re
+import json
+import gzip
+import hashlib
+from contextlib import closing
+
+from scrapy import signals, log
+from scrapy.http import Request, Headers
+from scrapy.exceptions import NotConfigured
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+
+# parts of pages which do not affect parsed data
+IGNORED_PARTS_REGEXP = re.compile(r'<!--.*?-->|<script.*?</script>', re.S | re.I)
+WHITESPACE_REGEXP = re.compile(r'\s+')
+
+
+def normalize_body(body):
+    """Returns body without comments, scripts and differences in whitespace"""
+    return WHITESPACE_REGEXP.sub(' ', IGNORED_PARTS_REGEXP.sub('', body)).strip()
+
+
+def body_digest(body):
+    return hashlib.sha1(normalize_body(body)).hexdigest()
+
+
+def get_cached_pages(spider):
+    """Returns compiled cached_pages of the spider - [(regexp, skip unchanged)]"""
+    return [(re.compile(pattern), skip) for pattern, skip in getattr(spider, 'cached_pages', ())]
+
+
+def match_page(cached_pages, url):
+    """Returns skip unchanged flag of the cached page url, None for other pages"""
+    for regexp, skip in cached_pages:
+        if regexp.search(url):
+            return skip
+    return None
+
+
+class PageCache(object):
+    """Cache entries by url stored in a gzip compressed JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        # url -> {'url', 'etag', 'last_modified', 'digest', 'status',
+        # 'headers', 'body', 'children', 'complete'}
+        self.pages = {}
+        if os.path.exists(path):
+            with closing(gzip.open(path, 'rb')) as f:
+                self.pages = json.load(f)
+
+    def get(self, url):
+        """Returns complete entry of the url or None"""
+        entry = self.pages.get(url)
+        if entry and entry.get('complete'):
+            return entry
+        return None
+
+    def put(self, url, entry):
+        self.pages[url] = entry
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # the file is replaced at once, an interrupted write keeps the old cache
+        path = self.path + '.tmp'
+        with closing(gzip.open(path, 'wb')) as f:
+            json.dump(self.pages, f, separators=(',', ':'))
+        os.rename(path, self.path)
+
+
+class PageCacheMiddleware(object):
+    """
+    Downloader middleware with conditional requests of discovery pages. It
+    stores information about the downloaded page into request meta
+    page_cache - the new cache entry, whether the page is unchanged and
+    whether its callback is skipped then - for PageCacheSpiderMiddleware,
+    which completes the entry when the callback finished.
+
+    """
+    def __init__(self, stats, path):
+        self.stats = stats
+        self.path = path
+        self.cache = None
+        self.cached_pages = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('PAGE_CACHE_FILE')
+        if not path:
+            raise NotConfigured
+        o = cls(crawler.stats, path)
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        self.cached_pages = get_cached_pages(spider)
+        if self.cached_pages:
+            self.cache = PageCache(self.path % {'name': spider.name})
+            log.msg('Page cache %s with %d pages' % (self.cache.path, len(self.cache.pages)),
+                    spider=spider)
+
+    def spider_closed(self, spider):
+        if self.cache is not None:
+            self.cache.save()
+            self.cache = None
+
+    def process_request(self, request, spider):
+        if self.cache is None or match_page(self.cached_pages, request.url) is None:
+            return
+        entry = self.cache.get(request.url)
+        if entry:
+            if entry.get('etag') and 'If-None-Match' not in request.headers:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified') and 'If-Modified-Since' not in request.headers:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+
+    def process_response(self, request, response, spider):
+        if self.cache is None:
+            return response
+        skip = match_page(self.cached_pages, request.url)
+        if skip is None:
+            return response
+        old = self.cache.get(request.url)
+        # a 304 response may not repeat the validators
+        etag = response.headers.get('ETag') or (old and old.get('etag'))
+        last_modified = response.headers.get('Last-Modified') or (old and old.get('last_modified'))
+        if response.status == 304 and old:
+            status = 'notmodified'
+            digest = old['digest']
+            response = self.cached_response(old)
+        elif response.status == 200:
+            digest = body_digest(response.body)
+            status = 'unchanged' if old and old['digest'] == digest else 'changed'
+        else:
+            return response
+        self.stats.inc_value('pagecache/%s' % status, spider=spider)
+
+        entry = {'url': response.url,
+                 'etag': etag,
+                 'last_modified': last_modified,
+                 'digest': digest,
+                 'status': response.status,
+                 # header values and the body are bytes, latin-1 maps them to
+                 # unicode and back
+                 'headers': dict((name, [value.decode('latin-1') for value in values])
+                                 for name, values in response.headers.iteritems()),
+                 'body': response.body.decode('latin-1'),
+                 'children': old['children'] if status != 'changed' else [],
+                 'complete': False}
+        self.cache.put(request.url, entry)
+        request.meta['page_cache'] = {'entry': entry,
+                                      'unchanged': status != 'changed',
+                                      'skip': skip}
+        return response
+
+    def cached_response(self, entry):
+        headers = Headers(dict((name, [value.encode('latin-1') for value in values])
+                               for name, values in entry['headers'].iteritems()))
+        url = entry['url'].encode('utf-8')
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, status=entry['status'], headers=headers,
+                       body=entry['body'].encode('latin-1'), flags=['cached'])
+
+
+class PageCacheSpiderMiddleware(object):
+    """
+    Spider middleware which skips callbacks of unchanged discovery pages and
+    requests their child pages instead. Callbacks of discovery pages must be
+    generators, they do not run until their output is iterated.
+
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.cached_pages = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('PAGE_CACHE_FILE'):
+            raise NotConfigured
+        o = cls(crawler.stats)
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        return o
+
+    def spider_opened(self, spider):
+        self.cached_pages = get_cached_pages(spider)
+
+    def process_spider_output(self, response, result, spider):
+        page = response.meta.get('page_cache')
+        if page is None:
+            return result
+        if page['unchanged'] and page['skip']:
+            return self.request_children(response, page['entry'], spider)
+        return self.record_children(result, page['entry'], spider)
+
+    def request_children(self, response, entry, spider):
+        log.msg(format='Unchanged page, %(count)d child pages: %(url)s', level=log.DEBUG,
+                spider=spider, count=len(entry['children']), url=response.url)
+        self.stats.inc_value('pagecache/skipped', spider=spider)
+        entry['complete'] = True
+        for child in entry['children']:
+            yield request_from_dict(child, spider)
+
+    def record_children(self, result, entry, spider):
+        children = []
+        for request_or_item in result:
+            if isinstance(request_or_item, Request) and \
+                    match_page(self.cached_pages, request_or_item.url) is not None:
+                child = request_to_dict(request_or_item, spider)
+                # later middlewares add to meta of the yielded request
+                child['meta'] = dict(child['meta'])
+                children.append(child)
+            yield request_or_item
+        entry['children'] = children
+        entry['complete'] = True
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Parsing of pages in worker processes.
+
+Parsing is the CPU bound part of a crawl and spider callbacks run in the
+reactor thread, so a single core parses all pages. ParsePool sends the body,
+encoding and url of a page to a pool of worker processes which run a parser
+function of psp_cz.parsers and return its records. The spider turns the
+records into items - its callback returns Deferred which fires with them
+(see PspCzSpider.parse_page).
+
+At most max_pending pages are parsed or wait for a worker at once, further
+pages wait in the reactor process.
+
+"""
+import signal
+import traceback
+import multiprocessing
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore
+
+
+class ParseError(Exception):
+    """Parser failed in a worker process - the message holds its traceback"""
+
+
+def _init_worker():
+    # Ctrl-C stops the crawl in the main process which closes the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call_parser(parser, args):
+    # Pool.apply_async() does not report exceptions to a callback
+    try:
+        records = parser(*args)
+    except Exception:
+        return False, traceback.format_exc()
+    # records are sent as plain tuples together with their class, pickling of
+    # namedtuples is several times slower
+    return True, (type(records[0]) if records else None, [tuple(record) for record in records])
+
+
+class ParsePool(object):
+    """Pool of processes running parser functions, results are delivered by Deferreds"""
+
+    def __init__(self, workers=None, max_pending=64):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.workers, _init_worker)
+        self.semaphore = DeferredSemaphore(max_pending)
+
+    def parse(self, parser, body, encoding, url):
+        """
+        Returns Deferred which fires with result of parser(body, encoding,
+        url) - list of namedtuples.
+
+        """
+        return self.semaphore.run(self._apply, parser, (body, encoding, url))
+
+    def _apply(self, parser, args):
+        dfd = Deferred()
+
+        def parsed(result):
+            # called in the result handler thread of the pool
+            ok, value = result
+            if ok:
+                record_class, records = value
+                if record_class is not None:
+                    records = [record_class._make(record) for record in records]
+                reactor.callFromThread(dfd.callback, records)
+            else:
+                reactor.callFromThread(dfd.errback, ParseError(value))
+
+        self.pool.apply_async(_call_parser, (parser, args), callback=parsed)
+        return dfd
+
+    def close(self):
+        """Waits for pending pages and stops the workers"""
+        self.pool.close()
+        self.pool.join()
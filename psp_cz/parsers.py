@@ -0,0 +1,155 @@
+# coding=utf-8
+"""
+Fast parsers of psp.cz pages which are downloaded in large numbers.
+
+The parsers work with plain lxml trees and precompiled XPath and regular
+expression objects instead of HtmlXPathSelector. They return tuples which are
+turned into Items by the spider callbacks.
+
+"""
+import re
+from datetime import datetime
+from collections import namedtuple
+
+from lxml import etree
+from scrapy.utils.url import urljoin_rfc
+
+BASE_HREF_XPATH = etree.XPath('//base/@href')
+PARL_MEMB_VOTES_XPATH = etree.XPath('//ul[@class="results"]//li')
+VOTING_ROWS_XPATH = etree.XPath('//*[@id="main-content"]/div[1]/center/table/tr[position()>1]')
+VOTING_URL_XPATH = etree.XPath('td[2]/a/@href')
+VOTING_NR_XPATH = etree.XPath('td[2]/a/text()')
+VOTING_NAME_XPATH = etree.XPath('td[4]/node()')
+VOTING_MINUTES_DATE_XPATH = etree.XPath('td[5]/a/text()')
+VOTING_MINUTES_URL_XPATH = etree.XPath('td[5]/a/@href')
+VOTING_DATE_XPATH = etree.XPath('td[5]/text()')
+VOTING_RESULT_XPATH = etree.XPath('td[6]/text()')
+# &o=<number> parameter refers to tenure
+TENURE_PARAM_REGEXP = re.compile(r'\&o=[0-9]+')
+PARL_MEMB_ID_REGEXP = re.compile(r'id=([0-9]+)')
+# links to pages of the list of votings, e.g. phlasa.sqw?o=6&amp;s=40&amp;pg=2
+VOTINGS_PAGE_REGEXP = re.compile(r'phlasa\.sqw\?[^"\'<>]*?pg=([0-9]+)')
+
+ParlMembVoteRecord = namedtuple('ParlMembVoteRecord',
+                                ['vote', 'parl_memb_name', 'parl_memb_url', 'parl_memb_id'])
+
+VotingRecord = namedtuple('VotingRecord',
+                          ['url', 'voting_nr', 'name', 'voting_date', 'minutes_url', 'result'])
+
+_html_parsers = {}
+
+
+def parse_html(body, encoding):
+    """Parses HTML document into lxml tree, returns None for an empty document"""
+    # lxml fails on empty documents, e.g. bodies of error responses
+    if not body or body.isspace():
+        return None
+    parser = _html_parsers.get(encoding)
+    if parser is None:
+        parser = _html_parsers[encoding] = etree.HTMLParser(encoding=encoding)
+    return etree.fromstring(body, parser)
+
+
+def get_base_url(tree, url):
+    """Returns base url of the document - either url of the page or <base> href"""
+    base_hrefs = BASE_HREF_XPATH(tree)
+    if base_hrefs:
+        return urljoin_rfc(url, base_hrefs[0])
+    return url
+
+
+def get_parl_memb_id(url):
+    match = PARL_MEMB_ID_REGEXP.search(url)
+    if match:
+        return int(match.group(1))
+
+
+def parse_parl_memb_votes(body, encoding, url):
+    """
+    Parses page with votes of individual parliament members in one voting.
+    Returns list of ParlMembVoteRecord tuples. Raises ValueError when a vote
+    or name of a member is missing - the page is broken.
+
+    """
+    tree = parse_html(body, encoding)
+    if tree is None:
+        return []
+    base_url = get_base_url(tree, url)
+    # all members link to the same detail page so joining of its path with
+    # base url is done only once per page
+    joined_paths = {}
+
+    records = []
+    for li in PARL_MEMB_VOTES_XPATH(tree):
+        span = link = None
+        for child in li:
+            if child.tag == 'span' and span is None:
+                span = child
+            elif child.tag == 'a' and link is None:
+                link = child
+        if span is None or span.text is None or link is None or link.text is None:
+            raise ValueError('Vote of a parliament member is missing at %s' % url)
+
+        relative_url = TENURE_PARAM_REGEXP.sub('', link.get('href'))
+        path, sep, query = relative_url.partition('?')
+        if path:
+            if path not in joined_paths:
+                joined_paths[path] = urljoin_rfc(base_url, path)
+            parl_memb_url = joined_paths[path] + sep + query.encode('utf-8')
+        else:
+            parl_memb_url = urljoin_rfc(base_url, relative_url)
+
+        records.append(ParlMembVoteRecord(unicode(span.text),
+                                          unicode(link.text),
+                                          parl_memb_url,
+                                          get_parl_memb_id(parl_memb_url)))
+    return records
+
+
+def extract_node(node):
+    """Text of text node or HTML of element - the same as HtmlXPathSelector.extract()"""
+    if isinstance(node, basestring):
+        return unicode(node)
+    return etree.tostring(node, method='html', encoding=unicode, with_tail=False)
+
+
+def parse_date(text):
+    return datetime.strptime(text.replace(u'\xa0', ''), '%d.%m.%Y')
+
+
+def parse_votings_page(body, encoding, url):
+    """
+    Parses page with a list of votings of a sitting. Returns list of
+    VotingRecord tuples.
+
+    """
+    tree = parse_html(body, encoding)
+    if tree is None:
+        return []
+    base_url = get_base_url(tree, url)
+
+    records = []
+    for row in VOTING_ROWS_XPATH(tree):
+        minutes_dates = VOTING_MINUTES_DATE_XPATH(row)
+        if minutes_dates:
+            voting_date = parse_date(minutes_dates[0])
+            minutes_url = unicode(VOTING_MINUTES_URL_XPATH(row)[0])
+        else:
+            voting_date = parse_date(VOTING_DATE_XPATH(row)[0])
+            minutes_url = None
+        records.append(VotingRecord(urljoin_rfc(base_url, VOTING_URL_XPATH(row)[0]),
+                                    int(VOTING_NR_XPATH(row)[0]),
+                                    extract_node(VOTING_NAME_XPATH(row)[0]),
+                                    voting_date,
+                                    minutes_url,
+                                    unicode(VOTING_RESULT_XPATH(row)[0])))
+    return records
+
+
+def get_votings_pages_count(body):
+    """
+    Returns number of pages of the list of votings - the highest page number
+    linked from the page body
+
+    """
+    return max([int(page) for page in VOTINGS_PAGE_REGEXP.findall(body)] or [1])
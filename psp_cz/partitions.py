@@ -0,0 +1,138 @@
+# coding=utf-8
+"""
+Partitioning of votes by term on PostgreSQL.
+
+Votes of all terms make parl_memb_voting table tens of millions of rows
+long. partition_votes() converts it into a table partitioned by list of
+terms - parl_memb_voting_t<term> partition per stored term and
+parl_memb_voting_default partition for terms without their own partition.
+Queries filtered by term column read only the partition of the term.
+
+Primary key and unique constraint of a partitioned table must contain the
+partition key, they are (id, term) and (parl_memb_id, voting_id, term) -
+PostgresVoteWriter resolves conflicts on the latter when the table is
+partitioned (see is_partitioned).
+
+create_term_partition() creates the partition of a term before its votes are
+loaded (the importer calls it for imported terms), votes of the term stored
+in the default partition are moved into it. delete_term() deletes sittings,
+votings, votes and summary counts of a term, the partition of the term is
+dropped instead of deleting its rows.
+
+"""
+from sqlalchemy import select
+
+from .psp_cz_models import Sitting as TSitting
+from .psp_cz_models import Voting as TVoting
+from .psp_cz_models import ParlMembVoting as TParlMembVoting
+from .psp_cz_models import VotingVotes as TVotingVotes
+from .psp_cz_models import TermMembSlot as TTermMembSlot
+from .psp_cz_models import VotingTally as TVotingTally
+from .psp_cz_models import ParlMembTermTally as TParlMembTermTally
+from .psp_cz_models import PolitGroupVotingTally as TPolitGroupVotingTally
+
+TABLE = 'parl_memb_voting'
+DEFAULT_PARTITION = TABLE + '_default'
+
+IS_PARTITIONED = """SELECT count(*) FROM pg_partitioned_table p
+                    JOIN pg_class c ON c.oid = p.partrelid
+                    WHERE c.relname = '%s' AND pg_table_is_visible(c.oid)""" % TABLE
+HAS_TABLE = """SELECT count(*) FROM pg_class c
+               WHERE c.relname = %(name)s AND pg_table_is_visible(c.oid)"""
+
+
+def partition_name(term):
+    return '%s_t%d' % (TABLE, term)
+
+
+def is_partitioned(connectable):
+    """Returns whether votes are partitioned - always False for other databases than PostgreSQL"""
+    if connectable.dialect.name != 'postgresql':
+        return False
+    return connectable.execute(IS_PARTITIONED).scalar() > 0
+
+
+def has_table(connection, name):
+    return connection.execute(HAS_TABLE, {'name': name}).scalar() > 0
+
+
+def get_terms(connection):
+    """Returns terms of stored votings"""
+    return [term for term, in connection.execute('SELECT DISTINCT term FROM voting ORDER BY term')]
+
+
+def partition_votes(connection):
+    """
+    Converts parl_memb_voting into a table partitioned by term with
+    partitions of all terms of stored votings. Returns False when the table
+    is partitioned already. Stored votes are copied, it takes a while.
+
+    """
+    if connection.dialect.name != 'postgresql':
+        raise ValueError('Votes can be partitioned on PostgreSQL only')
+    if is_partitioned(connection):
+        return False
+
+    new_table = TABLE + '_new'
+    connection.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY LIST (term)'
+                       % (new_table, TABLE))
+    connection.execute('ALTER TABLE %s ADD CONSTRAINT pk_parl_memb_voting PRIMARY KEY (id, term)'
+                       % new_table)
+    connection.execute('ALTER TABLE %s ADD CONSTRAINT uq_pmv_parl_memb_voting_term '
+                       'UNIQUE (parl_memb_id, voting_id, term)' % new_table)
+    connection.execute('ALTER TABLE %s ADD CONSTRAINT fk_pmv_parl_memb_id '
+                       'FOREIGN KEY (parl_memb_id) REFERENCES parl_memb (id)' % new_table)
+    connection.execute('ALTER TABLE %s ADD CONSTRAINT fk_pmv_voting_id '
+                       'FOREIGN KEY (voting_id) REFERENCES voting (id)' % new_table)
+    for term in get_terms(connection):
+        connection.execute('CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%d)'
+                           % (partition_name(term), new_table, term))
+    connection.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (DEFAULT_PARTITION, new_table))
+    connection.execute('INSERT INTO %s SELECT * FROM %s' % (new_table, TABLE))
+
+    # the sequence of ids is owned by the old table, it would be dropped with it
+    sequence = connection.execute("SELECT pg_get_serial_sequence('%s', 'id')" % TABLE).scalar()
+    connection.execute('ALTER SEQUENCE %s OWNED BY NONE' % sequence)
+    connection.execute('DROP TABLE %s' % TABLE)
+    connection.execute('ALTER TABLE %s RENAME TO %s' % (new_table, TABLE))
+    connection.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, TABLE))
+    connection.execute('CREATE INDEX ix_pmv_voting_id ON %s (voting_id)' % TABLE)
+    return True
+
+
+def create_term_partition(connection, term):
+    """
+    Creates partition of votes of the term unless it exists or votes are not
+    partitioned. Returns whether the partition was created.
+
+    """
+    name = partition_name(term)
+    if not is_partitioned(connection) or has_table(connection, name):
+        return False
+    # the default partition must not hold rows of the new partition
+    connection.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (name, TABLE))
+    connection.execute('WITH moved AS (DELETE FROM %s WHERE term = %d RETURNING *) '
+                       'INSERT INTO %s SELECT * FROM moved' % (DEFAULT_PARTITION, term, name))
+    connection.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN (%d)' % (TABLE, name, term))
+    return True
+
+
+def create_term_partitions(connection):
+    """Creates missing partitions of terms of stored votings; returns their terms"""
+    return [term for term in get_terms(connection) if create_term_partition(connection, term)]
+
+
+def delete_term(connection, term):
+    """Deletes sittings, votings, votes and summary counts of the term"""
+    if is_partitioned(connection) and has_table(connection, partition_name(term)):
+        connection.execute('ALTER TABLE %s DETACH PARTITION %s' % (TABLE, partition_name(term)))
+        connection.execute('DROP TABLE %s' % partition_name(term))
+    else:
+        connection.execute(TParlMembVoting.__table__.delete().where(TParlMembVoting.term == term))
+
+    voting_ids = select([TVoting.id]).where(TVoting.term == term)
+    for table in (TVotingTally.__table__, TPolitGroupVotingTally.__table__):
+        connection.execute(table.delete().where(table.c.voting_id.in_(voting_ids)))
+    for table in (TParlMembTermTally.__table__, TVotingVotes.__table__, TTermMembSlot.__table__,
+                  TVoting.__table__, TSitting.__table__):
+        connection.execute(table.delete().where(table.c.term == term))
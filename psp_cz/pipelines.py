@@ -1,174 +1,792 @@
-import re
-import hashlib
+import os
+import time
+from datetime import date
+from sqlalchemy import bindparam, func
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm.exc import NoResultFound
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 from scrapy.xlib.pydispatch import dispatcher
 from scrapy import signals, log
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DropItem, NotConfigured
 
 from .database import init_db
-from .database import db_session
+from .database import configure as configure_db
+from .database import create_session
+from .database import get_engine
+from .bulk import get_vote_writer, get_stored_votes
+from .votes import filter_known_votes
+from .cache import LRUCache
+from .dedup import FingerprintStore, item_fingerprint
+from .export import Exporter, get_picture_hash
+from .metrics import metrics, instrument_engine
+from .progress import update_progress
+from .aggregates import get_vote_changes, update_aggregates, move_parl_memb_votes, change_polit_group
+from .changelog import ChangeLog, new_run_id, get_changed
 from .items import ParlMembVote
 from .items import Voting
 from .items import Sitting
 from .items import ParlMemb
+from .items import SittingProgress
+from .items import VotingProgress
 from .psp_cz_models import Voting as TVoting
 from .psp_cz_models import ParlMemb as TParlMemb
-from .psp_cz_models import ParlMembVoting as TParlMembVoting
 from .psp_cz_models import Sitting as TSitting
 from .psp_cz_models import Region as TRegion
 from .psp_cz_models import PolitGroup as TPolitGroup
 
+# statements executed with every batch are built once so that the engine
+# reuses their compiled form
+SITTING_INSERT = TSitting.__table__.insert()
+VOTING_INSERT = TVoting.__table__.insert()
+VOTING_UPDATE = TVoting.__table__.update() \
+                    .where(TVoting.__table__.c.id == bindparam('b_id')) \
+                    .values(voting_nr=bindparam('b_voting_nr'),
+                            name=bindparam('b_name'),
+                            voting_date=bindparam('b_voting_date'),
+                            minutes_url=bindparam('b_minutes_url'),
+                            result=bindparam('b_result'),
+                            last_modified=func.now())
+PARL_MEMB_INSERT = TParlMemb.__table__.insert()
+
+# seconds without a new item after which DBStorePipeline flushes the batch -
+# the engine waits for the batched items to be stored
+FLUSH_IDLE_INTERVAL = 1.0
+
+# sent by DBStorePipeline in the reactor thread when a batch of items was
+# committed, with items and spider arguments
+items_stored = object()
+
 # Define your item pipelines here
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/topics/item-pipeline.html
 
 class DuplicatesPipeline(object):
-    def __init__(self):
+    """
+    Drops items which were already seen. Keys of the items are kept in a
+    compact fingerprint store (see dedup module). When DUPEFILTER_ITEMS_DIR
+    setting is set, fingerprints of items committed by DBStorePipeline (see
+    items_stored signal) are persisted there and the items are dropped in
+    later runs as well - an item lost in a failed batch is scraped again.
+    Progress items are never dropped, they record the current state.
+
+    """
+    def __init__(self, directory=None, bloom_bits=0):
+        self.directory = directory
+        self.bloom_bits = bloom_bits
+        # fingerprints seen in the current run
         self.duplicates = {}
+        # fingerprints of items stored in the database, kept between runs
+        self.stored = {}
         dispatcher.connect(self.spider_opened, signals.spider_opened)
         dispatcher.connect(self.spider_closed, signals.spider_closed)
+        dispatcher.connect(self.batch_stored, items_stored)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(directory=settings.get('DUPEFILTER_ITEMS_DIR'),
+                   bloom_bits=settings.getint('DUPEFILTER_ITEMS_BLOOM_BITS'))
 
     def spider_opened(self, spider):
-        self.duplicates[spider] = set()
+        if self.directory:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, '%s.fingerprints' % spider.name)
+            self.stored[spider] = FingerprintStore(path, self.bloom_bits)
+        self.duplicates[spider] = FingerprintStore(None, self.bloom_bits)
+        self.update_stats(spider)
 
     def spider_closed(self, spider):
-        del self.duplicates[spider]
+        self.update_stats(spider)
+        self.duplicates.pop(spider).close()
+        if spider in self.stored:
+            self.stored.pop(spider).close()
+
+    def batch_stored(self, items, spider):
+        store = self.stored.get(spider)
+        if store is None:
+            return
+        for item in items:
+            if not isinstance(item, (SittingProgress, VotingProgress)):
+                store.add(item_fingerprint(item))
 
+    def update_stats(self, spider):
+        stats = spider.crawler.stats
+        stores = [self.duplicates[spider]]
+        if spider in self.stored:
+            stores.append(self.stored[spider])
+            stats.set_value('dupefilter_items/persisted', len(self.stored[spider]), spider=spider)
+        stats.set_value('dupefilter_items/stored', len(self.duplicates[spider]), spider=spider)
+        stats.set_value('dupefilter_items/memory_bytes', sum(store.memory_usage() for store in stores),
+                        spider=spider)
+
+    @metrics.timed('pipeline/DuplicatesPipeline')
     def process_item(self, item, spider):
-        if item['id'] in self.duplicates[spider]:
+        if isinstance(item, (SittingProgress, VotingProgress)):
+            return item
+        fingerprint = item_fingerprint(item)
+        stored = self.stored.get(spider)
+        if (stored is not None and fingerprint in stored) or \
+                not self.duplicates[spider].add(fingerprint):
+            spider.crawler.stats.inc_value('dupefilter_items/dropped', spider=spider)
             raise DropItem("Duplicate item found: %s" % item)
         else:
-            self.duplicates[spider].add(item['id'])
+            if not len(self.duplicates[spider]) % 10000:
+                self.update_stats(spider)
 
             return item
 
 
 class DBStorePipeline(object):
-    def __init__(self):
+    """
+    Stores items into the database. Items are collected into batches which
+    are written in a single transaction each by a dedicated writer thread, so
+    that slow database does not block the reactor. process_item returns
+    Deferred which fires when the batch of the item is committed.
+
+    """
+    def __init__(self, batch_size=500, batch_timeout=10.0, cache_size=10000,
+                 vote_conflict='ignore', queue_size=1000, vote_storage='rows', aggregates=True,
+                 flush_retries=3, change_log=True):
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.batch = []
+        # Deferreds of the batched items, fired when the batch is committed
+        self.batch_results = []
+        self.last_flush = time.time()
+        self.last_item = time.time()
+        self.cache_size = cache_size
+        # natural keys of stored entities -> primary keys, warmed up when the
+        # spider is opened
+        self.caches = {
+            # sitting url -> id
+            'sitting': LRUCache(cache_size),
+            # voting url -> id
+            'voting': LRUCache(cache_size),
+            # voting id -> term
+            'voting_term': LRUCache(cache_size),
+            # psp.cz id of parliament member -> id
+            'parl_memb': LRUCache(cache_size),
+            # region url -> id
+            'region': LRUCache(cache_size),
+            # political group url -> id
+            'polit_group': LRUCache(cache_size),
+        }
+        # voting id -> {parliament member id: vote} of stored votes; only
+        # recent votings are kept as these are the ones votes arrive for
+        self.stored_votes = LRUCache(100)
+        self.vote_conflict = vote_conflict
+        self.vote_storage = vote_storage
+        self.vote_writer = None
+        self.aggregates = aggregates
+        self.flush_retries = flush_retries
+        self.change_log_enabled = change_log
+        # change records of the current batch, created with the run id when
+        # the spider is opened
+        self.change_log = None
+        self.session = None
+        self.spider = None
+        # single thread keeps the order of items
+        self.writer = ThreadPool(minthreads=1, maxthreads=1, name='DBStorePipeline')
+        # at most queue_size items wait for the writer, which slows down the
+        # engine when the database falls behind
+        self.queue = DeferredSemaphore(queue_size)
+        # flushes the batch when items stop arriving
+        self.flush_timer = LoopingCall(self.flush_pending)
         dispatcher.connect(self.spider_opened, signals.spider_opened)
-        dispatcher.connect(self.spider_closed, signals.spider_closed)
+
+    @classmethod
+    def from_settings(cls, settings):
+        configure_db(settings)
+        return cls(batch_size=settings.getint('DB_BATCH_SIZE', 500),
+                   batch_timeout=settings.getfloat('DB_BATCH_TIMEOUT', 10.0),
+                   cache_size=settings.getint('DB_CACHE_SIZE', 10000),
+                   vote_conflict=settings.get('DB_VOTE_CONFLICT', 'ignore'),
+                   queue_size=settings.getint('DB_WRITER_QUEUE_SIZE', 1000),
+                   vote_storage=settings.get('VOTE_STORAGE', 'rows'),
+                   aggregates=settings.getbool('DB_AGGREGATES', True),
+                   flush_retries=settings.getint('DB_FLUSH_RETRIES', 3),
+                   change_log=settings.getbool('DB_CHANGE_LOG', True))
 
     def spider_opened(self, spider):
+        self.spider = spider
+        if self.change_log_enabled:
+            self.change_log = ChangeLog(new_run_id(spider.name))
+            log.msg('Changes are logged with run id %s' % self.change_log.run_id, spider=spider)
+        self.writer.start()
+        dfd = self.run_in_writer(self.open_db)
+        if self.batch_timeout > 0:
+            dfd.addCallback(self.start_flush_timer)
+        return dfd
+
+    def start_flush_timer(self, result):
+        # Deferred of start() fires when the timer is stopped, not waited for
+        self.flush_timer.start(min(self.batch_timeout, FLUSH_IDLE_INTERVAL), now=False)
+        return result
+
+    def close_spider(self, spider):
+        # called before spider_closed signal, so the last batch is stored
+        # before the stats and metrics are collected
+        if self.flush_timer.running:
+            self.flush_timer.stop()
+        dfd = self.run_in_writer(self.close_db)
+        dfd.addBoth(self.stop_writer)
+        return dfd
+
+    def run_in_writer(self, func, *args):
+        """Runs func in the writer thread; returns Deferred with its result"""
+        return deferToThreadPool(reactor, self.writer, func, *args)
+
+    def inc_stats(self, key, count=1):
+        """Increments spider stats value; safe to call from the writer thread"""
+        reactor.callFromThread(self.spider.crawler.stats.inc_value, key, count, spider=self.spider)
+
+    def flush_pending(self):
+        """Queues flush of the batch if no items arrive or DB_BATCH_TIMEOUT elapsed"""
+        dfd = self.queue.run(self.run_in_writer, self.flush_idle)
+        # the timer must keep running
+        dfd.addErrback(log.err, 'Timed flush failed')
+        return dfd
+
+    def stop_writer(self, result):
+        self.writer.stop()
+        return result
+
+    def open_db(self):
         init_db()
+        engine = get_engine()
+        instrument_engine(engine)
+        self.session = create_session()
+        self.vote_writer = get_vote_writer(engine, self.vote_conflict, self.vote_storage)
+        self.warm_caches()
+        self.last_flush = time.time()
 
-    def spider_closed(self, spider):
-        db_session.close()
+    def close_db(self):
+        try:
+            self.flush()
+        finally:
+            self.session.close()
+            self.session = None
+        for name, cache in self.caches.iteritems():
+            log.msg('Cache %s: %d hits, %d misses' % (name, cache.hits, cache.misses),
+                    level=log.DEBUG)
+
+    def warm_caches(self):
+        """Loads natural key to id mappings of already stored entities"""
+        self.caches['sitting'].update(dict(self.session.query(TSitting.url, TSitting.id)))
+        self.caches['parl_memb'].update(dict(self.session.query(TParlMemb.psp_cz_id, TParlMemb.id)))
+        self.caches['region'].update(dict(self.session.query(TRegion.url, TRegion.id)))
+        self.caches['polit_group'].update(dict(self.session.query(TPolitGroup.url, TPolitGroup.id)))
+        # there are too many votings - take just the latest ones
+        latest_votings = self.session.query(TVoting.url, TVoting.id, TVoting.term) \
+                                   .order_by(TVoting.id.desc()) \
+                                   .limit(self.cache_size).all()
+        for url, id, term in reversed(latest_votings):
+            self.caches['voting'].put(url, id)
+            self.caches['voting_term'].put(id, term)
+        self.session.commit()
+
+    def clear_caches(self):
+        """Forgets cached ids - ids assigned in a rolled back transaction are not valid"""
+        for cache in self.caches.itervalues():
+            cache.clear()
+        self.stored_votes.clear()
+        self.vote_writer.clear()
+
+    def rollback(self):
+        self.session.rollback()
+        self.clear_caches()
+        if self.change_log is not None:
+            self.change_log.clear()
 
     def process_item(self, item, spider):
-        if isinstance(item, Sitting):
-            if self.get_db_sitting(item) == None:
-                sitting = TSitting(url = item['url'],
-                                   name = item['name'])
-                db_session.add(sitting)
-                db_session.commit()
-
-        elif isinstance(item, Voting):
-            if self.get_db_voting(item) == None:
-                voting = TVoting(url = item['url'],
-                                 voting_nr = item['voting_nr'],
-                                 name = item['name'],
-                                 voting_date = item['voting_date'],
-                                 minutes_url = item['minutes_url'],
-                                 result = item['result'],
-                                 sitting = self.get_db_sitting(item['sitting']))
-                db_session.add(voting)
-                db_session.commit()
-
-        elif isinstance(item, ParlMembVote):
-            if self.get_db_parl_memb_vote(item) == None:
-                # check if parliament member exists; create one if not
-                parl_memb = self.get_db_parl_memb(item)
-                if parl_memb == None:
-                    parl_memb = TParlMemb(url = item['parl_memb_url'],
-                                          name = item['parl_memb_name'],
-                                          psp_cz_id = item['parl_memb_id'])
-                    db_session.add(parl_memb)
-                    db_session.commit()
-
-                parl_memb_voting = TParlMembVoting(vote = item['vote'],
-                                                   parlMemb = parl_memb,
-                                                   voting = self.get_db_voting(item['voting']))
-                db_session.add(parl_memb_voting)
-                db_session.commit()
-
-        elif isinstance(item, ParlMemb):
-            region = self.get_db_region(item)
-            if region == None:
+        result = Deferred()
+        dfd = self.queue.run(self.run_in_writer, self.store_item, item, result)
+        dfd.addErrback(result.errback)
+        return result
+
+    @metrics.timed('pipeline/DBStorePipeline')
+    def store_item(self, item, result):
+        """
+        Adds item to the batch; runs in the writer thread. Deferred result
+        fires with the item when its batch is committed.
+
+        """
+        if isinstance(item, (Sitting, Voting, ParlMembVote, ParlMemb, SittingProgress, VotingProgress)):
+            self.batch.append(item)
+            self.batch_results.append(result)
+            self.last_item = time.time()
+        else:
+            reactor.callFromThread(result.callback, item)
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_timed_out()
+
+    def flush_timed_out(self):
+        """Flushes the batch if DB_BATCH_TIMEOUT elapsed since the last flush"""
+        if time.time() - self.last_flush >= self.batch_timeout:
+            self.flush()
+
+    def flush_idle(self):
+        """Flushes the batch if no item came for FLUSH_IDLE_INTERVAL or it timed out"""
+        if time.time() - self.last_item >= FLUSH_IDLE_INTERVAL:
+            self.flush()
+        else:
+            self.flush_timed_out()
+
+    def flush(self):
+        """
+        Writes all buffered items in one transaction. A batch which failed on
+        a conflict with another writer, e.g. when parallel replay workers
+        create the same parliament member, is rolled back and written again
+        at most DB_FLUSH_RETRIES times, items of a batch which failed anyway
+        are dropped.
+
+        """
+        batch, self.batch = self.batch, []
+        results, self.batch_results = self.batch_results, []
+        self.last_flush = time.time()
+        if not batch:
+            return
+
+        attempt = 0
+        while True:
+            try:
+                self.store_batch(batch)
+                break
+            except (IntegrityError, OperationalError), e:
+                self.rollback()
+                attempt += 1
+                if attempt > self.flush_retries:
+                    self.batch_lost(batch, results)
+                    return
+                log.msg('Batch of %d items failed (%s), writing it again' % (len(batch), e),
+                        level=log.WARNING)
+            except:
+                self.rollback()
+                self.batch_lost(batch, results)
+                return
+
+        log.msg('Stored batch of %d items' % len(batch), level=log.DEBUG)
+        reactor.callFromThread(self.batch_stored, batch, results)
+
+    def batch_stored(self, batch, results):
+        """Announces the committed batch and fires Deferreds of its items"""
+        dispatcher.send(signal=items_stored, sender=self, items=batch, spider=self.spider)
+        for item, result in zip(batch, results):
+            result.callback(item)
+
+    def batch_lost(self, batch, results):
+        """
+        Drops items of the batch which was not stored; called in the writer
+        thread while handling the error.
+
+        """
+        log.err(None, 'Batch of %d items was not stored!' % len(batch))
+        self.inc_stats('db/items_lost', len(batch))
+        error = DropItem('Item was not stored, its batch failed')
+        for result in results:
+            reactor.callFromThread(result.errback, error)
+
+    def store_batch(self, batch):
+        """
+        Stores parent entities (sittings, votings, parliament members) first,
+        then the votes referring to them and progress items, whose counts of
+        stored votes and complete votings include the votes of the batch (see
+        psp_cz.progress). Inserted and updated rows are recorded in change_log
+        table unless DB_CHANGE_LOG setting is off (see psp_cz.changelog).
+
+        """
+        with metrics.timer('db/flush'):
+            self.store_sittings([i for i in batch if isinstance(i, Sitting)])
+            self.store_votings([i for i in batch if isinstance(i, Voting)])
+            self.store_parl_membs([i for i in batch if isinstance(i, ParlMemb)])
+            self.store_parl_memb_votes([i for i in batch if isinstance(i, ParlMembVote)])
+            self.store_progress([i for i in batch if isinstance(i, (SittingProgress, VotingProgress))])
+            if self.change_log is not None:
+                self.change_log.write(self.session)
+            with metrics.timer('db/commit'):
+                self.session.commit()
+
+    @metrics.timed('db/store_sittings')
+    def store_sittings(self, items):
+        """Inserts sittings which are not in the database yet"""
+        sittings = dict((item['url'], item) for item in items)
+        if not sittings:
+            return
+
+        existing = self.get_db_sitting_ids(sittings.keys())
+        rows = [{'url': item['url'],
+                 'name': item['name'],
+                 'term': item['term'],
+                 'sitting_no': item['sitting_no']}
+                for url, item in sittings.iteritems() if url not in existing]
+        if rows:
+            self.session.execute(SITTING_INSERT, rows)
+            self.caches['sitting'].invalidate(row['url'] for row in rows)
+            if self.change_log is not None:
+                ids = self.get_db_sitting_ids([row['url'] for row in rows])
+                for row in rows:
+                    self.change_log.inserted(TSitting.__table__, ids[row['url']], row)
+
+    @metrics.timed('db/store_votings')
+    def store_votings(self, items):
+        """Inserts votings which are not in the database yet, updates stored ones in update mode"""
+        votings = dict((item['url'], item) for item in items)
+        if not votings:
+            return
+
+        existing = self.get_db_voting_ids(votings.keys())
+        if existing and self.vote_conflict == 'update':
+            self.update_votings(dict((id, votings[url]) for url, id in existing.iteritems()))
+        new_votings = [item for url, item in votings.iteritems() if url not in existing]
+        if not new_votings:
+            return
+
+        sitting_ids = self.get_db_sitting_ids(set(item['sitting_url'] for item in new_votings))
+        rows = [{'url': item['url'],
+                 'voting_nr': item['voting_nr'],
+                 'name': item['name'],
+                 'voting_date': item['voting_date'],
+                 'minutes_url': item['minutes_url'],
+                 'result': item['result'],
+                 'sitting_id': sitting_ids[item['sitting_url']],
+                 'term': item['term']}
+                for item in new_votings]
+        self.session.execute(VOTING_INSERT, rows)
+        self.caches['voting'].invalidate(row['url'] for row in rows)
+
+        ids = self.get_db_voting_ids([row['url'] for row in rows])
+        for row in rows:
+            self.caches['voting_term'].put(ids[row['url']], row['term'])
+        # new votings have no votes stored yet
+        for voting_id in ids.itervalues():
+            self.stored_votes.put(voting_id, {})
+        if self.change_log is not None:
+            for row in rows:
+                self.change_log.inserted(TVoting.__table__, ids[row['url']], row)
+
+    @metrics.timed('db/update_votings')
+    def update_votings(self, votings):
+        """Updates stored votings (id -> item) whose values differ from the crawled ones"""
+        stored = self.session.query(TVoting.id, TVoting.voting_nr, TVoting.name, TVoting.voting_date,
+                                    TVoting.minutes_url, TVoting.result) \
+                             .filter(TVoting.id.in_(votings.keys()))
+        params = []
+        for row in stored:
+            item = votings[row.id]
+            changed = get_changed(row, {'voting_nr': item['voting_nr'],
+                                        'name': item['name'],
+                                        'voting_date': item['voting_date'],
+                                        'minutes_url': item['minutes_url'],
+                                        'result': item['result']})
+            if not changed:
+                continue
+            params.append({'b_id': row.id,
+                           'b_voting_nr': item['voting_nr'],
+                           'b_name': item['name'],
+                           'b_voting_date': item['voting_date'],
+                           'b_minutes_url': item['minutes_url'],
+                           'b_result': item['result']})
+            if self.change_log is not None:
+                self.change_log.updated(TVoting.__table__, row.id, changed)
+        if params:
+            self.session.execute(VOTING_UPDATE, params)
+
+    @metrics.timed('db/store_parl_membs')
+    def store_parl_membs(self, items):
+        """
+        Inserts parliament members or updates their changed values, including
+        regions and political groups. Membership of members who changed
+        political group ends today and counts of their votes since today are
+        moved to the new group (see aggregates.change_polit_group).
+
+        """
+        today = date.today()
+        # (parliament member id, old group id, new group id, since)
+        group_moves = []
+        for item in items:
+            region_id = self.get_db_region_ids([item['region_url']]).get(item['region_url'])
+            if region_id == None:
                 # add region if it does not exists
                 region = TRegion(name=item['region'],
                                  url=item['region_url'])
-                db_session.add(region)
-                db_session.commit()
+                self.session.add(region)
+                self.session.flush()
+                region_id = region.id
+                self.caches['region'].put(region.url, region.id)
+                if self.change_log is not None:
+                    self.change_log.inserted(TRegion.__table__, region.id,
+                                             {'name': region.name, 'url': region.url})
 
-            polit_group = self.get_db_polit_group(item)
-            if polit_group == None:
+            polit_group_id = self.get_db_polit_group_ids([item['group_url']]).get(item['group_url'])
+            if polit_group_id == None:
                 # add political group if it does not exists
                 polit_group = TPolitGroup(name=item['group'],
                                           name_full=item['group_long'],
                                           url=item['group_url'])
-                db_session.add(polit_group)
-                db_session.commit()
+                self.session.add(polit_group)
+                self.session.flush()
+                polit_group_id = polit_group.id
+                self.caches['polit_group'].put(polit_group.url, polit_group.id)
+                if self.change_log is not None:
+                    self.change_log.inserted(TPolitGroup.__table__, polit_group.id,
+                                             {'name': polit_group.name,
+                                              'name_full': polit_group.name_full,
+                                              'url': polit_group.url})
 
+            values = {'url': item['url'],
+                      'name_full': item['name'],
+                      'born': item['born'],
+                      'picture_hash': get_picture_hash(item),
+                      'gender': item['gender'],
+                      'psp_cz_id': item['parl_memb_id'],
+                      'region_id': region_id,
+                      'polit_group_id': polit_group_id}
             parl_memb = self.get_db_parl_memb(item)
             if parl_memb == None:
                 log.msg('Parliament member not found! %s (%s)' % (item['name'], item['url']))
                 # insert new parliament member
-                parl_memb = TParlMemb(url=item['url'],
-                                      name_full=item['name'],
-                                      born=item['born'],
-                                      # file is named by url hash - see
-                                      # ImagesPipeline.image_key()
-                                      picture_hash=hashlib.sha1(item['image_urls'][0]).hexdigest(),
-                                      gender=item['gender'],
-                                      psp_cz_id=item['parl_memb_id'],
-                                      region=region,
-                                      polit_group=polit_group)
-                db_session.add(parl_memb)
+                parl_memb = TParlMemb(**values)
+                self.session.add(parl_memb)
+                self.session.flush()
+                change_polit_group(self.session, parl_memb.id, polit_group_id, today)
+                if self.change_log is not None:
+                    self.change_log.inserted(TParlMemb.__table__, parl_memb.id, values)
             else:
-                #update existing values
-                parl_memb.url = item['url']
-                parl_memb.name_full = item['name']
-                parl_memb.born = item['born']
-                # file is named by url hash - see
-                # ImagesPipeline.image_key()
-                parl_memb.picture_hash = hashlib.sha1(item['image_urls'][0]).hexdigest()
-                parl_memb.gender = item['gender']
-                parl_memb.psp_cz_id = item['parl_memb_id']
-                parl_memb.region = region
-                parl_memb.polit_group = polit_group
+                # update only changed values
+                changed = get_changed(parl_memb, values)
+                if 'polit_group_id' in changed:
+                    since = change_polit_group(self.session, parl_memb.id, polit_group_id, today)
+                    group_moves.append((parl_memb.id, parl_memb.polit_group_id, polit_group_id, since))
+                if changed:
+                    for key, value in changed.iteritems():
+                        setattr(parl_memb, key, value)
+                    parl_memb.last_modified = func.now()
+                    self.session.flush()
+                    if self.change_log is not None:
+                        self.change_log.updated(TParlMemb.__table__, parl_memb.id, changed)
 
-            db_session.commit()
+            self.caches['parl_memb'].put(parl_memb.psp_cz_id, parl_memb.id)
 
+        if self.aggregates and group_moves:
+            with metrics.timer('db/update_aggregates'):
+                move_parl_memb_votes(self.session, group_moves, self.vote_storage)
 
-        return item
+    @metrics.timed('db/store_parl_memb_votes')
+    def store_parl_memb_votes(self, items):
+        """
+        Inserts votes of parliament members by the bulk writer of VOTE_STORAGE
+        and DB_VOTE_CONFLICT settings (see psp_cz.bulk) and updates summary
+        tables of the votes unless DB_AGGREGATES setting is off (see
+        psp_cz.aggregates). Parliament members not known yet are created from
+        the vote information.
+
+        """
+        if not items:
+            return
+
+        voting_ids = self.get_db_voting_ids(set(item['voting_url'] for item in items))
+        voting_terms = self.get_db_voting_terms(set(voting_ids.itervalues()))
+        # votes of votings lost in an earlier failed batch cannot be stored
+        skipped = [item for item in items if item['voting_url'] not in voting_ids]
+        if skipped:
+            for voting_url in sorted(set(item['voting_url'] for item in skipped)):
+                log.msg('Votes of voting %s skipped, the voting is not stored' % voting_url,
+                        level=log.WARNING)
+            self.inc_stats('db/votes_skipped', len(skipped))
+            items = [item for item in items if item['voting_url'] in voting_ids]
+            if not items:
+                return
+
+        # check if parliament members exist; create those which do not
+        parl_memb_ids = self.get_db_parl_memb_ids(set(item['parl_memb_id'] for item in items))
+        new_parl_membs = {}
+        for item in items:
+            if item['parl_memb_id'] not in parl_memb_ids:
+                new_parl_membs[item['parl_memb_id']] = {'url': item['parl_memb_url'],
+                                                        'name': item['parl_memb_name'],
+                                                        'psp_cz_id': item['parl_memb_id']}
+        if new_parl_membs:
+            self.session.execute(PARL_MEMB_INSERT, new_parl_membs.values())
+            self.caches['parl_memb'].invalidate(new_parl_membs.keys())
+            parl_memb_ids.update(self.get_db_parl_memb_ids(new_parl_membs.keys()))
+            if self.change_log is not None:
+                for psp_cz_id, values in new_parl_membs.iteritems():
+                    self.change_log.inserted(TParlMemb.__table__, parl_memb_ids[psp_cz_id], values)
+
+        rows = [{'vote': item['vote'],
+                 'voting_id': voting_ids[item['voting_url']],
+                 'parl_memb_id': parl_memb_ids[item['parl_memb_id']],
+                 'term': voting_terms[voting_ids[item['voting_url']]]}
+                for item in items]
+        if self.vote_storage == 'packed':
+            # unknown votes are not stored, they must not be counted either
+            rows = filter_known_votes(rows)
+        if self.vote_writer.resolves_conflicts and not self.aggregates:
+            self.vote_writer.write(self.session, rows)
+            return
+
+        stored_votes = self.get_db_stored_votes(set(voting_ids.values()))
+        changes = None
+        if self.aggregates:
+            changes = get_vote_changes(rows, stored_votes, self.vote_conflict)
+        self.vote_writer.write(self.session, rows, stored_votes)
+        if changes:
+            with metrics.timer('db/update_aggregates'):
+                update_aggregates(self.session, changes)
+            # writers resolving conflicts by themselves do not update stored votes
+            for voting_id, parl_memb_id, old, new in changes:
+                stored_votes[voting_id][parl_memb_id] = new
+
+    @metrics.timed('db/store_progress')
+    def store_progress(self, items):
+        """Stores expected numbers of votings and votes and recounts the stored ones"""
+        if not items:
+            return
+
+        sitting_items = [item for item in items if isinstance(item, SittingProgress)]
+        voting_items = [item for item in items if isinstance(item, VotingProgress)]
+        sitting_ids = self.get_db_sitting_ids(set(item['url'] for item in sitting_items))
+        voting_ids = self.get_db_voting_ids(set(item['url'] for item in voting_items))
+        update_progress(self.session,
+                        votes_expected=dict((voting_ids[item['url']], item['votes_expected'])
+                                            for item in voting_items if item['url'] in voting_ids),
+                        votings_expected=dict((sitting_ids[item['url']], item['votings_expected'])
+                                              for item in sitting_items if item['url'] in sitting_ids),
+                        storage=self.vote_storage)
+
+    def get_db_ids(self, cache_name, key_column, id_column, keys):
+        """
+        Helper procedure that maps natural keys to DB ids. Only keys missing
+        in the cache are looked up in the database.
+
+        """
+        cache = self.caches[cache_name]
+        result = {}
+        missing = []
+        for key in keys:
+            id = cache.get(key)
+            if id is None:
+                missing.append(key)
+            else:
+                result[key] = id
+
+        if missing:
+            found = dict(self.session.query(key_column, id_column).filter(key_column.in_(missing)))
+            cache.update(found)
+            result.update(found)
+
+        return result
+
+    @metrics.timed('db/get_db_sitting_ids')
+    def get_db_sitting_ids(self, urls):
+        """Helper procedure that maps Sitting urls to DB ids"""
+        return self.get_db_ids('sitting', TSitting.url, TSitting.id, urls)
+
+    @metrics.timed('db/get_db_voting_ids')
+    def get_db_voting_ids(self, urls):
+        """Helper procedure that maps Voting urls to DB ids"""
+        return self.get_db_ids('voting', TVoting.url, TVoting.id, urls)
 
-    def get_db_sitting(self, item):
-        """Helper procedure that fetches DB Sitting entity based on Sitting Item"""
-        if isinstance(item, Sitting):
-            return db_session.query(TSitting).filter_by(url=item['url']).first()
+    @metrics.timed('db/get_db_voting_terms')
+    def get_db_voting_terms(self, voting_ids):
+        """Helper procedure that maps Voting ids to terms"""
+        return self.get_db_ids('voting_term', TVoting.id, TVoting.term, voting_ids)
 
-    def get_db_voting(self, item):
-        """Helper procedure that fetches DB Voting entity based on Voting Item"""
-        if isinstance(item, Voting):
-            return db_session.query(TVoting).filter_by(url=item['url']).first()
+    @metrics.timed('db/get_db_parl_memb_ids')
+    def get_db_parl_memb_ids(self, psp_cz_ids):
+        """Helper procedure that maps psp.cz ids of parliament members to DB ids"""
+        return self.get_db_ids('parl_memb', TParlMemb.psp_cz_id, TParlMemb.id, psp_cz_ids)
 
+    @metrics.timed('db/get_db_region_ids')
+    def get_db_region_ids(self, urls):
+        """Helper procedure that maps Region urls to DB ids"""
+        return self.get_db_ids('region', TRegion.url, TRegion.id, urls)
+
+    @metrics.timed('db/get_db_polit_group_ids')
+    def get_db_polit_group_ids(self, urls):
+        """Helper procedure that maps PolitGroup urls to DB ids"""
+        return self.get_db_ids('polit_group', TPolitGroup.url, TPolitGroup.id, urls)
+
+    @metrics.timed('db/get_db_stored_votes')
+    def get_db_stored_votes(self, voting_ids):
+        """
+        Helper procedure that maps Voting ids to already stored votes -
+        dictionaries of parliament member id -> vote
+
+        """
+        result = {}
+        missing = []
+        for voting_id in voting_ids:
+            parl_memb_ids = self.stored_votes.get(voting_id)
+            if parl_memb_ids is None:
+                missing.append(voting_id)
+            else:
+                result[voting_id] = parl_memb_ids
+
+        if missing:
+            found = get_stored_votes(self.session, missing, self.vote_storage)
+            self.stored_votes.update(found)
+            result.update(found)
+
+        return result
+
+    @metrics.timed('db/get_db_parl_memb')
     def get_db_parl_memb(self, item):
         """Helper procedure that fetches DB ParlMemb entity based on ParlMembVote or ParlMemb Item"""
-        return db_session.query(TParlMemb).filter_by(psp_cz_id=item['parl_memb_id']).first()
-
-    def get_db_parl_memb_vote(self, item):
-        """Helper procedure that fetches DB ParlMembVote entity based on ParlMembVote Item"""
-        if isinstance(item, ParlMembVote):
-            return db_session.query(TParlMembVoting).filter_by(parlMemb=self.get_db_parl_memb(item),
-                                                             voting=self.get_db_voting(item['voting'])).first()
-
-    def get_db_region(self, item):
-        """Helper procedure that fetches DB Region entity based on ParlMemb Item"""
-        if isinstance(item, ParlMemb):
-            return db_session.query(TRegion).filter_by(url=item['region_url']).first()
-
-    def get_db_polit_group(self, item):
-        """Helper procedure that fetches DB PolitGroup entity based on ParlMemb Item"""
-        if isinstance(item, ParlMemb):
-            return db_session.query(TPolitGroup).filter_by(url=item['group_url']).first()
+        return self.session.query(TParlMemb).filter_by(psp_cz_id=item['parl_memb_id']).first()
+
+
+class ExportPipeline(object):
+    """
+    Writes items into gzip compressed JSON Lines or CSV files instead of the
+    database - it can replace DBStorePipeline in ITEM_PIPELINES. Files are
+    written into EXPORT_DIR in EXPORT_FORMAT ('jsonl' or 'csv'), a new file
+    is started after EXPORT_FILE_RECORDS records of the item type. See export
+    module for the file layout.
+
+    """
+    def __init__(self, directory, format='jsonl', file_records=1000000, buffer_size=1 << 20):
+        self.directory = directory
+        self.format = format
+        self.file_records = file_records
+        self.buffer_size = buffer_size
+        self.exporters = {}
+        dispatcher.connect(self.spider_opened, signals.spider_opened)
+        dispatcher.connect(self.spider_closed, signals.spider_closed)
+
+    @classmethod
+    def from_settings(cls, settings):
+        directory = settings.get('EXPORT_DIR')
+        if not directory:
+            raise NotConfigured('EXPORT_DIR setting is not set')
+        return cls(directory,
+                   format=settings.get('EXPORT_FORMAT', 'jsonl'),
+                   file_records=settings.getint('EXPORT_FILE_RECORDS', 1000000),
+                   buffer_size=settings.getint('EXPORT_BUFFER_SIZE', 1 << 20))
+
+    def spider_opened(self, spider):
+        self.exporters[spider] = Exporter(self.directory, spider.name, self.format,
+                                          self.file_records, self.buffer_size)
+
+    def spider_closed(self, spider):
+        exporter = self.exporters.pop(spider)
+        exporter.close()
+        for item_type, export_file in sorted(exporter.files.iteritems()):
+            log.msg('Exported %d %s records into %s' % (export_file.total_records, item_type,
+                                                          ', '.join(export_file.paths)),
+                    spider=spider)
+
+    @metrics.timed('pipeline/ExportPipeline')
+    def process_item(self, item, spider):
+        # crawl progress is kept in the database only
+        if not isinstance(item, (SittingProgress, VotingProgress)):
+            self.exporters[spider].export(item)
+        return item
@@ -0,0 +1,100 @@
+# coding=utf-8
+"""
+Crawl progress stored in the database.
+
+Every sitting keeps the number of votings listed on its pages
+(votings_expected) and the number of its votings whose votes are complete
+(votings_stored). Every voting keeps the number of votes on its page
+(votes_expected) and the number of votes stored (votes_stored). The spider
+reports the expected numbers by SittingProgress and VotingProgress items,
+DBStorePipeline stores them together with the stored numbers counted in the
+database (see update_progress).
+
+A sitting or a voting is complete when its stored number reached the
+expected one. Complete sittings and votings are not downloaded again, so an
+interrupted crawl continues where it stopped.
+
+"""
+from sqlalchemy import and_, bindparam, func, select
+
+from .votes import count_votes
+from .psp_cz_models import Sitting as TSitting
+from .psp_cz_models import Voting as TVoting
+from .psp_cz_models import ParlMembVoting as TParlMembVoting
+from .psp_cz_models import VotingVotes as TVotingVotes
+
+# statements are built once so that the engine reuses their compiled form
+VOTES_PROGRESS_UPDATE = TVoting.__table__.update() \
+                            .where(TVoting.__table__.c.id == bindparam('b_id')) \
+                            .values(votes_expected=bindparam('b_expected'),
+                                    votes_stored=bindparam('b_stored'))
+VOTINGS_PROGRESS_UPDATE = TSitting.__table__.update() \
+                              .where(TSitting.__table__.c.id == bindparam('b_id')) \
+                              .values(votings_expected=bindparam('b_expected'))
+
+
+def count_stored_votes(session, voting_ids, storage='rows'):
+    """Returns dictionary of voting id -> number of stored votes of the voting"""
+    result = dict((voting_id, 0) for voting_id in voting_ids)
+    if not result:
+        return result
+
+    if storage == 'packed':
+        for voting_id, votes in session.query(TVotingVotes.voting_id, TVotingVotes.votes) \
+                                       .filter(TVotingVotes.voting_id.in_(result.keys())):
+            result[voting_id] = count_votes(votes)
+    else:
+        result.update(session.query(TParlMembVoting.voting_id, func.count(TParlMembVoting.id))
+                             .filter(TParlMembVoting.voting_id.in_(result.keys()))
+                             .group_by(TParlMembVoting.voting_id))
+    return result
+
+
+def update_progress(session, votes_expected=None, votings_expected=None, storage='rows'):
+    """
+    Stores expected numbers of votes (dictionary of voting id -> number) and
+    of votings (dictionary of sitting id -> number) and recounts the stored
+    numbers of the votings and of the sittings they belong to.
+
+    """
+    votes_expected = votes_expected or {}
+    votings_expected = votings_expected or {}
+    sitting_ids = set(votings_expected)
+
+    if votes_expected:
+        stored = count_stored_votes(session, votes_expected.keys(), storage)
+        session.execute(VOTES_PROGRESS_UPDATE,
+                        [{'b_id': voting_id, 'b_expected': expected, 'b_stored': stored[voting_id]}
+                         for voting_id, expected in votes_expected.iteritems()])
+        sitting_ids.update(sitting_id for sitting_id, in session.query(TVoting.sitting_id)
+                                                                 .filter(TVoting.id.in_(votes_expected.keys()))
+                                                                 .distinct())
+
+    if votings_expected:
+        session.execute(VOTINGS_PROGRESS_UPDATE,
+                        [{'b_id': sitting_id, 'b_expected': expected}
+                         for sitting_id, expected in votings_expected.iteritems()])
+
+    if sitting_ids:
+        sitting = TSitting.__table__
+        voting = TVoting.__table__
+        complete_votings = select([func.count(voting.c.id)]) \
+                               .where(and_(voting.c.sitting_id == sitting.c.id,
+                                           voting.c.votes_stored >= voting.c.votes_expected)) \
+                               .as_scalar()
+        session.execute(sitting.update()
+                               .where(sitting.c.id.in_(sitting_ids))
+                               .values(votings_stored=complete_votings))
+
+
+def get_complete_sitting_urls(session):
+    """Returns urls of sittings with all votings complete"""
+    return set(url for url, in session.query(TSitting.url)
+                                      .filter(TSitting.votings_stored >= TSitting.votings_expected))
+
+
+def get_complete_voting_urls(session):
+    """Returns urls of votings with all votes stored"""
+    return set(url for url, in session.query(TVoting.url)
+                                      .filter(TVoting.votes_stored >= TVoting.votes_expected))
+
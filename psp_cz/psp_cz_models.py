@@ -1,5 +1,5 @@
 # coding=utf-8
-from sqlalchemy import func, Column, Integer, String, Date, DateTime
+from sqlalchemy import func, Column, Integer, String, Date, DateTime, LargeBinary, Text
 from sqlalchemy.orm import relationship, object_mapper, ColumnProperty
 from sqlalchemy.schema import ForeignKey, UniqueConstraint, Index
 import datetime
@@ -31,20 +31,25 @@ class BaseMixin(object):
 class Sitting(BaseMixin, Base):
     __tablename__ = 'sitting'
     __table_args__ = (
-                      Index('ix_sit_url', 'url'),
+                      Index('ix_sit_term_sitting_no', 'term', 'sitting_no'),
                       )
 
     url = Column(String(4000), unique=True, nullable=False)
     name = Column(String(255), nullable=False)
+    term = Column(Integer)
+    sitting_no = Column(Integer)
+    # crawl progress (see psp_cz.progress)
+    votings_expected = Column(Integer)
+    votings_stored = Column(Integer)
 
     votings = relationship('Voting', backref='sitting')
 
 class Voting(BaseMixin, Base):
     __tablename__ = 'voting'
     __table_args__ = (
-                      Index('ix_vot_url', 'url'),
                       Index('ix_vot_sitting_id', 'sitting_id'),
-                      Index('ix_vot_voting_date', 'voting_date')
+                      Index('ix_vot_voting_date', 'voting_date'),
+                      Index('ix_vot_term', 'term'),
                       )
 
     url = Column(String(4000), unique=True, nullable=False)
@@ -54,14 +59,18 @@ class Voting(BaseMixin, Base):
     minutes_url = Column(String(4000))
     result = Column(String(50), nullable=False)
     sitting_id = Column(Integer, ForeignKey('sitting.id'), nullable=False)
+    term = Column(Integer, nullable=False) # term of the sitting, psp_cz.bulk.UNKNOWN_TERM if it has none
+    # crawl progress (see psp_cz.progress)
+    votes_expected = Column(Integer)
+    votes_stored = Column(Integer)
 
     parlMembVotings = relationship('ParlMembVoting', backref='voting')
+    packedVotes = relationship('VotingVotes', uselist=False, backref='voting')
 
 class ParlMemb(BaseMixin, Base):
     __tablename__ = 'parl_memb'
     __table_args__ = (
                       UniqueConstraint('psp_cz_id'),
-                      Index('ix_pm_url', 'url'),
                       )
 
     url = Column(String(4000), unique=True, nullable=False)
@@ -76,17 +85,90 @@ class ParlMemb(BaseMixin, Base):
 
     parlMembVotings = relationship('ParlMembVoting', backref='parlMemb')
 
+class PolitGroupMemb(BaseMixin, Base):
+    """Membership of parliament member in political group, votes are counted for it (see psp_cz.aggregates)"""
+    __tablename__ = 'polit_group_memb'
+    __table_args__ = (
+                      Index('ix_pgm_parl_memb_id', 'parl_memb_id'),
+                      )
+
+    parl_memb_id = Column(Integer, ForeignKey('parl_memb.id'), nullable=False)
+    polit_group_id = Column(Integer, ForeignKey('polit_group.id'), nullable=False)
+    since = Column(Date) # NULL since the beginning
+    until = Column(Date) # excluded, NULL until now
+
 class ParlMembVoting(BaseMixin, Base):
+    """Vote of a parliament member, partitioned by term on PostgreSQL (see psp_cz.partitions)"""
     __tablename__ = 'parl_memb_voting'
     __table_args__ = (
+                      # serves lookups by parl_memb_id as well
                       UniqueConstraint('parl_memb_id', 'voting_id'),
-                      Index('ix_pmv_parl_memb_id', 'parl_memb_id'),
                       Index('ix_pmv_voting_id', 'voting_id'),
                       )
 
     vote = Column(String(1), nullable=False)
     parl_memb_id = Column(Integer, ForeignKey('parl_memb.id'), nullable=False)
     voting_id = Column(Integer, ForeignKey('voting.id'), nullable=False)
+    term = Column(Integer, nullable=False) # term of the voting
+
+class VotingVotes(BaseMixin, Base):
+    """Votes of all parliament members in a voting packed by psp_cz.votes"""
+    __tablename__ = 'voting_votes'
+    __table_args__ = (
+                      UniqueConstraint('voting_id'),
+                      Index('ix_vv_term', 'term'),
+                      )
+
+    voting_id = Column(Integer, ForeignKey('voting.id'), nullable=False)
+    term = Column(Integer, nullable=False)
+    votes = Column(LargeBinary, nullable=False) # vote code per slot of TermMembSlot
+
+class TermMembSlot(BaseMixin, Base):
+    """Position of parliament member's vote in VotingVotes of the term"""
+    __tablename__ = 'term_memb_slot'
+    __table_args__ = (
+                      UniqueConstraint('term', 'slot'),
+                      UniqueConstraint('term', 'parl_memb_id'),
+                      )
+
+    term = Column(Integer, nullable=False)
+    slot = Column(Integer, nullable=False)
+    parl_memb_id = Column(Integer, ForeignKey('parl_memb.id'), nullable=False)
+
+class VotingTally(BaseMixin, Base):
+    """Number of votes of each kind in a voting (see psp_cz.aggregates)"""
+    __tablename__ = 'voting_tally'
+    __table_args__ = (
+                      UniqueConstraint('voting_id', 'vote'),
+                      )
+
+    voting_id = Column(Integer, ForeignKey('voting.id'), nullable=False)
+    vote = Column(String(1), nullable=False)
+    count = Column(Integer, nullable=False)
+
+class ParlMembTermTally(BaseMixin, Base):
+    """Number of votes of each kind of parliament member in a term"""
+    __tablename__ = 'parl_memb_term_tally'
+    __table_args__ = (
+                      UniqueConstraint('parl_memb_id', 'term', 'vote'),
+                      )
+
+    parl_memb_id = Column(Integer, ForeignKey('parl_memb.id'), nullable=False)
+    term = Column(Integer, nullable=False)
+    vote = Column(String(1), nullable=False)
+    count = Column(Integer, nullable=False)
+
+class PolitGroupVotingTally(BaseMixin, Base):
+    """Number of votes of each kind of political group members (see PolitGroupMemb) in a voting"""
+    __tablename__ = 'polit_group_voting_tally'
+    __table_args__ = (
+                      UniqueConstraint('voting_id', 'polit_group_id', 'vote'),
+                      )
+
+    polit_group_id = Column(Integer, ForeignKey('polit_group.id'), nullable=False)
+    voting_id = Column(Integer, ForeignKey('voting.id'), nullable=False)
+    vote = Column(String(1), nullable=False)
+    count = Column(Integer, nullable=False)
 
 class Region(BaseMixin, Base):
     __tablename__ = 'region'
@@ -104,3 +186,17 @@ class PolitGroup(BaseMixin, Base):
     url = Column(String(4000), unique=True, nullable=False)
 
     parlMembs = relationship('ParlMemb', backref='polit_group')
+
+class ChangeLog(BaseMixin, Base):
+    """Inserted and changed row of a crawled table (see psp_cz.changelog)"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+                      Index('ix_cl_run_id', 'run_id'),
+                      Index('ix_cl_table_row', 'table_name', 'row_id'),
+                      )
+
+    run_id = Column(String(100), nullable=False)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String(1), nullable=False) # 'I' insert, 'U' update
+    changed = Column(Text, nullable=False) # JSON object with new values of changed columns
@@ -11,11 +11,97 @@ BOT_NAME = 'psp_cz'
 
 SPIDER_MODULES = ['psp_cz.spiders']
 NEWSPIDER_MODULE = 'psp_cz.spiders'
+COMMANDS_MODULE = 'psp_cz.commands'
 DEFAULT_ITEM_CLASS = 'scrapy.item.Item'
-ITEM_PIPELINES = ['scrapy.contrib.pipeline.images.ImagesPipeline', 'psp_cz.pipelines.DBStorePipeline']
+ITEM_PIPELINES = ['psp_cz.images.CachedImagesPipeline', 'psp_cz.pipelines.DBStorePipeline']
+EXTENSIONS = {
+    'psp_cz.extensions.MetricsExtension': 500,
+}
+DOWNLOADER_MIDDLEWARES = {
+    'psp_cz.pagecache.PageCacheMiddleware': 580,
+    'psp_cz.archive.ResponseArchiveMiddleware': 950,
+}
+SPIDER_MIDDLEWARES = {
+    'psp_cz.pagecache.PageCacheSpiderMiddleware': 950,
+}
 WEBSERVICE_ENABLED = False
 TELNETCONSOLE_ENABLED = False
-IMAGES_STORE = os.environ['IMAGES_STORE']
+# images pipeline is disabled when IMAGES_STORE is not set
+IMAGES_STORE = os.environ.get('IMAGES_STORE')
 IMAGES_THUMBS = {
     'small': (50, 50),
 }
+# validators and content hashes of downloaded images (see
+# psp_cz.images.CachedImagesPipeline), IMAGES_STORE/image_cache.json if None
+IMAGES_CACHE_FILE = None
+
+# database url, the database is connected when a crawl or a command needs it
+DATABASE_URL = os.environ.get('DATABASE_URL')
+# connection pool of the database (not used by SQLite) - size, overflow above
+# the size, seconds after which connections are replaced and whether
+# connections are checked before they are used
+DB_POOL_SIZE = 5
+DB_POOL_MAX_OVERFLOW = 10
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = True
+# number of compiled statements cached by the engine
+DB_STATEMENT_CACHE_SIZE = 500
+
+# responses are recorded into an archive in ARCHIVE_DIR when it is set (see
+# psp_cz.archive), ARCHIVE_REPLAY (archive files or directories with archives)
+# replays recorded responses instead of downloading them - see scrapy replay
+ARCHIVE_DIR = None
+ARCHIVE_REPLAY = None
+ARCHIVE_COMPRESS_LEVEL = 6
+
+# discovery pages of the spiders (see psp_cz.pagecache) are requested
+# conditionally and callbacks of unchanged ones are skipped when PAGE_CACHE_FILE
+# is set (%(name)s is replaced by the spider name)
+PAGE_CACHE_FILE = None
+
+# pages with votings and votes are parsed in PARSE_POOL_WORKERS worker
+# processes (0 parses them in the crawl process, -1 starts a worker per CPU),
+# at most PARSE_POOL_MAX_PENDING pages are sent to the workers at once
+PARSE_POOL_WORKERS = 0
+PARSE_POOL_MAX_PENDING = 64
+
+# DBStorePipeline writes items in batches - a batch is stored when it reaches
+# DB_BATCH_SIZE items or when DB_BATCH_TIMEOUT seconds elapsed since the last
+# write
+DB_BATCH_SIZE = 500
+DB_BATCH_TIMEOUT = 10
+# number of cached natural key to id mappings per entity type
+DB_CACHE_SIZE = 10000
+# how to treat votes which are already stored - 'ignore' keeps them, 'update'
+# overwrites them (and stored votings) with the crawled ones
+DB_VOTE_CONFLICT = 'ignore'
+# number of times a batch which failed on a conflict with another writer (e.g.
+# parallel replay workers) is written again
+DB_FLUSH_RETRIES = 3
+# maximum number of items waiting for the database writer thread
+DB_WRITER_QUEUE_SIZE = 1000
+# update summary tables of votes (see psp_cz.aggregates) together with votes
+DB_AGGREGATES = True
+# record inserted and changed rows into change_log table (see psp_cz.changelog)
+DB_CHANGE_LOG = True
+# directory where DuplicatesPipeline keeps fingerprints of items stored in the
+# database between runs (None keeps them in memory only) and size in bits of the Bloom filter in
+# front of the fingerprint table (0 disables the filter)
+DUPEFILTER_ITEMS_DIR = None
+DUPEFILTER_ITEMS_BLOOM_BITS = 0
+# how votes of parliament members are stored - 'rows' (a ParlMembVoting row
+# per vote), 'packed' (a VotingVotes row per voting, see psp_cz.votes) or
+# 'both'
+VOTE_STORAGE = 'rows'
+# ExportPipeline writes items into EXPORT_DIR in EXPORT_FORMAT ('jsonl' or
+# 'csv'), every file is gzip compressed and holds at most EXPORT_FILE_RECORDS
+# records; records are compressed in chunks of EXPORT_BUFFER_SIZE bytes
+EXPORT_DIR = None
+EXPORT_FORMAT = 'jsonl'
+EXPORT_FILE_RECORDS = 1000000
+EXPORT_BUFFER_SIZE = 1048576
+# timing of callbacks, pipelines and SQL statements (see psp_cz.metrics) is
+# stored into the stats and, if METRICS_REPORT is set, into JSON file at the
+# path (%(name)s is replaced by the spider name)
+METRICS_ENABLED = True
+METRICS_REPORT = None
@@ -10,7 +10,8 @@ from scrapy.utils.response import get_base_url
 from scrapy.utils.url import urljoin_rfc
 
 from psp_cz.items import ParlMemb
-from .psp_cz_spider import get_parl_memb_id
+from psp_cz.parsers import get_parl_memb_id
+from psp_cz.metrics import timed_callback
 
 class PoslanciPspCzSpider(CrawlSpider):
     """ Spider crawls the psp.cz and gets information about parliament members """
@@ -21,12 +22,19 @@ class PoslanciPspCzSpider(CrawlSpider):
     start_urls = [
         "http://www.psp.cz/sqw/organy2.sqw?k=1"
     ]
+    # discovery pages cached with PAGE_CACHE_FILE setting (see
+    # psp_cz.pagecache) - members of unchanged groups are not downloaded again
+    cached_pages = (
+        (r'organy2\.sqw\?k=1$', True),
+        (r'snem\.sqw\?.*id=', True),
+    )
 
     rules = (
         # follow links to parliamentary political groups
         Rule(SgmlLinkExtractor(allow=('\/snem.sqw\?.*id\=',)), callback='parse_parl_polit_groups', follow=False),
     )
 
+    @timed_callback
     def parse_parl_polit_groups(self, response):
         """ Parses parliament political groups """
 
@@ -60,6 +68,7 @@ class PoslanciPspCzSpider(CrawlSpider):
 
 
     # this callback just adds sitting info to requests and follows links
+    @timed_callback
     def parse_parl_memb(self, response):
         """ Parses parliament member info """
 
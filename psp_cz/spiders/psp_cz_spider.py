@@ -1,23 +1,23 @@
 # coding=utf-8
-import re
 
-from datetime import datetime
+from scrapy import signals, log
 from scrapy.contrib.spiders import CrawlSpider, Rule
 from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
 from scrapy.http import Request
+from scrapy.exceptions import DontCloseSpider
 from scrapy.selector import HtmlXPathSelector
 from scrapy.utils.response import get_base_url
 from scrapy.utils.url import urljoin_rfc
 
-from psp_cz.database import db_session
-from psp_cz.items import ParlMembVote, Voting, Sitting
+from psp_cz.database import init_db, create_session
+from psp_cz.database import configure as configure_db
+from psp_cz.items import ParlMembVote, Voting, Sitting, SittingProgress, VotingProgress
 from psp_cz.psp_cz_models import Sitting as TSitting
-
-def get_parl_memb_id(url):
-    match = re.search('id=([0-9]+)', url)
-    if match:
-        return int(match.group(1))
-
+from psp_cz.urls import get_sitting_numbers, votings_page_url
+from psp_cz.parsers import parse_parl_memb_votes, parse_votings_page, get_votings_pages_count
+from psp_cz.parse_pool import ParsePool
+from psp_cz.progress import get_complete_sitting_urls, get_complete_voting_urls
+from psp_cz.metrics import timed_callback
 
 class PspCzSpider(CrawlSpider):
     """
@@ -26,7 +26,8 @@ class PspCzSpider(CrawlSpider):
     about voting of each parliament member.
 
     Spider accepts following parameters:
-        mode - values 'incremental' or 'full'. Incremental is the default.
+        mode - values 'incremental', 'full' or 'reparse'. Incremental is the
+            default.
             Completely parses the information from psp.cz. For incremental mode
             there are 2 possible run options - either parameters from_term and
             from_sitting are specified and then parsing starts at the sitting
@@ -34,12 +35,32 @@ class PspCzSpider(CrawlSpider):
              from_sitting is not specified then spider gets the latest parsed
              sitting from the database and starts with this sitting (the latest
              sitting from the database is crawled again to make sure that the
-             previously fetched information is complete).
+             previously fetched information is complete). Older sittings which
+             are not complete in the database are crawled as well.
+            In both modes complete sittings and votings (see psp_cz.progress)
+            are not downloaded again except for the latest sitting in the
+            database which may continue. Run the spider with JOBDIR setting to
+            keep pending requests when the crawl is interrupted.
+            Reparse mode parses all sittings and votings including the
+            complete ones - it is used to parse recorded responses again (see
+            scrapy replay command).
         from_term - term of parliament. Applicable only if mode=incremental and
             from_sitting parameter is also specified
         from_sitting - sitting number we should start at with parsing. It is
             applicable only for incremental mode and from_term parameter
             specified.
+        scheduling - values 'depth' or 'breadth'. Depth is the default.
+            Depth first scheduling downloads pages with votes of parliament
+            members before further pages with lists of votings and sittings
+            so that the number of pending requests (and memory) does not grow
+            with the number of crawled sittings. Older sittings are finished
+            first. Breadth leaves the order to the scheduler.
+        shard - 'k/n', the spider parses only sittings whose number modulo n
+            is k. Used by parallel workers of the replay command.
+
+    Pages with votings and votes are parsed in PARSE_POOL_WORKERS worker
+    processes (see psp_cz.parse_pool) when the setting is not 0, at most
+    PARSE_POOL_MAX_PENDING pages at once.
 
     """
     name = "psp.cz"
@@ -48,8 +69,21 @@ class PspCzSpider(CrawlSpider):
         "http://www.psp.cz/sqw/hp.sqw?k=27",
         "http://www.psp.cz/sqw/hlasovani.sqw?zvo=1"
     ]
-    # restriction not to parse all data over and over again
-    SITTING_URL_SORT_REGEXP = r'o=([:0-9:]+)\&s=([:0-9:]+)'
+    # discovery pages cached with PAGE_CACHE_FILE setting (see
+    # psp_cz.pagecache) - url pattern, whether the callback is skipped when
+    # the page did not change
+    cached_pages = (
+        (r'hp\.sqw\?k=27$', True),
+        (r'hlasovani\.sqw\?zvo=1$', True),
+        # the latest sitting may continue although the list of sittings did
+        # not change
+        (r'hlasovani\.sqw$', False),
+    )
+    # page levels used by depth first scheduling - the deeper level the higher
+    # request priority (see request_priority)
+    SITTING_LEVEL = 1
+    VOTINGS_LEVEL = 2
+    VOTING_LEVEL = 3
 
     rules = (
         # extract sittings
@@ -59,30 +93,124 @@ class PspCzSpider(CrawlSpider):
     def __init__(self, *a, **kw):
         super(PspCzSpider, self).__init__(*a, **kw)
 
-        if kw.get('mode', None) in ['full', 'incremental']:
+        if kw.get('scheduling', None) in ['depth', 'breadth']:
+            self.scheduling = kw['scheduling']
+        else:
+            self.scheduling = 'depth'
+
+        if kw.get('mode', None) in ['full', 'incremental', 'reparse']:
             self.mode = kw['mode']
         else:
             self.mode = 'incremental'
 
-        if self.mode == 'incremental':
-            from_sitting = kw.get('from_sitting', None)
-            from_term = kw.get('from_term', None)
-            if not from_sitting or not from_term:
-                # get the latest Sitting urls from the database
-                db_sitting_urls = db_session.query(TSitting.url).all()
-
-                if db_sitting_urls:
-                    # sort the list
-                    db_sitting_urls.sort(key=lambda x: map(int, re.findall(self.SITTING_URL_SORT_REGEXP, x[0])[0]))
-                    latest_db_sitting_url = db_sitting_urls[-1][0]
-                    self.log('Latest URL in DB is ' + latest_db_sitting_url)
-                    self.start_from = map(int, re.findall(self.SITTING_URL_SORT_REGEXP, latest_db_sitting_url)[0])
-                else:
-                    # no starting point specified and no sitting record in DB - switch to 'full' mode
-                    self.mode = 'full'
+        self.start_from = None
+        if kw.get('from_sitting', None) and kw.get('from_term', None):
+            self.start_from = (int(kw['from_term']), int(kw['from_sitting']))
+
+        self.shard = None
+        if kw.get('shard', None):
+            self.shard = tuple(int(n) for n in kw['shard'].split('/'))
+
+        # the database is queried when the crawl starts, see spider_opened
+        self.session = None
+        self.stored_sittings = set()
+        self.complete_sittings = set()
+        self.complete_votings = set()
+        self.parse_pool = None
+
+    def set_crawler(self, crawler):
+        super(PspCzSpider, self).set_crawler(crawler)
+        workers = crawler.settings.getint('PARSE_POOL_WORKERS', 0)
+        if workers:
+            # worker processes are forked before the crawl starts its threads
+            self.parse_pool = ParsePool(workers if workers > 0 else None,
+                                        crawler.settings.getint('PARSE_POOL_MAX_PENDING', 64))
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+
+    def spider_opened(self, spider):
+        if spider is not self:
+            return
+        configure_db(self.settings)
+        # make sure the schema is up to date before it is queried
+        init_db()
+        self.session = create_session()
+        try:
+            self.load_db_state()
+        finally:
+            # do not keep the transaction open during the crawl
+            self.session.commit()
+
+    def spider_closed(self, spider):
+        if spider is not self:
+            return
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+            self.parse_pool = None
+
+    def spider_idle(self, spider):
+        """
+        Pages of votings still pending when nothing is left to crawl failed to
+        download - their sittings fall back to the sitting page or are given up
+        (see votings_pages_failed).
+
+        """
+        if spider is not self:
+            return
+        requests = []
+        for sitting_url in sorted(self.state.get('sitting_pages', {})):
+            requests.extend(self.votings_pages_failed(sitting_url, 'Pages of votings not downloaded'))
+        for request in requests:
+            self.crawler.engine.crawl(request, self)
+        if requests:
+            raise DontCloseSpider
+
+    def load_db_state(self):
+        """Loads the starting point and complete sittings and votings from the database"""
+        # get the latest Sitting from the database
+        latest_db_sitting = self.session.query(TSitting.url, TSitting.term, TSitting.sitting_no) \
+                                        .order_by(TSitting.term.desc(), TSitting.sitting_no.desc()) \
+                                        .first()
+
+        if self.mode == 'incremental' and self.start_from is None:
+            if latest_db_sitting:
+                self.log('Latest sitting in DB is %d/%d' % tuple(latest_db_sitting[1:]))
+                self.start_from = tuple(latest_db_sitting[1:])
             else:
-                self.start_from = [int(from_term), int(from_sitting)]
+                # no starting point specified and no sitting record in DB - switch to 'full' mode
+                self.mode = 'full'
+
+        if self.mode == 'reparse':
+            # everything is parsed again
+            return
 
+        # urls of stored sittings, of sittings and votings with all votes
+        # stored - the latest sitting may continue, it is never complete
+        self.stored_sittings = set(url for url, in self.session.query(TSitting.url))
+        self.complete_sittings = get_complete_sitting_urls(self.session)
+        if latest_db_sitting:
+            self.complete_sittings.discard(latest_db_sitting[0])
+        self.complete_votings = get_complete_voting_urls(self.session)
+        self.log('%d complete sittings and %d complete votings found in DB' %
+                 (len(self.complete_sittings), len(self.complete_votings)))
+
+    def request_priority(self, level, term, sitting_no):
+        """
+        Priority of request to a page of level belonging to the sitting. Pages
+        of deeper levels go first, pages of the same level are ordered by
+        sitting. Priorities are coarse on purpose - the scheduler keeps a queue
+        per priority.
+
+        """
+        if self.scheduling != 'depth':
+            return 0
+        return level * 100000 - (term * 1000 + sitting_no)
+
+    @timed_callback
     def parse_sittings(self, response):
         """ Parses parliament sittings at the current season """
 
@@ -97,14 +225,38 @@ class PspCzSpider(CrawlSpider):
             sitting['url'] = urljoin_rfc(base_url, relative_url)
             sitting['id'] = sitting['url']
             sitting['name'] = sitting_link.select('a/text()').extract()[0]
+            sitting['term'], sitting['sitting_no'] = get_sitting_numbers(sitting['url'])
+
+            # sitting belongs to another worker
+            if self.shard and sitting['sitting_no'] % self.shard[1] != self.shard[0]:
+                continue
+
+            # sitting and all its votings are already stored
+            if sitting['url'] in self.complete_sittings:
+                self.log('SKIP ' + sitting['url'])
+                continue
 
             # to optimize speed start downloading only from latest sitting stored in DB
-            if self.mode == 'full' or \
-                    map(int, re.findall(self.SITTING_URL_SORT_REGEXP, sitting['url'])[0]) >= self.start_from:
+            # (and continue incomplete sittings)
+            if self.mode in ('full', 'reparse') or sitting['url'] in self.stored_sittings or \
+                    (sitting['term'], sitting['sitting_no']) >= self.start_from:
                 self.log('PARSE ' + sitting['url'])
                 yield sitting
 
-                request = Request(sitting['url'], self.proceed_to_votings, meta={'sitting':sitting})
+                # the first page of votings is requested directly, it links
+                # the other pages; the sitting page is used when they fail
+                page = votings_page_url(sitting['term'], sitting['sitting_no'])
+                self.state.setdefault('sitting_pages', {})[sitting['url']] = {'pages': set([page]),
+                                                                              'votings': set()}
+                request = Request(page, self.parse_votings,
+                                  meta={'sitting_url': sitting['url'],
+                                        'term': sitting['term'],
+                                        'sitting_no': sitting['sitting_no'],
+                                        'votings_page': page,
+                                        'first_page': True,
+                                        'handle_httpstatus_all': True},
+                                  priority=self.request_priority(self.VOTINGS_LEVEL, sitting['term'],
+                                                                 sitting['sitting_no']))
                 yield request
 
             else:
@@ -112,86 +264,218 @@ class PspCzSpider(CrawlSpider):
 
 
     # this callback just adds sitting info to requests and follows links
+    @timed_callback
     def proceed_to_votings(self, response):
-        """ Navigates from more descriptive page about votings to voting table """
+        """
+        Navigates from more descriptive page about votings to voting table.
+        Used when pages of votings requested directly failed (see
+        votings_pages_failed).
+
+        """
 
         hxs = HtmlXPathSelector(response)
         base_url = get_base_url(response)
 
-        if 'sitting' in response.meta:
-            sitting = response.meta['sitting']
-        else:
+        if 'sitting_url' not in response.meta:
             self.log('Error: SITTING parameter not found! %s' % response.url)
             return
 
-        voting_links = hxs.select('//@href').re(r'phlasa\.sqw.*')
-
-        for voting_link in voting_links:
-            request = Request(urljoin_rfc(base_url, voting_link),
+        # sitting is referred by its url and numbers only, the item itself is
+        # not passed along so that pending requests stay small
+        meta = dict((key, response.meta[key]) for key in ('sitting_url', 'term', 'sitting_no'))
+        priority = self.request_priority(self.VOTINGS_LEVEL, meta['term'], meta['sitting_no'])
+
+        pages = set(urljoin_rfc(base_url, voting_link)
+                    for voting_link in hxs.select('//@href').re(r'phlasa\.sqw.*'))
+
+        # votings of the sitting are collected as its pages are parsed (the
+        # same votings may be listed on several pages); pending pages are part
+        # of the spider state kept in JOBDIR
+        self.state.setdefault('sitting_pages', {})[meta['sitting_url']] = {'pages': pages,
+                                                                           'votings': set(),
+                                                                           'sitting_page': True}
+        if not pages:
+            for item in self.sitting_page_parsed(meta['sitting_url'], None, []):
+                yield item
+
+        for page in sorted(pages):
+            # the page may be requested already by its url built by the spider
+            request = Request(page,
                               self.parse_votings,
-                              meta={'sitting':sitting})
+                              meta=dict(meta, votings_page=page, handle_httpstatus_all=True),
+                              priority=priority,
+                              dont_filter=True)
             yield request
 
 
+    def parse_page(self, parser, response, callback):
+        """
+        Parses the page by parser function of psp_cz.parsers and returns
+        callback(response, records). The page is parsed in the parse pool when
+        it is enabled - Deferred which fires with the result is returned then.
+
+        """
+        if self.parse_pool is None:
+            return callback(response, parser(response.body, response.encoding, response.url))
+        dfd = self.parse_pool.parse(parser, response.body, response.encoding, response.url)
+        dfd.addCallback(lambda records: callback(response, records))
+        return dfd
+
+    @timed_callback
     def parse_votings(self, response):
         """ Parses votings from given parliament sitting """
 
-        hxs = HtmlXPathSelector(response)
-
-        base_url = get_base_url(response)
-        if 'sitting' in response.meta:
-            sitting = response.meta['sitting']
-        else:
+        if 'sitting_url' not in response.meta:
             self.log('Error: SITTING parameter not found! %s' % response.url)
             return
+        # pages of votings are requested with all statuses, error pages are
+        # not parsed
+        if response.status != 200:
+            return self.votings_page_failed(response)
+        return self.parse_page(parse_votings_page, response, self.votings_parsed)
+
+    def votings_parsed(self, response, records):
+        sitting_url = response.meta['sitting_url']
+        if not records:
+            for request in self.votings_page_failed(response):
+                yield request
+            return
+        if response.meta.get('first_page'):
+            for request in self.request_votings_pages(response):
+                yield request
+
+        priority = self.request_priority(self.VOTING_LEVEL, response.meta['term'],
+                                         response.meta['sitting_no'])
+        voting_urls = []
+
+        for record in records:
+            voting_urls.append(record.url)
 
-        voting_links = hxs.select('//*[@id="main-content"]/div[1]/center/table/tr[position()>1]')
+            # voting and its votes are already stored
+            if record.url in self.complete_votings:
+                self.log('SKIP ' + record.url)
+                continue
 
-        for voting_link in voting_links:
             voting = Voting()
-            relative_url = voting_link.select('td[2]/a/@href').extract()[0]
-            voting['url'] = urljoin_rfc(base_url, relative_url)
+            voting['url'] = record.url
             voting['id'] = voting['url']
-            voting['voting_nr'] = int(voting_link.select('td[2]/a/text()').extract()[0])
-            voting['name'] = voting_link.select('td[4]/node()').extract()[0]
-            if voting_link.select('td[5]/a/text()'):
-                date_text = voting_link.select('td[5]/a/text()').extract()[0].replace(u'\xa0', '')
-                voting['voting_date'] = datetime.strptime(date_text, '%d.%m.%Y')
-                voting['minutes_url'] = voting_link.select('td[5]/a/@href').extract()[0]
-            else:
-                date_text = voting_link.select('td[5]/text()').extract()[0].replace(u'\xa0', '')
-                voting['voting_date'] = datetime.strptime(date_text, '%d.%m.%Y')
-                voting['minutes_url'] = None
-            voting['result'] = voting_link.select('td[6]/text()').extract()[0]
-            voting['sitting'] = sitting
+            voting['voting_nr'] = record.voting_nr
+            voting['name'] = record.name
+            voting['voting_date'] = record.voting_date
+            voting['minutes_url'] = record.minutes_url
+            voting['result'] = record.result
+            voting['sitting_url'] = sitting_url
+            voting['term'] = response.meta['term']
             yield voting
 
-            request = Request(voting['url'], self.parse_parl_memb_votes, meta={'voting':voting})
+            request = Request(voting['url'], self.parse_parl_memb_votes,
+                              meta={'voting_url': voting['url']},
+                              priority=priority)
             yield request
 
+        for item in self.sitting_page_parsed(sitting_url, response.meta.get('votings_page'),
+                                             voting_urls):
+            yield item
+
+    def votings_page_failed(self, response):
+        return self.votings_pages_failed(response.meta['sitting_url'],
+                                         'No votings at %s (%d)' % (response.url, response.status))
+
+    def votings_pages_failed(self, sitting_url, reason):
+        """
+        Requests the sitting page to find pages of votings of the sitting when
+        some of them failed. When pages found at the sitting page fail as well
+        the sitting is given up - it stays incomplete and is crawled again
+        next time.
+
+        """
+        sitting_pages = self.state.get('sitting_pages', {})
+        progress = sitting_pages.get(sitting_url)
+        if progress is None:
+            return
+        if progress.get('sitting_page'):
+            self.log('%s, sitting %s stays incomplete' % (reason, sitting_url), level=log.WARNING)
+            del sitting_pages[sitting_url]
+            return
 
+        self.log('%s, looking for votings at the sitting page %s' % (reason, sitting_url),
+                 level=log.WARNING)
+        progress['sitting_page'] = True
+        term, sitting_no = get_sitting_numbers(sitting_url)
+        yield Request(sitting_url, self.proceed_to_votings,
+                      meta={'sitting_url': sitting_url,
+                            'term': term,
+                            'sitting_no': sitting_no},
+                      priority=self.request_priority(self.SITTING_LEVEL, term, sitting_no),
+                      dont_filter=True)
+
+    def request_votings_pages(self, response):
+        """Requests further pages of votings linked from the first page"""
+        meta = dict((key, response.meta[key]) for key in ('sitting_url', 'term', 'sitting_no'))
+        priority = self.request_priority(self.VOTINGS_LEVEL, meta['term'], meta['sitting_no'])
+        progress = self.state.get('sitting_pages', {}).get(meta['sitting_url'])
+
+        for page_no in xrange(2, get_votings_pages_count(response.body) + 1):
+            page = votings_page_url(meta['term'], meta['sitting_no'], page_no)
+            if progress is not None:
+                progress['pages'].add(page)
+            yield Request(page,
+                          self.parse_votings,
+                          meta=dict(meta, votings_page=page, handle_httpstatus_all=True),
+                          priority=priority)
+
+    def sitting_page_parsed(self, sitting_url, page, voting_urls):
+        """
+        Collects voting urls of a parsed page of the sitting. Yields
+        SittingProgress item when all pages of the sitting were parsed.
+
+        """
+        sitting_pages = self.state.get('sitting_pages', {})
+        progress = sitting_pages.get(sitting_url)
+        if progress is None:
+            return
+        progress['pages'].discard(page)
+        progress['votings'].update(voting_urls)
+        if not progress['pages']:
+            del sitting_pages[sitting_url]
+            sitting_progress = SittingProgress()
+            sitting_progress['url'] = sitting_url
+            sitting_progress['id'] = sitting_url + '|progress'
+            sitting_progress['votings_expected'] = len(progress['votings'])
+            yield sitting_progress
+
+
+    @timed_callback
     def parse_parl_memb_votes(self, response):
         """ Parses votes of individual members of parliament """
 
-        hxs = HtmlXPathSelector(response)
-        base_url = get_base_url(response)
-        if 'voting' in response.meta:
-            voting = response.meta['voting']
-        else:
+        if 'voting_url' not in response.meta:
             self.log('Error: VOTING parameter not found! %s' % response.url)
             return
+        return self.parse_page(parse_parl_memb_votes, response, self.parl_memb_votes_parsed)
 
-        votings = hxs.select('//ul[@class="results"]//li')
-
-        for v in votings:
+    def parl_memb_votes_parsed(self, response, records):
+        voting_url = response.meta['voting_url']
+        for record in records:
             parl_memb_vote = ParlMembVote()
-            parl_memb_vote['vote'] = v.select('span/text()').extract()[0]
-            parl_memb_vote['parl_memb_name'] = v.select('a/text()').extract()[0]
-            relative_url = v.select('a/@href').extract()[0]
-            # remove &o=<number> parameter - it refers to tenure
-            relative_url = re.sub(r'\&o=[:0-9:]+', '', relative_url)
-            parl_memb_vote['parl_memb_url'] = urljoin_rfc(base_url, relative_url)
+            parl_memb_vote['vote'] = record.vote
+            parl_memb_vote['parl_memb_name'] = record.parl_memb_name
+            parl_memb_vote['parl_memb_url'] = record.parl_memb_url
             parl_memb_vote['id'] = response.url + '|' + parl_memb_vote['parl_memb_url']
-            parl_memb_vote['voting'] = voting
-            parl_memb_vote['parl_memb_id'] = get_parl_memb_id(parl_memb_vote['parl_memb_url'])
+            parl_memb_vote['voting_url'] = voting_url
+            parl_memb_vote['parl_memb_id'] = record.parl_memb_id
             yield parl_memb_vote
+
+        # a page without votes is broken (error or truncated page), the voting
+        # stays incomplete and is crawled again next time
+        if not records:
+            self.log('No votes at %s (%d)' % (response.url, response.status), level=log.WARNING)
+            return
+
+        # votes of the voting precede the progress item, so they are stored
+        # when it is
+        voting_progress = VotingProgress()
+        voting_progress['url'] = voting_url
+        voting_progress['id'] = voting_url + '|progress'
+        voting_progress['votes_expected'] = len(records)
+        yield voting_progress
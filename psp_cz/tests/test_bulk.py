@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Checks that duplicate votes of a batch are resolved the same way by all vote
+writers - unique_votes() removes them before COPY of PostgresVoteWriter.
+
+"""
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from psp_cz.database import Base
+from psp_cz.bulk import VoteWriter, SQLiteVoteWriter, unique_votes
+from psp_cz.psp_cz_models import ParlMembVoting as TParlMembVoting
+
+# the vote of member 1 in voting 1 is written three times
+ROWS = [{'vote': vote, 'parl_memb_id': 1, 'voting_id': voting_id, 'term': 6}
+        for voting_id, vote in ((1, u'A'), (1, u'N'), (2, u'Z'), (1, u'M'))]
+
+
+class UniqueVotesTest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(bind=engine)
+        self.session = Session(bind=engine)
+
+    def tearDown(self):
+        self.session.close()
+
+    def written(self, writer):
+        writer.write(self.session, ROWS, {1: {}, 2: {}})
+        votes = sorted((row.voting_id, row.vote) for row in self.session.query(TParlMembVoting))
+        self.session.rollback()
+        return votes
+
+    def unique(self, conflict):
+        return sorted((row['voting_id'], row['vote']) for row in unique_votes(ROWS, conflict))
+
+    def test_ignore(self):
+        self.assertEqual(self.unique('ignore'), [(1, u'A'), (2, u'Z')])
+        self.assertEqual(self.written(VoteWriter('ignore')), self.unique('ignore'))
+        self.assertEqual(self.written(SQLiteVoteWriter('ignore')), self.unique('ignore'))
+
+    def test_update(self):
+        self.assertEqual(self.unique('update'), [(1, u'M'), (2, u'Z')])
+        self.assertEqual(self.written(VoteWriter('update')), self.unique('update'))
+        self.assertEqual(self.written(SQLiteVoteWriter('update')), self.unique('update'))
+
+    def test_no_duplicates(self):
+        rows = ROWS[2:]
+        self.assertTrue(unique_votes(rows) is rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
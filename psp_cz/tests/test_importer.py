@@ -0,0 +1,219 @@
+# coding=utf-8
+"""
+Imports the small open data archives in fixtures (poslanci.zip and
+hl-2010ps.zip) into a temporary SQLite database and checks the stored rows.
+
+"""
+import os
+import tempfile
+import unittest
+from datetime import date
+
+from scrapy.settings import Settings
+
+from psp_cz.database import configure as configure_db
+from psp_cz.database import db_session
+from psp_cz.importer import ArchiveImporter, date_key
+from psp_cz.aggregates import change_polit_group, move_parl_memb_votes
+from psp_cz.aggregates import check_aggregates, rebuild_aggregates
+from psp_cz.urls import parl_memb_url, voting_url, organ_url
+from psp_cz.psp_cz_models import Sitting as TSitting
+from psp_cz.psp_cz_models import Voting as TVoting
+from psp_cz.psp_cz_models import ParlMemb as TParlMemb
+from psp_cz.psp_cz_models import ParlMembVoting as TParlMembVoting
+from psp_cz.psp_cz_models import PolitGroup as TPolitGroup
+from psp_cz.psp_cz_models import PolitGroupMemb as TPolitGroupMemb
+from psp_cz.psp_cz_models import PolitGroupVotingTally as TPolitGroupVotingTally
+from psp_cz.psp_cz_models import Region as TRegion
+from psp_cz.psp_cz_models import VotingTally as TVotingTally
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+ARCHIVES = [os.path.join(FIXTURES_DIR, 'hl-2010ps.zip'), os.path.join(FIXTURES_DIR, 'poslanci.zip')]
+
+# id_poslanec of hl2010h1.unl -> id_osoba of poslanec.unl
+PERSONS = {300: 5000, 301: 5001, 302: 5002}
+# flags of voting pages for vote codes A, B, N, C, K, F, @, W, M which are
+# assigned in turn to the votes of hl2010h1.unl
+VOTE_FLAGS = u'ANNZZX00M'
+
+_db_path = None
+
+
+def setUpModule():
+    global _db_path
+    fd, _db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    configure_db(Settings({'DATABASE_URL': 'sqlite:///%s' % _db_path}))
+    ArchiveImporter().import_archives(ARCHIVES)
+
+
+def tearDownModule():
+    db_session.remove()
+    os.remove(_db_path)
+
+
+def table_counts():
+    return dict((model.__name__, db_session.query(model).count())
+                for model in (TSitting, TVoting, TParlMemb, TParlMembVoting, TPolitGroup, TRegion,
+                              TPolitGroupMemb, TVotingTally))
+
+
+def get_group_votes():
+    """Returns dictionary of (voting url, political group url) -> number of votes"""
+    rows = db_session.query(TVoting.url, TPolitGroup.url, TPolitGroupVotingTally.count) \
+                     .join(TPolitGroupVotingTally, TPolitGroupVotingTally.voting_id == TVoting.id) \
+                     .join(TPolitGroup, TPolitGroup.id == TPolitGroupVotingTally.polit_group_id)
+    counts = {}
+    for voting, group, count in rows:
+        counts[(voting, group)] = counts.get((voting, group), 0) + count
+    return counts
+
+
+class DateKeyTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(date_key(u'01.06.2010'), (2010, 6, 1))
+        self.assertEqual(date_key(u'15.3.2012'), (2012, 3, 15))
+        self.assertEqual(date_key(u'2012-01-01 00'), (2012, 1, 1, 0))
+
+    def test_order(self):
+        self.assertTrue(date_key(u'2012-01-01 00') > date_key(u'01.06.2010'))
+        self.assertTrue(date_key(u'15.3.2012') > date_key(u'2012-03-01 00'))
+        self.assertTrue(date_key(u'01.06.2010') > date_key(u''))
+
+    def test_empty(self):
+        self.assertEqual(date_key(u''), ())
+        self.assertEqual(date_key(u'2012'), ())
+
+
+class ArchiveImporterTest(unittest.TestCase):
+
+    def get_votes(self):
+        rows = db_session.query(TParlMemb.psp_cz_id, TVoting.url, TParlMembVoting.vote) \
+                         .join(TParlMembVoting, TParlMembVoting.parl_memb_id == TParlMemb.id) \
+                         .join(TVoting, TVoting.id == TParlMembVoting.voting_id)
+        return dict(((psp_cz_id, url), vote) for psp_cz_id, url, vote in rows)
+
+    def test_parl_membs(self):
+        parl_membs = dict((m.psp_cz_id, m) for m in db_session.query(TParlMemb))
+        self.assertEqual(sorted(parl_membs), [5000, 5001, 5002])
+        bem = parl_membs[5000]
+        self.assertEqual(bem.url, parl_memb_url(5000))
+        self.assertEqual(bem.name, u'Bém Pavel')
+        self.assertEqual(bem.name_full, u'Ing. Pavel Bém')
+        self.assertEqual(bem.born, date(1963, 7, 18))
+        self.assertEqual(parl_membs[5001].gender, 'F')
+        self.assertEqual(parl_membs[5001].name_full, u'Žofie Šťastná Ph.D.')
+        self.assertEqual(parl_membs[5002].born, None)
+
+    def test_latest_polit_group(self):
+        groups = dict(db_session.query(TPolitGroup.id, TPolitGroup.url))
+        regions = dict(db_session.query(TRegion.id, TRegion.url))
+        parl_membs = dict((m.psp_cz_id, m) for m in db_session.query(TParlMemb))
+        # yyyy-mm-dd membership is newer than d.m.yyyy one and vice versa
+        self.assertEqual(groups[parl_membs[5000].polit_group_id], organ_url(1002))
+        self.assertEqual(groups[parl_membs[5001].polit_group_id], organ_url(1002))
+        # other functions than membership are ignored
+        self.assertEqual(groups[parl_membs[5002].polit_group_id], organ_url(1001))
+        self.assertEqual(regions[parl_membs[5001].region_id], organ_url(602))
+
+    def test_memberships(self):
+        rows = db_session.query(TParlMemb.psp_cz_id, TPolitGroupMemb.since, TPolitGroupMemb.until,
+                                TPolitGroup.url) \
+                         .join(TPolitGroupMemb, TPolitGroupMemb.parl_memb_id == TParlMemb.id) \
+                         .join(TPolitGroup, TPolitGroup.id == TPolitGroupMemb.polit_group_id) \
+                         .order_by(TParlMemb.psp_cz_id, TPolitGroupMemb.since)
+        self.assertEqual(rows.all(), [
+            # the last day of a membership is included in the archives
+            (5000, date(2010, 6, 1), date(2012, 2, 3), organ_url(1001)),
+            (5000, date(2012, 2, 3), None, organ_url(1002)),
+            # a membership ends when the next one starts
+            (5001, date(2011, 3, 1), date(2011, 3, 15), organ_url(1001)),
+            (5001, date(2011, 3, 15), None, organ_url(1002)),
+            (5002, date(2010, 6, 1), None, organ_url(1001)),
+        ])
+
+    def test_group_votes(self):
+        # votes are counted for the group of the member on the day of the voting
+        counts = get_group_votes()
+        self.assertEqual(counts[(voting_url(57001), organ_url(1001))], 2)
+        self.assertEqual(counts[(voting_url(57001), organ_url(1002))], 1)
+        self.assertEqual(counts[(voting_url(57002), organ_url(1001))], 1)
+        self.assertEqual(counts[(voting_url(57002), organ_url(1002))], 2)
+        self.assertEqual(check_aggregates(db_session), [])
+
+    def test_votings(self):
+        sittings = dict((s.sitting_no, s) for s in db_session.query(TSitting))
+        self.assertEqual(sorted(sittings), [1, 2])
+        self.assertEqual([sittings[1].term, sittings[2].term], [6, 6])
+        self.assertEqual([sittings[1].votings_expected, sittings[2].votings_expected], [2, 2])
+        votings = dict((v.url, v) for v in db_session.query(TVoting))
+        self.assertEqual(sorted(votings), [voting_url(57000 + v) for v in range(4)])
+        voting = votings[voting_url(57001)]
+        self.assertEqual(voting.name, u'Návrh zákona 1')
+        self.assertEqual(voting.result, u'Přijato')
+        self.assertEqual(voting.voting_date, date(2012, 2, 2))
+        self.assertEqual(votings[voting_url(57000)].result, u'Zamítnuto')
+
+    def test_vote_codes(self):
+        votes = self.get_votes()
+        expected = {}
+        for v in range(4):
+            for i in range(3):
+                expected[(PERSONS[300 + i], voting_url(57000 + v))] = VOTE_FLAGS[(3 * v + i) % 9]
+        self.assertEqual(votes, expected)
+
+    def test_skipped_votes(self):
+        # votes of unknown parliament member 399 and of voting 57999 missing
+        # in the votings file are not imported
+        self.assertEqual(db_session.query(TParlMembVoting).count(), 12)
+        self.assertEqual(db_session.query(TVoting).filter_by(url=voting_url(57999)).count(), 0)
+
+    def test_votes_expected(self):
+        # skipped votes are not expected, the votings are complete
+        for voting in db_session.query(TVoting):
+            self.assertEqual((voting.votes_expected, voting.votes_stored), (3, 3), voting.url)
+        for sitting in db_session.query(TSitting):
+            self.assertEqual(sitting.votings_stored, 2)
+
+    def test_reimport(self):
+        counts = table_counts()
+        votes = self.get_votes()
+        ArchiveImporter().import_archives(ARCHIVES)
+        self.assertEqual(table_counts(), counts)
+        self.assertEqual(self.get_votes(), votes)
+
+
+class GroupChangeTest(unittest.TestCase):
+
+    def tearDown(self):
+        db_session.rollback()
+
+    def test_change(self):
+        parl_memb = db_session.query(TParlMemb).filter_by(psp_cz_id=5002).one()
+        cssd_id = db_session.query(TPolitGroup.id).filter_by(url=organ_url(1002)).scalar()
+        since = change_polit_group(db_session, parl_memb.id, cssd_id, date(2012, 2, 2))
+        self.assertEqual(since, date(2012, 2, 2))
+        move_parl_memb_votes(db_session, [(parl_memb.id, parl_memb.polit_group_id, cssd_id, since)])
+        # votes of earlier votings stay with the old group
+        counts = get_group_votes()
+        self.assertEqual(counts[(voting_url(57000), organ_url(1001))], 2)
+        self.assertEqual(counts[(voting_url(57001), organ_url(1001))], 1)
+        self.assertEqual(counts[(voting_url(57001), organ_url(1002))], 2)
+        self.assertEqual(check_aggregates(db_session), [])
+
+    def test_first_group(self):
+        # a member without membership is in the group since the beginning
+        parl_memb = db_session.query(TParlMemb).filter_by(psp_cz_id=5002).one()
+        cssd_id = db_session.query(TPolitGroup.id).filter_by(url=organ_url(1002)).scalar()
+        db_session.query(TPolitGroupMemb).filter_by(parl_memb_id=parl_memb.id).delete()
+        rebuild_aggregates(db_session)
+        since = change_polit_group(db_session, parl_memb.id, cssd_id, date(2012, 2, 2))
+        self.assertEqual(since, None)
+        move_parl_memb_votes(db_session, [(parl_memb.id, None, cssd_id, since)])
+        self.assertEqual(get_group_votes()[(voting_url(57000), organ_url(1002))], 2)
+        self.assertEqual(check_aggregates(db_session), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
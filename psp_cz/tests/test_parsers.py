@@ -0,0 +1,86 @@
+# coding=utf-8
+"""
+Checks psp_cz.parsers against the original HtmlXPathSelector based parsing of
+the spider (see benchmarks.parser_equivalence) on saved pages in fixtures.
+
+Run from the project directory: python -m unittest discover psp_cz/tests
+
+"""
+import os
+import unittest
+from datetime import datetime
+
+from scrapy.http import HtmlResponse
+
+from benchmarks.parser_equivalence import selector_parl_memb_votes
+from benchmarks.parser_equivalence import selector_votings
+from psp_cz.parsers import parse_parl_memb_votes, parse_votings_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+SITE_URL = 'http://www.psp.cz/sqw/'
+
+
+def fixture_response(name, url):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return HtmlResponse(url, body=f.read())
+
+
+class ParlMembVotesTest(unittest.TestCase):
+
+    def test_votes(self):
+        response = fixture_response('hlasy_57300.html', SITE_URL + 'hlasy.sqw?g=57300')
+        records = parse_parl_memb_votes(response.body, response.encoding, response.url)
+        self.assertEqual(records, selector_parl_memb_votes(response))
+        self.assertEqual([r.vote for r in records], [u'A', u'N', u'0', u'A', u'Z', u'M', u'N'])
+        self.assertEqual(records[2].parl_memb_name, u'Šťastný Žofie')
+        self.assertEqual(records[4].parl_memb_name, u'Ďurďová\xa0Ivana')
+        self.assertEqual(records[1].parl_memb_url, SITE_URL + 'detail.sqw?id=5953&l=cz')
+        self.assertEqual(records[5].parl_memb_url, SITE_URL + 'detail.sqw?id=6203')
+        self.assertEqual([r.parl_memb_id for r in records], [5462, 5953, 6150, 5271, 6201, 6203, 5009])
+
+    def test_base_href(self):
+        response = fixture_response('hlasy_57301.html', SITE_URL + 'hlasy.sqw?g=57301')
+        records = parse_parl_memb_votes(response.body, response.encoding, response.url)
+        self.assertEqual(records, selector_parl_memb_votes(response))
+        self.assertEqual(records[0].parl_memb_url, SITE_URL + 'detail.sqw?id=5462')
+        self.assertEqual(records[1].parl_memb_url, SITE_URL + 'detail.sqw?o=6&id=5953')
+        self.assertEqual(records[2].vote, u' A ')
+
+    def test_missing_vote(self):
+        # the spider failed on such a page before, it must not store u'None'
+        response = fixture_response('hlasy_57302.html', SITE_URL + 'hlasy.sqw?g=57302')
+        self.assertRaises(IndexError, selector_parl_memb_votes, response)
+        self.assertRaises(ValueError, parse_parl_memb_votes, response.body, response.encoding,
+                          response.url)
+
+    def test_missing_name(self):
+        body = '<ul class="results"><li><span>A</span><a href="detail.sqw?id=1"></a></li></ul>'
+        self.assertRaises(ValueError, parse_parl_memb_votes, body, 'utf-8', SITE_URL + 'hlasy.sqw?g=1')
+
+    def test_empty_page(self):
+        self.assertEqual(parse_parl_memb_votes('', 'utf-8', SITE_URL + 'hlasy.sqw?g=1'), [])
+        self.assertEqual(parse_parl_memb_votes(' \n', 'utf-8', SITE_URL + 'hlasy.sqw?g=1'), [])
+
+
+class VotingsPageTest(unittest.TestCase):
+
+    def test_votings(self):
+        response = fixture_response('phlasa_40.html', SITE_URL + 'phlasa.sqw?o=6&s=40')
+        records = parse_votings_page(response.body, response.encoding, response.url)
+        self.assertEqual([tuple(r) for r in records], selector_votings(response))
+        self.assertEqual([r.voting_nr for r in records], [1, 2, 3])
+        self.assertEqual(records[0].url, SITE_URL + 'hlasy.sqw?g=57300')
+        self.assertEqual(records[0].minutes_url, u'eknih/2010ps/stenprot/040schuz/s040001.htm#h1')
+        self.assertEqual(records[1].name,
+                         u'<a href="historie.sqw?o=6&amp;t=606">Vládní návrh zákona o účetnictví</a>')
+        self.assertEqual(records[2].name, u'Návrh na zamítnutí & vrácení')
+        self.assertEqual(records[2].voting_date, datetime(2012, 5, 16))
+        self.assertEqual(records[2].minutes_url, None)
+        self.assertEqual([r.result for r in records], [u'Přijato', u'Zamítnuto', u'Přijato'])
+
+    def test_empty_page(self):
+        self.assertEqual(parse_votings_page('', 'utf-8', SITE_URL + 'phlasa.sqw?o=6&s=40'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# coding=utf-8
+import re
+
+# term and sitting number in sitting url, e.g. hlasovani.sqw?o=6&s=40
+SITTING_URL_REGEXP = re.compile(r'o=([0-9]+)\&s=([0-9]+)')
+
+
+def get_sitting_numbers(url):
+    """Returns (term, sitting number) tuple parsed from sitting url"""
+    match = SITTING_URL_REGEXP.search(url)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+
+BASE_URL = 'http://www.psp.cz/sqw/'
+
+
+def sitting_url(term, sitting_no):
+    """Url of the sitting in the format used by the sittings page"""
+    return '%shlasovani.sqw?o=%d&s=%d' % (BASE_URL, term, sitting_no)
+
+
+def votings_page_url(term, sitting_no, page=1):
+    """Url of a page of the list of votings of the sitting"""
+    return '%sphlasa.sqw?o=%d&s=%d&pg=%d' % (BASE_URL, term, sitting_no, page)
+
+
+def voting_url(voting_id):
+    """Url of the page with votes of parliament members in one voting"""
+    return '%shlasy.sqw?g=%d' % (BASE_URL, voting_id)
+
+
+def parl_memb_url(psp_cz_id):
+    """Url of parliament member detail without the tenure parameter"""
+    return '%sdetail.sqw?id=%d' % (BASE_URL, psp_cz_id)
+
+
+def organ_url(organ_id):
+    """Url of parliament organ (political group, region)"""
+    return '%ssnem.sqw?id=%d' % (BASE_URL, organ_id)
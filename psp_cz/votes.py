@@ -0,0 +1,125 @@
+# coding=utf-8
+"""
+Packed storage of votes of parliament members.
+
+Instead of a ParlMembVoting row per member and voting, all votes of a voting
+are stored in a single VotingVotes row as a byte string - one byte per seat.
+Parliament members get a stable seat (slot) in every term (TermMembSlot), the
+byte at the slot position holds the code of the member's vote (see
+VOTE_CODES). Zero byte means there is no vote of the member in the voting.
+
+The VOTE_STORAGE setting selects whether votes are stored as rows, packed or
+both (see bulk.PackedVoteWriter). get_parl_memb_votes() and
+iter_parl_memb_votes() give per member votes of the packed storage in the
+same form ParlMembVoting rows have, iter_votes_of_parl_membs() all votes of
+given members.
+
+"""
+from scrapy import log
+
+from .psp_cz_models import VotingVotes as TVotingVotes
+from .psp_cz_models import TermMembSlot as TTermMembSlot
+
+# vote flags of the voting pages, code of the vote is its position
+VOTES = (None, u'A', u'N', u'Z', u'0', u'M', u'X', u'K')
+VOTE_CODES = dict((vote, code) for code, vote in enumerate(VOTES) if vote)
+
+
+def get_vote_code(vote):
+    try:
+        return VOTE_CODES[vote]
+    except KeyError:
+        raise ValueError('Unknown vote %r' % vote)
+
+
+def filter_known_votes(rows):
+    """
+    Returns vote rows (see bulk) whose votes have a code. Rows with unknown
+    votes cannot be packed, they are logged and skipped.
+
+    """
+    known = []
+    for row in rows:
+        if row['vote'] in VOTE_CODES:
+            known.append(row)
+        else:
+            log.msg('Unknown vote %r of parliament member %s in voting %s skipped' %
+                    (row['vote'], row['parl_memb_id'], row['voting_id']), level=log.WARNING)
+    return known
+
+
+def pack_votes(votes, size=0):
+    """Packs dictionary of slot -> vote into byte string"""
+    packed = bytearray(max([size] + [slot + 1 for slot in votes]))
+    for slot, vote in votes.iteritems():
+        packed[slot] = get_vote_code(vote)
+    return str(packed)
+
+
+def unpack_votes(packed):
+    """Returns dictionary of slot -> vote of packed votes"""
+    return dict((slot, VOTES[code]) for slot, code in enumerate(bytearray(packed)) if code)
+
+
+def count_votes(packed):
+    """Returns number of votes in packed votes"""
+    return len(packed) - str(packed).count('\0')
+
+
+def iter_parl_memb_votes(session, voting_ids=None):
+    """
+    Yields (voting id, parliament member id, vote) tuples of packed votes,
+    either of all votings or of votings with voting_ids.
+
+    """
+    query = session.query(TVotingVotes.voting_id, TVotingVotes.term, TVotingVotes.votes)
+    if voting_ids is not None:
+        if not voting_ids:
+            return
+        query = query.filter(TVotingVotes.voting_id.in_(voting_ids))
+
+    parl_memb_ids = {}
+    for voting_id, term, votes in query:
+        if term not in parl_memb_ids:
+            parl_memb_ids[term] = dict(session.query(TTermMembSlot.slot, TTermMembSlot.parl_memb_id)
+                                              .filter(TTermMembSlot.term == term))
+        term_parl_memb_ids = parl_memb_ids[term]
+        for slot, vote in unpack_votes(votes).iteritems():
+            yield voting_id, term_parl_memb_ids[slot], vote
+
+
+def iter_votes_of_parl_membs(session, parl_memb_ids):
+    """
+    Yields (voting id, parliament member id, vote) tuples of packed votes of
+    the parliament members in all votings.
+
+    """
+    if not parl_memb_ids:
+        return
+    # term -> {slot: parliament member id}
+    slots = {}
+    for term, slot, parl_memb_id in session.query(TTermMembSlot.term, TTermMembSlot.slot,
+                                                  TTermMembSlot.parl_memb_id) \
+                                           .filter(TTermMembSlot.parl_memb_id.in_(parl_memb_ids)):
+        slots.setdefault(term, {})[slot] = parl_memb_id
+
+    for term, term_slots in slots.iteritems():
+        for voting_id, votes in session.query(TVotingVotes.voting_id, TVotingVotes.votes) \
+                                       .filter(TVotingVotes.term == term):
+            codes = bytearray(votes)
+            for slot, parl_memb_id in term_slots.iteritems():
+                if slot < len(codes) and codes[slot]:
+                    yield voting_id, parl_memb_id, VOTES[codes[slot]]
+
+
+def get_parl_memb_votes(session, voting_ids):
+    """
+    Returns packed votes of votings as dictionary of voting id ->
+    {parliament member id: vote} (see bulk.get_stored_votes)
+
+    """
+    result = dict((voting_id, {}) for voting_id in voting_ids)
+    for voting_id, parl_memb_id, vote in iter_parl_memb_votes(session, result.keys()):
+        result[voting_id][parl_memb_id] = vote
+    return result
+